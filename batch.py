@@ -0,0 +1,285 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 16:45
+
+Headless batch scanning of image directories and video files.
+
+Scans all images in a directory (or the frames of video files) for codes
+using a process pool and streams the results as JSON lines:
+
+    {"file": ..., "frame": 0, "type": "DATAMATRIX_2D", "data": ..., "bounds": [[x, y], ...], "decode_ms": 12.3}
+
+Code data is decoded as latin-1, so the original bytes can be recovered
+with .encode("latin-1"). After all codes of a file (or chunk of video frames)
+a {"file": ..., "frames": [start, end], "done": true} record is written.
+When the output file already exists, units marked as done are skipped, so an
+interrupted run can simply be restarted with the same arguments.
+
+With --lookup, the part info of all found datamatrices is looked up as well
+and written as {"file": ..., "code": ..., "part_info": {...}} records, with the
+file the code was first found in. When resuming, codes of earlier runs without
+a part_info record (e.g. because the rate limit was exhausted) are looked up again.
+
+Usage:
+
+    python batch.py <directory or video files...> -o results.jsonl [--workers N] [--lookup]
+"""
+
+import argparse
+import concurrent.futures
+import dataclasses
+import json
+import os
+import time
+from pathlib import Path
+import cv2
+
+from src.scanner import Scanner, CodeResult
+
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp"}
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mkv", ".mov", ".webm", ".m4v"}
+DEFAULT_CHUNK_SIZE = 300    # video frames per unit of work
+
+
+@dataclasses.dataclass
+class ScannerOptions:
+    datamatrix: bool
+    barcode_128: bool
+    qr_code: bool
+    candidate_search: bool
+    roi_tracking: bool
+
+
+@dataclasses.dataclass
+class WorkUnit:
+    file: str
+    start_frame: int    # first frame of the chunk, 0 for images
+    end_frame: int      # end of the chunk (exclusive), 1 for images
+    is_video: bool
+    frame_step: int = 1
+
+    @property
+    def key(self) -> tuple[str, int, int]:
+        return (self.file, self.start_frame, self.end_frame)
+
+
+def _make_scanner(options: ScannerOptions, roi_tracking: bool) -> Scanner:
+    scanner = Scanner()
+    scanner.check_datamatrix_2d = options.datamatrix
+    scanner.check_barcode_128 = options.barcode_128
+    scanner.check_qr_code = options.qr_code
+    scanner.candidate_search = options.candidate_search
+    scanner.roi_tracking = roi_tracking
+    return scanner
+
+
+def _code_record(file: str, frame_index: int, code: CodeResult, decode_time: float) -> dict:
+    return {
+        "file": file,
+        "frame": frame_index,
+        "type": code.type.name,
+        "data": code.data.decode("latin-1"),
+        "bounds": [list(point) for point in code._bounding_points],
+        "decode_ms": round(decode_time * 1000, 3),
+    }
+
+
+def scan_unit(unit: WorkUnit, options: ScannerOptions) -> list[dict]:
+    """
+    Scans one image or one chunk of video frames (runs in the pool processes).
+
+    :returns: all records of the unit, terminated by the "done" record
+    """
+    records: list[dict] = []
+    # only the frames of a video chunk are consecutive, which ROI tracking needs
+    scanner = _make_scanner(options, roi_tracking=options.roi_tracking and unit.is_video)
+
+    if unit.is_video:
+        cap = cv2.VideoCapture(unit.file)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, unit.start_frame)
+        for frame_index in range(unit.start_frame, unit.end_frame):
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if (frame_index - unit.start_frame) % unit.frame_step != 0:
+                continue
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            start = time.perf_counter()
+            codes = scanner.scan_for_codes(frame)
+            decode_time = time.perf_counter() - start
+            records.extend(_code_record(unit.file, frame_index, code, decode_time) for code in codes)
+        cap.release()
+    else:
+        frame = cv2.imread(unit.file)
+        if frame is None:
+            records.append({"file": unit.file, "error": "couldn't read image"})
+        else:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            start = time.perf_counter()
+            codes = scanner.scan_for_codes(frame)
+            decode_time = time.perf_counter() - start
+            records.extend(_code_record(unit.file, 0, code, decode_time) for code in codes)
+
+    records.append({"file": unit.file, "frames": [unit.start_frame, unit.end_frame], "done": True})
+    return records
+
+
+def collect_units(inputs: list[str], chunk_size: int, frame_step: int) -> list[WorkUnit]:
+    files: list[Path] = []
+    for input_path in map(Path, inputs):
+        if input_path.is_dir():
+            files.extend(sorted(p for p in input_path.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS | VIDEO_EXTENSIONS))
+        else:
+            files.append(input_path)
+
+    units: list[WorkUnit] = []
+    for file in files:
+        if file.suffix.lower() in VIDEO_EXTENSIONS:
+            cap = cv2.VideoCapture(str(file))
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+            if frame_count <= 0:
+                print(f"Couldn't determine frame count of '{file}', skipping")
+                continue
+            for start in range(0, frame_count, chunk_size):
+                units.append(WorkUnit(str(file), start, min(frame_count, start + chunk_size), True, frame_step))
+        else:
+            units.append(WorkUnit(str(file), 0, 1, False))
+    return units
+
+
+def read_completed(output: Path) -> set[tuple[str, int, int]]:
+    """
+    :returns: keys of all units marked as done in an existing output file
+    """
+    completed: set[tuple[str, int, int]] = set()
+    if not output.exists():
+        return completed
+    with output.open() as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue    # last line may be cut off if the previous run was killed
+            if record.get("done"):
+                completed.add((record["file"], record["frames"][0], record["frames"][1]))
+    return completed
+
+
+def read_lookups(output: Path) -> tuple[dict[bytes, str], set[bytes]]:
+    """
+    :returns: the file every datamatrix in an existing output file was first found in,
+        and the datamatrices that already have a part_info record
+    """
+    code_files: dict[bytes, str] = {}
+    looked_up: set[bytes] = set()
+    if not output.exists():
+        return code_files, looked_up
+    with output.open() as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("type") == "DATAMATRIX_2D":
+                code_files.setdefault(record["data"].encode("latin-1"), record["file"])
+            elif "part_info" in record and "code" in record:
+                looked_up.add(record["code"].encode("latin-1"))
+    return code_files, looked_up
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="image directories, images or video files")
+    parser.add_argument("-o", "--output", required=True, type=Path, help="JSONL output file (appended to and resumed if it exists)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of scanner processes")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="video frames per unit of work")
+    parser.add_argument("--frame-step", type=int, default=1, help="only scan every N-th video frame")
+    parser.add_argument("--no-datamatrix", action="store_true", help="don't look for datamatrices")
+    parser.add_argument("--barcode-128", action="store_true", help="look for CODE128 barcodes")
+    parser.add_argument("--qr-code", action="store_true", help="look for QR codes")
+    parser.add_argument("--candidate-search", action="store_true", help="only decode datamatrix candidate regions (faster, may miss codes)")
+    parser.add_argument("--roi-tracking", action="store_true", help="only decode datamatrices around the ones of the last video frame (see bench/roi_tracking.py)")
+    parser.add_argument("--lookup", action="store_true", help="look up part info of found datamatrices")
+    args = parser.parse_args()
+
+    options = ScannerOptions(
+        datamatrix=not args.no_datamatrix,
+        barcode_128=args.barcode_128,
+        qr_code=args.qr_code,
+        candidate_search=args.candidate_search,
+        roi_tracking=args.roi_tracking
+    )
+    units = collect_units(args.inputs, args.chunk_size, args.frame_step)
+    completed = read_completed(args.output)
+    todo = [unit for unit in units if unit.key not in completed]
+    print(f"{len(units)} units of work, {len(units) - len(todo)} already done")
+
+    lookup = None
+    code_files: dict[bytes, str] = {}   # file every datamatrix was first found in
+    retry: list[bytes] = []
+    if args.lookup:
+        # imported here so scanning works without API keys
+        from src.lookup_service import LookupService, LookupFinished, MAX_QUEUED_LOOKUPS
+        from src.partinfo import part_info_to_dict
+        lookup = LookupService(report_finished=True)
+        lookup.start()
+        code_files, looked_up = read_lookups(args.output)
+        retry = [data for data in code_files if data not in looked_up]
+        if retry:
+            print(f"{len(retry)} codes of earlier runs have no part info yet, looking them up again")
+
+    start = time.perf_counter()
+    with args.output.open("a") as output, concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+        def write_part_infos() -> None:
+            for result in lookup.poll():
+                # part infos are written once their code has finished, images are left out,
+                # the image_url of the part info is all a batch run needs
+                if isinstance(result, LookupFinished) and result.info is not None:
+                    output.write(json.dumps({
+                        "file": code_files[result.code_data],
+                        "code": result.code_data.decode("latin-1"),
+                        "part_info": part_info_to_dict(result.info)
+                    }) + "\n")
+
+        def submit_lookup(data: bytes) -> None:
+            # the service drops codes while its queue is full
+            while lookup.outstanding >= MAX_QUEUED_LOOKUPS:
+                write_part_infos()
+                time.sleep(0.1)
+            lookup.submit(data)
+
+        futures = [pool.submit(scan_unit, unit, options) for unit in todo]
+        for data in retry:
+            submit_lookup(data)
+        for index, future in enumerate(concurrent.futures.as_completed(futures)):
+            records = future.result()
+            # all records of a unit are written at once, so a unit is either complete or will be redone
+            output.write("".join(json.dumps(record) + "\n" for record in records))
+            output.flush()
+            if lookup is not None:
+                for record in records:
+                    if record.get("type") == "DATAMATRIX_2D":
+                        data = record["data"].encode("latin-1")
+                        if data not in code_files:
+                            code_files[data] = record["file"]
+                            submit_lookup(data)
+                write_part_infos()
+            print(f"\r{index + 1}/{len(todo)} units done", end="", flush=True)
+        print()
+
+        if lookup is not None:
+            while lookup.outstanding:
+                time.sleep(0.1)
+            write_part_infos()
+            lookup.stop()
+
+    print(f"Finished in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,263 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 17:30
+
+Reproducible synthetic label corpus for decoder benchmarks.
+
+Generates ECIA/Mouser style datamatrices (pylibdmtx.encode), CODE128
+barcodes (own encoder, zbar can't encode) and LCSC style QR codes
+(OpenCV), and composites them onto cluttered backgrounds at different
+scales, rotations, blur and noise levels. The same seed always produces
+the same corpus.
+
+The corpus can also be written to disk for use with other tools:
+
+    python -m bench.corpus <output dir> [--seed N] [--count N]
+"""
+
+import argparse
+import dataclasses
+import itertools
+import json
+import random
+from pathlib import Path
+import numpy
+import cv2
+from pylibdmtx import pylibdmtx
+
+from src.scanner import CodeType
+
+
+# CODE128 symbol patterns (bar/space widths in modules), index = symbol value
+CODE128_PATTERNS = [
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312", "132212", "221213",
+    "221312", "231212", "112232", "122132", "122231", "113222", "123122", "123221", "223211", "221132",
+    "221231", "213212", "223112", "312131", "311222", "321122", "321221", "312212", "322112", "322211",
+    "212123", "212321", "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121", "313121", "211331",
+    "231131", "213113", "213311", "213131", "311123", "311321", "331121", "312113", "312311", "332111",
+    "314111", "221411", "431111", "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112", "421211", "212141",
+    "214121", "412121", "111143", "111341", "131141", "114113", "114311", "411113", "411311", "113141",
+    "114131", "311141", "411131", "211412", "211214", "211232", "2331112",
+]
+CODE128_START_B = 104
+CODE128_STOP = 106
+
+BACKGROUND_SIZES = [(1280, 720), (1920, 1080)]
+LABEL_SCALES = [0.6, 1.0, 1.6]
+ROTATIONS = [0, 15, 45]
+BLUR_SIGMAS = [0.0, 1.2]
+NOISE_LEVELS = [0, 12]
+
+
+@dataclasses.dataclass
+class Sample:
+    name: str
+    image: numpy.ndarray    # RGB
+    code_type: CodeType
+    data: bytes             # expected decoded data
+    scale: float
+    rotation: float
+    blur: float
+    noise: float
+
+
+def encode_code128(data: bytes, module_width: int = 2, height: int = 60) -> numpy.ndarray:
+    """
+    Renders printable ASCII data as a CODE128 (code set B) barcode
+    including quiet zones.
+
+    :returns: grayscale image
+    """
+    values = [CODE128_START_B] + [c - 32 for c in data]
+    checksum = (values[0] + sum(i * v for i, v in enumerate(values[1:], start=1))) % 103
+    values += [checksum, CODE128_STOP]
+
+    modules: list[int] = [0] * 10     # quiet zone (0 = white)
+    for value in values:
+        for index, width in enumerate(CODE128_PATTERNS[value]):
+            modules += [1 - index % 2] * int(width)
+    modules += [0] * 10
+
+    row = numpy.where(numpy.array(modules, dtype=numpy.uint8) == 1, 0, 255).astype(numpy.uint8)
+    return numpy.repeat(numpy.tile(row, (height, 1)), module_width, axis=1)
+
+
+def encode_datamatrix(data: bytes, module_width: int = 4) -> numpy.ndarray:
+    """
+    :returns: grayscale datamatrix image including quiet zone
+    """
+    encoded = pylibdmtx.encode(data)
+    image = numpy.frombuffer(encoded.pixels, dtype=numpy.uint8).reshape(encoded.height, encoded.width, 3)
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    # libdmtx renders 5 px per module
+    return cv2.resize(gray, None, fx=module_width / 5, fy=module_width / 5, interpolation=cv2.INTER_NEAREST)
+
+
+def encode_qr(data: bytes, module_width: int = 4) -> numpy.ndarray:
+    """
+    :returns: grayscale QR code image including quiet zone
+    """
+    qr = cv2.QRCodeEncoder.create().encode(data.decode())
+    return cv2.resize(qr, None, fx=module_width, fy=module_width, interpolation=cv2.INTER_NEAREST)
+
+
+def mouser_label_data(rng: random.Random) -> bytes:
+    """
+    :returns: ECIA formatted datamatrix content like printed on Mouser bags
+    """
+    mpn = "".join(rng.choices("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789-", k=rng.randint(8, 16)))
+    fields = [
+        f"K{rng.randint(10000, 99999)}",
+        f"14K{rng.randint(1, 99):03d}",
+        f"1P{mpn}",
+        f"Q{rng.choice([1, 5, 10, 25, 100, 1000])}",
+        f"11K{rng.randint(10000000, 99999999)}",
+        f"4L{rng.choice(['CN', 'US', 'DE', 'TW', 'JP', 'MY'])}",
+        f"1V{rng.choice(['Texas Instruments', 'Microchip', 'STMicroelectronics', 'Yageo', 'Murata'])}",
+    ]
+    return ("[)>\x1e06\x1d" + "\x1d".join(fields) + "\x1e\x04").encode()
+
+
+def digikey_barcode_data(rng: random.Random) -> bytes:
+    return str(rng.randint(10**11, 10**12 - 1)).encode()
+
+
+def lcsc_qr_data(rng: random.Random) -> bytes:
+    return (
+        f"{{pbn:PICK{rng.randint(10**9, 10**10 - 1)},on:SO{rng.randint(10**9, 10**10 - 1)},"
+        f"pc:C{rng.randint(1000, 999999)},pm:PART-{rng.randint(100, 999)},qty:{rng.choice([10, 50, 100])}}}"
+    ).encode()
+
+
+def make_background(rng: numpy.random.Generator, size: tuple[int, int]) -> numpy.ndarray:
+    """
+    Desk-like background with a gradient, random rectangles and some text.
+    """
+    width, height = size
+    gradient = numpy.linspace(rng.integers(60, 120), rng.integers(120, 200), width, dtype=numpy.float32)
+    background = numpy.tile(gradient, (height, 1))
+    background = numpy.dstack([background * rng.uniform(0.8, 1.1) for _ in range(3)]).clip(0, 255).astype(numpy.uint8)
+    for _ in range(8):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(rng.integers(20, width // 4)), int(rng.integers(20, height // 4))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(background, (x, y), (x + w, y + h), color, -1)
+    for _ in range(4):
+        x, y = int(rng.integers(0, width - 200)), int(rng.integers(20, height))
+        cv2.putText(background, "LOT 2417 QTY 100 RoHS", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2)
+    return background
+
+
+def place_code(
+    background: numpy.ndarray,
+    code: numpy.ndarray,
+    rng: numpy.random.Generator,
+    scale: float,
+    rotation: float,
+    blur: float,
+    noise: float
+) -> numpy.ndarray:
+    """
+    Puts a code on a white label and composites it onto the background.
+    """
+    # white label around the code
+    pad = max(code.shape) // 4
+    label = numpy.pad(code, pad, constant_values=255)
+    label = cv2.resize(label, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+
+    h, w = label.shape
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), rotation, 1.0)
+    # enlarge the output so the rotated label isn't cut off
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    out_w, out_h = int(h * sin + w * cos), int(h * cos + w * sin)
+    matrix[0, 2] += out_w / 2 - w / 2
+    matrix[1, 2] += out_h / 2 - h / 2
+    rotated = cv2.warpAffine(label, matrix, (out_w, out_h), borderValue=0)
+    mask = cv2.warpAffine(numpy.full_like(label, 255), matrix, (out_w, out_h), borderValue=0)
+
+    image = background.copy()
+    bg_h, bg_w = image.shape[:2]
+    out_w, out_h = min(out_w, bg_w), min(out_h, bg_h)
+    x = int(rng.integers(0, bg_w - out_w + 1))
+    y = int(rng.integers(0, bg_h - out_h + 1))
+    region = image[y:y + out_h, x:x + out_w]
+    selected = mask[:out_h, :out_w] > 0
+    region[selected] = rotated[:out_h, :out_w][selected][:, None]
+
+    if blur > 0:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+    if noise > 0:
+        image = (image + rng.normal(0, noise, image.shape)).clip(0, 255).astype(numpy.uint8)
+    return image
+
+
+def generate_corpus(seed: int = 0, count: int | None = None) -> list[Sample]:
+    """
+    Generates the corpus: every code type in every combination of background
+    size, scale, rotation, blur and noise level.
+
+    :param count: only generate the first count samples (for quick runs)
+    """
+    rng = numpy.random.default_rng(seed)
+    data_rng = random.Random(seed)
+    backgrounds = {size: make_background(rng, size) for size in BACKGROUND_SIZES}
+    generators = [
+        (CodeType.DATAMATRIX_2D, mouser_label_data, encode_datamatrix),
+        (CodeType.BARCODE_128, digikey_barcode_data, encode_code128),
+        (CodeType.QR_CODE, lcsc_qr_data, encode_qr),
+    ]
+
+    samples: list[Sample] = []
+    for (code_type, make_data, encode), size, scale, rotation, blur, noise in itertools.product(
+        generators, BACKGROUND_SIZES, LABEL_SCALES, ROTATIONS, BLUR_SIGMAS, NOISE_LEVELS
+    ):
+        if count is not None and len(samples) >= count:
+            break
+        data = make_data(data_rng)
+        image = place_code(backgrounds[size], encode(data), rng, scale, rotation, blur, noise)
+        samples.append(Sample(
+            name=f"{len(samples):04d}_{code_type.name.lower()}_{size[0]}_s{scale}_r{rotation}_b{blur}_n{noise}",
+            image=cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if image.ndim == 3 else image,
+            code_type=code_type,
+            data=data,
+            scale=scale,
+            rotation=rotation,
+            blur=blur,
+            noise=noise
+        ))
+    return samples
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", type=Path, help="output directory")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count", type=int, default=None, help="only generate the first N samples")
+    args = parser.parse_args()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    manifest: list[dict] = []
+    for sample in generate_corpus(args.seed, args.count):
+        file = f"{sample.name}.png"
+        cv2.imwrite(str(args.output / file), cv2.cvtColor(sample.image, cv2.COLOR_RGB2BGR))
+        manifest.append({
+            "file": file,
+            "type": sample.code_type.name,
+            "data": sample.data.decode("latin-1"),
+            "scale": sample.scale,
+            "rotation": sample.rotation,
+            "blur": sample.blur,
+            "noise": sample.noise,
+        })
+    (args.output / "manifest.json").write_text(json.dumps({"seed": args.seed, "samples": manifest}, indent=2))
+    print(f"Wrote {len(manifest)} samples to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,169 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 18:10
+
+Decoder benchmark over the synthetic label corpus.
+
+Runs every scanner configuration over the corpus (see corpus.py) and reports
+decode latency percentiles, throughput and detection rate. Results can be
+written as JSON and compared against a previous run to detect regressions:
+
+    python -m bench.decoders --json new.json [--compare old.json] [--configs baseline candidates]
+
+When comparing, the exit code is 1 if any configuration got slower (p50) or
+detects fewer codes than the tolerances allow.
+"""
+
+import argparse
+import dataclasses
+import json
+import platform
+import statistics
+import time
+from pathlib import Path
+import numpy
+import cv2
+
+from src.scanner import Scanner, DmtxParams, CodeType
+from bench.corpus import generate_corpus, Sample
+
+
+LATENCY_TOLERANCE = 0.10    # relative p50 increase that counts as a regression
+DETECTION_TOLERANCE = 0.01  # absolute detection rate decrease that counts as a regression
+
+
+@dataclasses.dataclass
+class ScannerConfig:
+    candidate_search: bool = False
+    dmtx_params: DmtxParams = dataclasses.field(default_factory=DmtxParams)
+
+
+CONFIGS: dict[str, ScannerConfig] = {
+    "baseline": ScannerConfig(),
+    "candidates": ScannerConfig(candidate_search=True),
+    "dmtx_shrink2": ScannerConfig(dmtx_params=DmtxParams(shrink=2)),
+    "dmtx_timeout50": ScannerConfig(dmtx_params=DmtxParams(timeout=50)),
+    "dmtx_no_threshold": ScannerConfig(dmtx_params=DmtxParams(threshold=None)),
+    "dmtx_edges": ScannerConfig(dmtx_params=DmtxParams(min_edge=40, max_edge=400, gap_size=2)),
+}
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_config(config: ScannerConfig, corpus: list[Sample], repeat: int) -> dict:
+    latencies: list[float] = []
+    detected_by_type: dict[str, list[bool]] = {code_type.name: [] for code_type in CodeType}
+
+    total_start = time.perf_counter()
+    for sample in corpus:
+        for _ in range(repeat):
+            # fresh scanner for every sample, the samples are independent images
+            scanner = Scanner()
+            scanner.check_datamatrix_2d = True
+            scanner.check_barcode_128 = True
+            scanner.check_qr_code = True
+            scanner.candidate_search = config.candidate_search
+            scanner.dmtx_params = config.dmtx_params
+
+            start = time.perf_counter()
+            codes = scanner.scan_for_codes(sample.image)
+            latencies.append(time.perf_counter() - start)
+        detected_by_type[sample.code_type.name].append(any(code.data == sample.data for code in codes))
+    total_time = time.perf_counter() - total_start
+
+    ms = sorted(latency * 1000 for latency in latencies)
+    detected = [hit for hits in detected_by_type.values() for hit in hits]
+    return {
+        "frames": len(ms),
+        "mean_ms": statistics.fmean(ms),
+        "p50_ms": _percentile(ms, 0.50),
+        "p90_ms": _percentile(ms, 0.90),
+        "p99_ms": _percentile(ms, 0.99),
+        "max_ms": ms[-1],
+        "throughput_fps": len(ms) / total_time,
+        "detection_rate": sum(detected) / len(detected),
+        "detection_by_type": {
+            name: sum(hits) / len(hits)
+            for name, hits in detected_by_type.items() if hits
+        },
+    }
+
+
+def compare(old: dict, new: dict) -> bool:
+    """
+    Prints the differences between two benchmark results.
+
+    :returns: True if there are regressions
+    """
+    regression = False
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        before = old["results"][name]
+        latency_change = result["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] > 0 else 0.0
+        detection_change = result["detection_rate"] - before["detection_rate"]
+        slower = latency_change > LATENCY_TOLERANCE
+        worse = detection_change < -DETECTION_TOLERANCE
+        regression |= slower or worse
+        print(
+            f"{name:>18}: p50 {before['p50_ms']:7.1f} -> {result['p50_ms']:7.1f} ms ({latency_change:+.0%}){' SLOWER' if slower else ''}, "
+            f"detection {before['detection_rate']:.1%} -> {result['detection_rate']:.1%}{' WORSE' if worse else ''}"
+        )
+    return regression
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed")
+    parser.add_argument("--count", type=int, default=None, help="only use the first N corpus samples")
+    parser.add_argument("--repeat", type=int, default=1, help="decode every sample N times")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    parser.add_argument("--compare", type=Path, help="previous results to compare against")
+    args = parser.parse_args()
+
+    print("Generating corpus...")
+    corpus = generate_corpus(args.seed, args.count)
+    print(f"{len(corpus)} samples")
+
+    results: dict[str, dict] = {}
+    for name in args.configs:
+        result = run_config(CONFIGS[name], corpus, args.repeat)
+        results[name] = result
+        print(
+            f"{name:>18}: mean {result['mean_ms']:7.1f} ms, p50 {result['p50_ms']:7.1f} ms, "
+            f"p90 {result['p90_ms']:7.1f} ms, p99 {result['p99_ms']:7.1f} ms, "
+            f"{result['throughput_fps']:6.1f} fps, detected {result['detection_rate']:.1%} "
+            f"({', '.join(f'{t}: {r:.0%}' for t, r in result['detection_by_type'].items())})"
+        )
+
+    output = {
+        "meta": {
+            "seed": args.seed,
+            "samples": len(corpus),
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "opencv": cv2.__version__,
+            "numpy": numpy.__version__,
+        },
+        "configs": {name: dataclasses.asdict(CONFIGS[name]) for name in args.configs},
+        "results": results,
+    }
+    if args.json is not None:
+        args.json.write_text(json.dumps(output, indent=2))
+
+    if args.compare is not None:
+        print(f"\nCompared to {args.compare}:")
+        if compare(json.loads(args.compare.read_text()), output):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
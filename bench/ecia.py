@@ -0,0 +1,201 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+19.10.26 01:10
+
+Benchmark and fuzz test of the ECIA label parser.
+
+Generates a corpus of valid Mouser and DigiKey style labels (with random
+field order and optional fields) and mutations of them (truncated, bytes
+flipped, separators removed or duplicated, fields repeated, random bytes),
+then checks that parse_ecia():
+
+- never raises
+- recovers every field of the valid labels, whatever the field order
+- gives equal dedup keys for the same label with differently ordered fields
+
+and reports parse time per label compared to the previous extraction
+(splitting on GS and slicing the fourth field). The corpus can be saved to
+be reused, e.g. by other fuzzers:
+
+    python -m bench.ecia [--labels 2000] [--mutations 10] [--seed 0] [--save DIR]
+
+The exit code is 1 if any check fails.
+"""
+
+import argparse
+import random
+import statistics
+import time
+from pathlib import Path
+
+from src.ecia import parse_ecia, EciaLabel, HEADER
+
+
+ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-/._"
+
+
+def _random_value(rng: random.Random, min_length: int = 3, max_length: int = 20) -> bytes:
+    return bytes(rng.choice(ALPHABET) for _ in range(rng.randint(min_length, max_length)))
+
+
+def generate_label(rng: random.Random) -> tuple[dict[bytes, bytes], bytes]:
+    """
+    :returns: the fields by DI and the encoded label
+    """
+    fields: dict[bytes, bytes] = {
+        b"K": _random_value(rng, 0, 12),
+        b"14K": str(rng.randint(1, 999)).encode(),
+        b"1P": _random_value(rng),
+        b"Q": str(rng.randint(1, 100000)).encode(),
+    }
+    if rng.random() < 0.5:
+        # DigiKey style
+        fields[b"P"] = _random_value(rng)
+        fields[b"30P"] = _random_value(rng) + b"-ND"
+        fields[b"1K"] = str(rng.randint(10 ** 7, 10 ** 8)).encode()
+        fields[b"10K"] = str(rng.randint(10 ** 7, 10 ** 8)).encode()
+        fields[b"9D"] = f"{rng.randint(10, 26):02d}{rng.randint(1, 52):02d}".encode()
+        fields[b"1T"] = _random_value(rng, 4, 10)
+        fields[b"11K"] = b"1"
+        fields[b"4L"] = rng.choice([b"CN", b"TW", b"US", b"MY"])
+        fields[b"13Z"] = str(rng.randint(10 ** 5, 10 ** 6)).encode()
+        fields[b"20Z"] = b"0" * rng.randint(10, 60)
+    else:
+        # Mouser style
+        fields[b"11K"] = str(rng.randint(10 ** 7, 10 ** 8)).encode()
+        fields[b"4L"] = rng.choice([b"CN", b"TW", b"US", b"MY"])
+        fields[b"1V"] = _random_value(rng, 3, 12)
+    return fields, encode_label(fields, rng)
+
+
+def encode_label(fields: dict[bytes, bytes], rng: random.Random) -> bytes:
+    order = list(fields.items())
+    rng.shuffle(order)
+    return HEADER + b"\x1d".join(di + value for di, value in order) + b"\x1e\x04"
+
+
+def mutate(label: bytes, rng: random.Random) -> bytes:
+    mutation = rng.randrange(7)
+    data = bytearray(label)
+    if mutation == 0:
+        return bytes(data[:rng.randrange(len(data))])
+    if mutation == 1:
+        for _ in range(rng.randint(1, 5)):
+            data[rng.randrange(len(data))] = rng.randrange(256)
+        return bytes(data)
+    if mutation == 2:
+        return label.replace(b"\x1d", b"", rng.randint(1, 3))
+    if mutation == 3:
+        return label.replace(b"\x1d", b"\x1d\x1d", rng.randint(1, 3))
+    if mutation == 4:
+        fields = label[len(HEADER):].split(b"\x1d")
+        return label.replace(b"\x1e\x04", b"\x1d" + rng.choice(fields) + b"\x1e\x04")
+    if mutation == 5:
+        return bytes(rng.randrange(256) for _ in range(rng.randint(0, 200)))
+    return HEADER + bytes(rng.randrange(256) for _ in range(rng.randint(0, 200)))
+
+
+def legacy_extract(code_data: bytes) -> bytes | None:
+    """
+    How the part number was extracted before the parser.
+    """
+    if not b'[)>' in code_data:
+        return None
+    code_components = code_data.split(b"\x1d")
+    return code_components[3][2:]
+
+
+def check_fields(label: EciaLabel, fields: dict[bytes, bytes]) -> list[str]:
+    expected = {
+        "customer_po": fields.get(b"K"),
+        "supplier_order": fields.get(b"1K"),
+        "invoice": fields.get(b"10K"),
+        "packing_list": fields.get(b"11K"),
+        "line_item": fields.get(b"14K"),
+        "customer_part_number": fields.get(b"P"),
+        "supplier_part_number": fields.get(b"1P"),
+        "distributor_part_number": fields.get(b"30P"),
+        "quantity": int(fields[b"Q"]),
+        "date_code": fields.get(b"9D"),
+        "lot": fields.get(b"1T"),
+        "country_of_origin": fields.get(b"4L"),
+        "manufacturer": fields.get(b"1V"),
+    }
+    problems = [
+        f"{name}: expected {value!r}, got {getattr(label, name)!r}"
+        for name, value in expected.items() if getattr(label, name) != value
+    ]
+    for di in (b"13Z", b"20Z"):
+        if di in fields and label.other.get(di) != fields[di]:
+            problems.append(f"{di.decode()} missing in other fields")
+    if not label.valid:
+        problems.append(f"errors: {label.errors}")
+    return problems
+
+
+def _time_per_label(function, labels: list[bytes], repeat: int) -> list[float]:
+    times: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for label in labels:
+            function(label)
+        times.append((time.perf_counter() - start) / len(labels))
+    return times
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", type=int, default=2000, help="valid labels to generate")
+    parser.add_argument("--mutations", type=int, default=10, help="mutations per valid label")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", type=Path, help="directory to save the corpus to, one file per code")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    failures = 0
+    valid_labels: list[bytes] = []
+    for index in range(args.labels):
+        fields, label_data = generate_label(rng)
+        valid_labels.append(label_data)
+        label = parse_ecia(label_data)
+        problems = check_fields(label, fields) if label is not None else ["not recognized"]
+        reordered = parse_ecia(encode_label(fields, rng))
+        if label is not None and (reordered is None or reordered.dedup_key != label.dedup_key):
+            problems.append("dedup key depends on the field order")
+        if problems:
+            failures += 1
+            if failures <= 10:
+                print(f"Label {index} {label_data!r}: {problems}")
+
+    mutated_labels = [mutate(label, rng) for label in valid_labels for _ in range(args.mutations)]
+    parsed = invalid = 0
+    for label_data in mutated_labels:
+        try:
+            label = parse_ecia(label_data)
+        except Exception as e:
+            failures += 1
+            print(f"Parser raised {e!r} for {label_data!r}")
+            continue
+        if label is not None:
+            parsed += 1
+            invalid += not label.valid
+
+    if args.save is not None:
+        args.save.mkdir(parents=True, exist_ok=True)
+        for index, label_data in enumerate(valid_labels + mutated_labels):
+            (args.save / f"{'valid' if index < len(valid_labels) else 'mutated'}_{index:06d}.bin").write_bytes(label_data)
+        print(f"Saved corpus to {args.save}")
+
+    parse_times = _time_per_label(parse_ecia, valid_labels, 5)
+    legacy_times = _time_per_label(legacy_extract, valid_labels, 5)
+    print(f"{len(valid_labels)} valid labels, {len(mutated_labels)} mutations ({parsed} recognized, {invalid} of them with errors)")
+    print(f"parse_ecia:     {statistics.median(parse_times) * 1e6:6.2f} us per label (all fields, validated)")
+    print(f"legacy extract: {statistics.median(legacy_times) * 1e6:6.2f} us per label (part number only, order dependent)")
+    print(f"{failures} failed checks")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,246 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 23:10
+
+Local stand-in for the Mouser search API and image server.
+
+Answers part number searches (including batches joined by "|") from
+recorded responses and serves part images, with configurable latency,
+error rate and rate limiting, so the lookup path can be tested and loaded
+without an API key or quota:
+
+    python -m bench.fake_mouser [--port 8300] [--responses DIR] [--latency 0.3]
+        [--jitter 0.1] [--error-rate 0.05] [--per-minute 30]
+
+The app is pointed to it with the GETPARTS_MOUSER_API_URL environment
+variable, e.g. GETPARTS_MOUSER_API_URL=http://127.0.0.1:8300/api/v1.
+
+Recorded responses are JSON files of Mouser search responses (as saved from
+the real API), whose parts are indexed by Mouser part number. Part numbers
+that aren't in any recording get a generated part, except ones starting with
+NOT_FOUND_PREFIX, which aren't found.
+"""
+
+import argparse
+import asyncio
+import collections
+import copy
+import dataclasses
+import io
+import json
+import random
+import re
+import time
+from pathlib import Path
+from aiohttp import web
+from PIL import Image
+
+
+DEFAULT_PORT = 8300
+SEARCH_PATH = "/api/v1/search/partnumber"
+IMAGE_PATH = "/images/{name}"
+NOT_FOUND_PREFIX = "NOTFOUND"
+
+
+@dataclasses.dataclass
+class FakeMouserStats:
+    searches: int = 0           # search requests, including rejected ones
+    part_numbers: int = 0       # part numbers searched in accepted requests
+    images: int = 0
+    errors: int = 0             # injected 500 responses
+    throttled: int = 0          # 429 responses
+
+
+def load_recordings(directory: Path) -> dict[str, dict]:
+    """
+    :returns: part descriptors of all recorded search responses by upper case Mouser part number
+    """
+    parts: dict[str, dict] = {}
+    for path in sorted(directory.glob("*.json")):
+        with open(path, "r") as f:
+            response = json.load(f)
+        for part in response["SearchResults"]["Parts"] or []:
+            parts[part["MouserPartNumber"].upper()] = part
+    return parts
+
+
+def generated_part(part_number: str, image_url: str) -> dict:
+    return {
+        "Description": f"Generated part {part_number}",
+        "AvailabilityInStock": str(random.randint(0, 10000)),
+        "Min": "1",
+        "Mult": "1",
+        "Manufacturer": "Fake Manufacturer",
+        "ManufacturerPartNumber": f"FM-{part_number}",
+        "MouserPartNumber": part_number,
+        "PriceBreaks": [
+            {"Quantity": 1, "Price": "0,10 €", "Currency": "EUR"},
+            {"Quantity": 100, "Price": "0,05 €", "Currency": "EUR"},
+        ],
+        "ProductAttributes": [{"AttributeName": "Packaging", "AttributeValue": "Cut Tape"}],
+        "ProductDetailUrl": f"https://www.mouser.com/ProductDetail/{part_number}",
+        "ImagePath": image_url,
+    }
+
+
+class FakeMouser:
+    """
+    aiohttp application imitating the Mouser search API and image server.
+    """
+
+    def __init__(
+        self,
+        recordings: dict[str, dict] | None = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        per_minute: int = 0
+    ) -> None:
+        """
+        :param recordings: recorded part descriptors by upper case Mouser part number
+        :param latency: mean seconds before a response is sent
+        :param jitter: standard deviation of the latency
+        :param error_rate: fraction of requests answered with 500
+        :param per_minute: searches accepted per sliding minute, more are answered with 429, 0 for no limit
+        """
+        self._recordings = recordings or {}
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._per_minute = per_minute
+        self._accepted: collections.deque[float] = collections.deque()
+        self._image = self._make_image()
+        self.stats = FakeMouserStats()
+        self.app = web.Application()
+        self.app.router.add_post(SEARCH_PATH, self._search)
+        self.app.router.add_get(IMAGE_PATH, self._image_file)
+
+    @staticmethod
+    def _make_image() -> bytes:
+        buffer = io.BytesIO()
+        Image.new("RGB", (180, 180), (40, 120, 200)).save(buffer, format="JPEG")
+        return buffer.getvalue()
+
+    async def _delay(self) -> None:
+        delay = random.gauss(self._latency, self._jitter) if self._jitter > 0 else self._latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _retry_after(self) -> float | None:
+        """
+        :returns: seconds until the next search is accepted, None if it is accepted now
+        """
+        if self._per_minute <= 0:
+            return None
+        now = time.monotonic()
+        while self._accepted and now - self._accepted[0] >= 60:
+            self._accepted.popleft()
+        if len(self._accepted) < self._per_minute:
+            self._accepted.append(now)
+            return None
+        return 60 - (now - self._accepted[0])
+
+    def _find(self, part_number: str, request: web.Request) -> list[dict]:
+        search = part_number.upper()
+        if search.startswith(NOT_FOUND_PREFIX):
+            return []
+        if search in self._recordings:
+            return [copy.deepcopy(self._recordings[search])]
+        recorded = [copy.deepcopy(part) for key, part in self._recordings.items() if search in key]
+        if recorded:
+            return recorded
+        image_url = str(request.url.with_path(IMAGE_PATH.format(name=f"{part_number}.jpg")).with_query(None))
+        return [generated_part(part_number, image_url)]
+
+    async def _search(self, request: web.Request) -> web.Response:
+        self.stats.searches += 1
+        body = await request.text()
+        await self._delay()
+
+        retry_after = self._retry_after()
+        if retry_after is not None:
+            self.stats.throttled += 1
+            return web.Response(status=429, headers={"Retry-After": str(int(retry_after) + 1)})
+        if random.random() < self._error_rate:
+            self.stats.errors += 1
+            return web.Response(status=500, text="Injected error")
+
+        # the body isn't strictly valid JSON (trailing comma), so it is parsed like the real API seems to
+        match = re.search(r'"mouserPartNumber"\s*:\s*"([^"]*)"', body)
+        if match is None:
+            return web.json_response({"Errors": [{"Message": "Invalid request"}], "SearchResults": None})
+        part_numbers = [part_number for part_number in match.group(1).split("|") if part_number]
+        self.stats.part_numbers += len(part_numbers)
+        parts = [part for part_number in part_numbers for part in self._find(part_number, request)]
+        return web.json_response({
+            "Errors": [],
+            "SearchResults": {"NumberOfResult": len(parts), "Parts": parts}
+        })
+
+    async def _image_file(self, request: web.Request) -> web.Response:
+        self.stats.images += 1
+        await self._delay()
+        return web.Response(body=self._image, content_type="image/jpeg")
+
+
+async def start_server(fake: FakeMouser, host: str, port: int) -> web.AppRunner:
+    """
+    Starts serving the fake API in the running event loop.
+
+    :returns: the runner, to be cleaned up to stop the server
+    """
+    runner = web.AppRunner(fake.app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the options of the fake API, shared with the lookup load test.
+    """
+    parser.add_argument("--responses", type=Path, help="directory of recorded search responses (*.json)")
+    parser.add_argument("--latency", type=float, default=0.3, help="mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="standard deviation of the latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--per-minute", type=int, default=30, help="searches accepted per minute, 0 for no limit")
+
+
+def from_arguments(args: argparse.Namespace) -> FakeMouser:
+    return FakeMouser(
+        recordings=load_recordings(args.responses) if args.responses is not None else None,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        per_minute=args.per_minute
+    )
+
+
+async def serve(args: argparse.Namespace) -> None:
+    fake = from_arguments(args)
+    runner = await start_server(fake, args.host, args.port)
+    print(f"Fake Mouser API running, use GETPARTS_MOUSER_API_URL=http://{args.host}:{args.port}/api/v1")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(f"Served: {fake.stats}")
+        await runner.cleanup()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
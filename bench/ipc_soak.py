@@ -0,0 +1,269 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 22:00
+
+Soak test of the IPC between the image worker and the UI.
+
+A producer process imitates the image worker: at a fixed rate it publishes a
+frame into a shared memory frame ring and sends a timestamped message of
+about the size of a WorkerResponse with its handle, while the event loop
+receives them with AsyncChannel (async for) next to a task imitating the UI
+loop, views the frames and acknowledges them. Like the worker, the producer
+holds a frame back while slot_count - 1 frames aren't acknowledged yet.
+Every interval, receive latency and event loop lag percentiles, the maximum
+RSS of both processes and the frame ring counters (frames held back for lack
+of a free slot, frames overwritten before they were viewed, unacknowledged
+frames) are printed. At the end the first and last interval are compared to
+check that nothing grows over the whole run:
+
+    python -m bench.ipc_soak [--duration 7200] [--rate 60] [--interval 60] [--frame 640x360] [--legacy]
+
+With --legacy, messages are received the way it was done before AsyncChannel
+(add_reader and a new event for every message) for comparison. The exit code
+is 1 if the p99 latency of the last interval is more than FLAT_TOLERANCE
+times (plus FLAT_SLACK) that of the first, if the RSS of either process grew
+by more than RSS_GROWTH_LIMIT or if frames were held back or overwritten in
+the last interval.
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import statistics
+import time
+import typing
+from multiprocessing.connection import Connection
+import numpy
+
+from src.async_channel import AsyncChannel
+from src.frame_transport import FrameRingWriter, FrameRingReader
+from src.preview import PREVIEW_SIZE
+
+try:
+    import resource
+except ImportError:     # not available on windows
+    resource = None
+
+
+FLAT_TOLERANCE = 2.0    # allowed p99 latency growth factor from the first to the last interval
+FLAT_SLACK = 0.001      # seconds, so scheduling noise on sub-millisecond latencies doesn't count
+RSS_GROWTH_LIMIT = 16.0 # MB the maximum RSS of a process may grow by from the first to the last interval
+UI_INTERVAL = 0.02      # seconds, like MainWindow.run()
+
+
+def producer(connection: Connection, rate: float, duration: float, payload_size: int, frame_shape: tuple[int, ...]) -> None:
+    """
+    Sends messages with frames at a fixed rate for duration seconds, then closes the connection.
+    """
+    payload = bytes(payload_size)
+    frame = numpy.zeros(frame_shape, dtype=numpy.uint8)
+    frame_ring = FrameRingWriter()
+    # like the image worker, one slot always has to stay free for the next frame
+    max_unacked_frames = frame_ring.slot_count - 1
+    unacked_frames: set[int] = set()
+    held_back = 0
+    start = time.monotonic()
+    sequence = 0
+    while True:
+        deadline = start + sequence / rate
+        if deadline - start >= duration:
+            break
+        time.sleep(max(0.0, deadline - time.monotonic()))
+        while connection.poll():
+            unacked_frames.discard(connection.recv())
+
+        handle = None
+        if len(unacked_frames) < max_unacked_frames:
+            # marked with the sequence number the frame gets in the ring, to detect overwritten frames
+            frame[0, 0] = (sequence - held_back) % 256
+            handle = frame_ring.publish(frame)
+            unacked_frames.add(handle.sequence)
+        else:
+            held_back += 1
+        connection.send({
+            "sequence": sequence,
+            "sent": time.monotonic(),
+            "frame": handle,
+            "held_back": held_back,
+            "unacked": len(unacked_frames),
+            "rss_mb": _max_rss_mb(),
+            "payload": payload
+        })
+        sequence += 1
+    connection.close()
+    frame_ring.close()
+
+
+async def legacy_recv(reader: Connection) -> typing.Any:
+    """
+    How async_pipe_recv() used to receive a message.
+    """
+    data_available = asyncio.Event()
+    asyncio.get_event_loop().add_reader(reader.fileno(), data_available.set)
+
+    while not reader.poll():
+        await data_available.wait()
+        data_available.clear()
+
+    return reader.recv()
+
+
+async def legacy_messages(connection: Connection) -> typing.AsyncIterator[typing.Any]:
+    while True:
+        try:
+            yield await legacy_recv(connection)
+        except EOFError:
+            return
+
+
+async def measure_ui_lag(lags: list[float]) -> None:
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(UI_INTERVAL)
+        lags.append(time.monotonic() - start - UI_INTERVAL)
+
+
+def _max_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _report(elapsed: float, latencies: list[float], lags: list[float], counters: dict) -> dict:
+    ms = sorted(latency * 1000 for latency in latencies)
+    lag_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    result = {
+        "messages": len(ms),
+        "p50_ms": ms[len(ms) // 2],
+        "p99_ms": ms[min(len(ms) - 1, int(len(ms) * 0.99))],
+        "max_ms": ms[-1],
+        "mean_ms": statistics.fmean(ms),
+        "lag_p99_ms": lag_ms[min(len(lag_ms) - 1, int(len(lag_ms) * 0.99))],
+        "rss_mb": _max_rss_mb(),
+    } | counters
+    print(
+        f"{elapsed / 60:7.1f} min: {result['messages']:6d} msgs, latency p50 {result['p50_ms']:6.3f} ms, "
+        f"p99 {result['p99_ms']:6.3f} ms, max {result['max_ms']:7.3f} ms, "
+        f"UI lag p99 {result['lag_p99_ms']:6.3f} ms, max RSS {result['rss_mb']:6.1f} / {result['producer_rss_mb']:6.1f} MB, "
+        f"frames held back {result['held_back']}, overwritten {result['overwritten']}, unacked {result['unacked']}",
+        flush=True
+    )
+    return result
+
+
+async def soak(args: argparse.Namespace) -> int:
+    connection, producer_connection = mp.Pipe(duplex=True)
+    width, height = args.frame
+    process = mp.Process(
+        target=producer,
+        args=(producer_connection, args.rate, args.duration, args.payload, (height, width, 3)),
+        daemon=True
+    )
+    process.start()
+    # only the producer may keep its end open, otherwise the stream never ends
+    producer_connection.close()
+
+    lags: list[float] = []
+    ui_task = asyncio.create_task(measure_ui_lag(lags))
+    channel: AsyncChannel | None = None
+    messages: typing.AsyncIterator[typing.Any]
+    if args.legacy:
+        messages = legacy_messages(connection)
+    else:
+        channel = AsyncChannel(connection)
+        messages = channel
+
+    frame_ring = FrameRingReader()
+    intervals: list[dict] = []
+    latencies: list[float] = []
+    held_back = overwritten = interval_held_back = interval_overwritten = 0
+    start = interval_start = time.monotonic()
+    expected_sequence = 0
+    async for message in messages:
+        latencies.append(time.monotonic() - message["sent"])
+        if message["sequence"] != expected_sequence:
+            print(f"Message {expected_sequence} missing, got {message['sequence']}")
+        expected_sequence = message["sequence"] + 1
+
+        interval_held_back += message["held_back"] - held_back
+        held_back = message["held_back"]
+        if message["frame"] is not None:
+            frame = frame_ring.view(message["frame"])
+            if frame is None or frame[0, 0, 0] != message["frame"].sequence % 256:
+                interval_overwritten += 1
+            del frame
+            # acknowledged with the sequence number like FrameAck, which can't be imported
+            # without API keys (img_process imports the lookup service).
+            # the producer may already have finished and closed its end
+            try:
+                (channel.send if channel is not None else connection.send)(message["frame"].sequence)
+            except OSError:
+                pass
+
+        now = time.monotonic()
+        if now - interval_start >= args.interval:
+            overwritten += interval_overwritten
+            intervals.append(_report(now - start, latencies, lags, {
+                "producer_rss_mb": message["rss_mb"],
+                "held_back": interval_held_back,
+                "overwritten": interval_overwritten,
+                "unacked": message["unacked"],
+            }))
+            latencies.clear()
+            lags.clear()
+            interval_held_back = interval_overwritten = 0
+            interval_start = now
+    if latencies:
+        overwritten += interval_overwritten
+        result = _report(time.monotonic() - start, latencies, lags, {
+            "producer_rss_mb": message["rss_mb"],
+            "held_back": interval_held_back,
+            "overwritten": interval_overwritten,
+            "unacked": message["unacked"],
+        })
+        # a short remainder is too noisy to compare
+        if time.monotonic() - interval_start >= args.interval / 2:
+            intervals.append(result)
+
+    ui_task.cancel()
+    if channel is not None:
+        channel.close()
+    frame_ring.close()
+    process.join()
+
+    print(f"{held_back} frames held back and {overwritten} overwritten in total")
+    if len(intervals) < 2:
+        print("Run at least two intervals to compare latencies")
+        return 0
+    first, last = intervals[0], intervals[-1]
+    flat = last["p99_ms"] <= first["p99_ms"] * FLAT_TOLERANCE + FLAT_SLACK * 1000
+    print(f"p99 latency first interval {first['p99_ms']:.3f} ms, last interval {last['p99_ms']:.3f} ms: {'flat' if flat else 'GROWING'}")
+    rss_growth = max(last["rss_mb"] - first["rss_mb"], last["producer_rss_mb"] - first["producer_rss_mb"])
+    leaking = rss_growth > RSS_GROWTH_LIMIT
+    print(f"max RSS growth {rss_growth:.1f} MB: {'LEAKING' if leaking else 'flat'}")
+    starved = last["held_back"] > 0 or last["overwritten"] > 0
+    print(f"frame ring slots in the last interval: {'STARVED' if starved else 'ok'}")
+    return 1 if not flat or leaking or starved else 0
+
+
+def _frame_size(value: str) -> tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=7200, help="seconds to run")
+    parser.add_argument("--rate", type=float, default=60, help="messages per second")
+    parser.add_argument("--interval", type=float, default=60, help="seconds per reported interval")
+    parser.add_argument("--payload", type=int, default=512, help="message payload size in bytes")
+    parser.add_argument("--frame", type=_frame_size, default=PREVIEW_SIZE, help="size of the frames sent through the frame ring, WIDTHxHEIGHT")
+    parser.add_argument("--legacy", action="store_true", help="receive like the old async_pipe_recv()")
+    args = parser.parse_args()
+    return asyncio.run(soak(args))
+
+
+if __name__ == "__main__":
+    exit(main())
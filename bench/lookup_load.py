@@ -0,0 +1,168 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 23:30
+
+Load test of the part lookup path against the fake Mouser API.
+
+Submits ECIA codes to a LookupService at a fixed scan rate, like the image
+worker does, and reports lookup latency percentiles (from submitting a code
+to its part info being available, the image follows later), throughput and
+how many lookups failed, together with what the server saw (searches, 429
+and 500 responses) and the request counters of the lookup service:
+
+    python -m bench.lookup_load [--rate 2] [--duration 60] [--parts 50] [--cache]
+        [--client-per-minute 30] [--per-minute 30] [--error-rate 0.05] [--latency 0.3]
+
+By default a fake Mouser API (see fake_mouser.py) is started in the
+background and all its options can be used here, with --url the lookups go
+to an already running one instead. Part numbers starting with "NOTFOUND"
+can be mixed in with --not-found to test lookups without result.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench.fake_mouser import FakeMouser, add_arguments, from_arguments, start_server, DEFAULT_PORT, NOT_FOUND_PREFIX
+
+
+DRAIN_TIMEOUT = 60.0    # seconds to wait for outstanding lookups after the last scan
+POLL_INTERVAL = 0.01    # seconds, about like the image worker loop
+
+
+def ecia_code(part_number: str) -> bytes:
+    """
+    :returns: the data of a Mouser bag label datamatrix code for the part number
+    """
+    return b"[)>\x1e06\x1dK1234\x1d14K001\x1d1P" + part_number.encode() + b"\x1dQ10\x1d11K1\x1e\x04"
+
+
+def start_fake_server(fake: FakeMouser, port: int) -> None:
+    """
+    Runs the fake API in a background thread.
+    """
+    started = threading.Event()
+
+    def run() -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(start_server(fake, "127.0.0.1", port))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="FakeMouser", daemon=True).start()
+    started.wait()
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(args: argparse.Namespace) -> int:
+    fake: FakeMouser | None = None
+    url = args.url
+    if url is None:
+        fake = from_arguments(args)
+        start_fake_server(fake, args.port)
+        url = f"http://127.0.0.1:{args.port}/api/v1"
+    os.environ["GETPARTS_MOUSER_API_URL"] = url
+    # imported here, because the API URL is read on import
+    from src.lookup_service import LookupService, MOUSER_RATE_LIMIT
+    from src.supplier_client import RateLimit
+    from src.instrumentation import PipelineMetrics
+    from src.partinfo import PartImage
+
+    part_numbers = [
+        f"{NOT_FOUND_PREFIX}{index}" if random.random() < args.not_found else f"{index:03d}-LOAD{index}"
+        for index in range(args.parts)
+    ]
+    metrics = PipelineMetrics()
+    cache_dir = tempfile.TemporaryDirectory() if args.cache else None
+    service = LookupService(
+        cache_dir=Path(cache_dir.name) if cache_dir is not None else None,
+        metrics=metrics,
+        mouser_limit=RateLimit(
+            per_minute=args.client_per_minute or MOUSER_RATE_LIMIT.per_minute,
+            per_day=args.client_per_day or MOUSER_RATE_LIMIT.per_day
+        )
+    )
+    service.start()
+
+    submitted: dict[str, float] = {}    # part number -> time of the scan whose result is awaited
+    latencies: list[float] = []
+    images: list[PartImage] = []
+    scans = 0
+
+    def collect() -> None:
+        now = time.monotonic()
+        for info in service.poll():
+            if isinstance(info, PartImage):
+                images.append(info)
+                continue
+            scan_time = submitted.pop(info.supplier_part_number, None)
+            # revalidated cache entries are delivered a second time
+            if scan_time is not None:
+                latencies.append(now - scan_time)
+
+    start = time.monotonic()
+    while (now := time.monotonic()) - start < args.duration:
+        if now >= start + scans / args.rate:
+            part_number = random.choice(part_numbers)
+            submitted.setdefault(part_number, now)
+            service.submit(ecia_code(part_number))
+            scans += 1
+        collect()
+        time.sleep(POLL_INTERVAL)
+    scan_end = time.monotonic()
+    while service.outstanding and time.monotonic() - scan_end < DRAIN_TIMEOUT:
+        collect()
+        time.sleep(POLL_INTERVAL)
+    collect()
+    elapsed = time.monotonic() - start
+    service.stop()
+    if cache_dir is not None:
+        cache_dir.cleanup()
+
+    unanswered = len(submitted)
+    expected_missing = sum(1 for part_number in submitted if part_number.startswith(NOT_FOUND_PREFIX))
+    print(f"{scans} scans of {args.parts} part numbers at {args.rate}/s in {elapsed:.1f} s")
+    if latencies:
+        ms = sorted(latency * 1000 for latency in latencies)
+        print(
+            f"Lookup latency: mean {statistics.fmean(ms):7.1f} ms, p50 {_percentile(ms, 0.5):7.1f} ms, "
+            f"p90 {_percentile(ms, 0.9):7.1f} ms, p99 {_percentile(ms, 0.99):7.1f} ms, max {ms[-1]:7.1f} ms"
+        )
+    print(f"Throughput: {len(latencies) / elapsed:.2f} parts/s, {len(latencies)} delivered, {len(images)} images")
+    print(f"Unanswered: {unanswered} ({expected_missing} not found on purpose, {unanswered - expected_missing} failed)")
+    print(f"Lookup service: {metrics.values()}")
+    if fake is not None:
+        print(f"Fake server: {fake.stats}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=2.0, help="scans per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to scan")
+    parser.add_argument("--parts", type=int, default=50, help="distinct part numbers scanned")
+    parser.add_argument("--not-found", type=float, default=0.0, help="fraction of part numbers that don't exist")
+    parser.add_argument("--cache", action="store_true", help="use a (new, temporary) part cache")
+    parser.add_argument("--client-per-minute", type=int, default=0, help="client rate limit, 0 for Mouser's")
+    parser.add_argument("--client-per-day", type=int, default=0, help="client rate limit, 0 for Mouser's")
+    parser.add_argument("--url", help="API URL of an already running fake server, e.g. http://127.0.0.1:8300/api/v1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port of the fake server started otherwise")
+    add_arguments(parser)
+    args = parser.parse_args()
+    return run(args)
+
+
+if __name__ == "__main__":
+    exit(main())
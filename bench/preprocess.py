@@ -0,0 +1,102 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+19.10.26 02:30
+
+Benchmark of the preprocessing configurations over the synthetic label corpus.
+
+Feeds the corpus images (converted to BGR like camera frames) through every
+preprocessing configuration and the scanner, and reports per frame the
+decoder input size, preprocessing and decode time and the detection rate,
+compared to decoding the RGB frames as before the preprocessing stage:
+
+    python -m bench.preprocess [--count N] [--repeat N] [--configs gray downscale_1280 ...]
+"""
+
+import argparse
+import statistics
+import time
+import cv2
+
+from src.scanner import Scanner, CodeResult
+from src.preprocess import Preprocessor, PreprocessConfig
+from bench.corpus import generate_corpus, Sample
+
+
+RGB = "rgb"     # the frame converted to RGB and passed to the decoders as it is
+CONFIGS: dict[str, PreprocessConfig | None] = {
+    RGB: None,
+    "gray": PreprocessConfig(),
+    "downscale_1280": PreprocessConfig(max_width=1280),
+    "downscale_960": PreprocessConfig(max_width=960),
+    "clahe": PreprocessConfig(clahe=True),
+    "sharpen": PreprocessConfig(sharpen=True),
+    "threshold": PreprocessConfig(adaptive_threshold=True),
+    "1280_clahe_sharpen": PreprocessConfig(max_width=1280, clahe=True, sharpen=True),
+}
+
+
+def run_config(config: PreprocessConfig | None, frames: list[tuple[Sample, cv2.typing.MatLike]], repeat: int) -> dict:
+    preprocessor = Preprocessor(config)
+    input_bytes: list[int] = []
+    preprocess_times: list[float] = []
+    decode_times: list[float] = []
+    detected: list[bool] = []
+
+    for sample, frame in frames:
+        for _ in range(repeat):
+            scanner = Scanner()
+            scanner.check_datamatrix_2d = True
+            scanner.check_barcode_128 = True
+            scanner.check_qr_code = True
+
+            start = time.perf_counter()
+            if config is None:
+                image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            else:
+                image = preprocessor.process(frame)
+            preprocess_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            codes: list[CodeResult] = scanner.scan_for_codes(image)
+            decode_times.append(time.perf_counter() - start)
+        input_bytes.append(image.nbytes)
+        detected.append(any(code.data == sample.data for code in codes))
+
+    return {
+        "input_kb": statistics.fmean(input_bytes) / 1024,
+        "preprocess_ms": statistics.median(preprocess_times) * 1000,
+        "decode_ms": statistics.median(decode_times) * 1000,
+        "detection_rate": sum(detected) / len(detected),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed")
+    parser.add_argument("--count", type=int, default=None, help="only use the first N corpus samples")
+    parser.add_argument("--repeat", type=int, default=1, help="process every sample N times")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=list(CONFIGS))
+    args = parser.parse_args()
+
+    print("Generating corpus...")
+    corpus = generate_corpus(args.seed, args.count)
+    frames = [(sample, cv2.cvtColor(sample.image, cv2.COLOR_RGB2BGR)) for sample in corpus]
+    print(f"{len(corpus)} samples")
+
+    results = {name: run_config(CONFIGS[name], frames, args.repeat) for name in dict.fromkeys([RGB] + args.configs)}
+    baseline = results[RGB]
+    for name, result in results.items():
+        total_ms = result["preprocess_ms"] + result["decode_ms"]
+        baseline_ms = baseline["preprocess_ms"] + baseline["decode_ms"]
+        print(
+            f"{name:>18}: input {result['input_kb']:7.0f} kB ({baseline['input_kb'] / result['input_kb']:4.1f}x smaller), "
+            f"preprocess {result['preprocess_ms']:5.2f} ms, decode {result['decode_ms']:7.1f} ms "
+            f"({baseline_ms / total_ms:4.1f}x faster in total), detected {result['detection_rate']:.1%}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
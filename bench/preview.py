@@ -0,0 +1,127 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 21:20
+
+Camera preview rendering benchmark.
+
+Compares the UI thread time per frame of the previous preview path (full size
+frame -> PIL thumbnail -> new letterboxed image -> new CTkImage) with the
+current one (frame letterboxed by PreviewRenderer in the worker, copied into
+a reused image and pasted into a reused photo image). The worker side time
+of PreviewRenderer is reported separately.
+
+    python -m bench.preview [--frames N] [--size 1920x1080]
+
+The Tk parts need a display, without one only the PIL parts are measured.
+"""
+
+import argparse
+import statistics
+import time
+import tkinter
+import numpy
+from PIL import Image, ImageTk
+
+from src.preview import PreviewRenderer, PREVIEW_SIZE
+
+
+def _summary(name: str, seconds: list[float]) -> None:
+    ms = sorted(s * 1000 for s in seconds)
+    print(
+        f"{name:>18}: mean {statistics.fmean(ms):6.2f} ms, p50 {ms[len(ms) // 2]:6.2f} ms, "
+        f"p90 {ms[int(len(ms) * 0.9)]:6.2f} ms, max {ms[-1]:6.2f} ms"
+    )
+
+
+def make_frames(size: tuple[int, int], count: int = 8) -> list[numpy.ndarray]:
+    """
+    A few different noisy frames, so no stage can profit from identical input.
+    """
+    rng = numpy.random.default_rng(0)
+    width, height = size
+    gradient = numpy.linspace(0, 255, width, dtype=numpy.float32)
+    frames: list[numpy.ndarray] = []
+    for _ in range(count):
+        noise = rng.normal(0, 20, (height, width, 3))
+        frames.append((gradient[None, :, None] + noise).clip(0, 255).astype(numpy.uint8))
+    return frames
+
+
+def old_preview(frame: numpy.ndarray, label) -> None:
+    """
+    The preview path before PreviewRenderer, as it was in MainWindow.set_camera_image().
+    """
+    img = Image.fromarray(frame)
+    img.thumbnail(size=PREVIEW_SIZE)
+    w, h = img.size
+    background = Image.new("RGB", PREVIEW_SIZE, "black")
+    background.paste(img, ((PREVIEW_SIZE[0] - w) // 2, (PREVIEW_SIZE[1] - h) // 2))
+    if label is not None:
+        import customtkinter as ctk
+        label.configure(image=ctk.CTkImage(light_image=background, size=PREVIEW_SIZE))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=300, help="frames rendered per path")
+    parser.add_argument("--size", default="1920x1080", help="camera frame size WIDTHxHEIGHT")
+    args = parser.parse_args()
+    size = tuple(int(v) for v in args.size.split("x"))
+
+    root = None
+    try:
+        import customtkinter as ctk
+        root = ctk.CTk()
+    except (ImportError, tkinter.TclError) as e:
+        print(f"No Tk available ({e}), only measuring the PIL parts")
+
+    frames = make_frames(size)
+    old_label = new_photo = None
+    new_image = Image.new("RGB", PREVIEW_SIZE, (0, 0, 0))
+    if root is not None:
+        old_label = ctk.CTkLabel(root, text="")
+        old_label.grid(row=0, column=0)
+        new_photo = ImageTk.PhotoImage(new_image)
+        new_label = tkinter.Label(root, image=new_photo, borderwidth=0)
+        new_label.grid(row=0, column=1)
+        root.update()
+
+    old_times: list[float] = []
+    for index in range(args.frames):
+        start = time.perf_counter()
+        old_preview(frames[index % len(frames)], old_label)
+        if root is not None:
+            root.update_idletasks()
+        old_times.append(time.perf_counter() - start)
+
+    renderer = PreviewRenderer()
+    render_times: list[float] = []
+    new_times: list[float] = []
+    for index in range(args.frames):
+        # worker side
+        start = time.perf_counter()
+        preview = renderer.render(frames[index % len(frames)])
+        render_times.append(time.perf_counter() - start)
+        # UI side
+        start = time.perf_counter()
+        new_image.frombytes(preview)
+        if new_photo is not None:
+            new_photo.paste(new_image)
+            root.update_idletasks()
+        new_times.append(time.perf_counter() - start)
+
+    print(f"{args.frames} frames of {size[0]}x{size[1]} into {PREVIEW_SIZE[0]}x{PREVIEW_SIZE[1]}, UI thread time:")
+    _summary("previous", old_times)
+    _summary("current", new_times)
+    print("Worker time:")
+    _summary("PreviewRenderer", render_times)
+
+    if root is not None:
+        root.destroy()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,134 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+19.10.26 03:30
+
+Decoder benchmark over a recorded session.
+
+Replays a recording (see src/recording.py, recorded with the environment
+variable GETPARTS_RECORDING_DIR set) as fast as possible through VideoSource,
+so every frame is decoded exactly once in the original order, and decodes it
+with the scanner configured like in the image worker. Reports decode latency
+percentiles, throughput and the codes found. Results can be written as JSON
+and compared against a previous run of the same recording:
+
+    python -m bench.replay session.gprec --json new.json [--compare old.json] [--preprocess gray] [--budget 0.016] [--roi-tracking]
+
+When comparing, the exit code is 1 if decoding got slower (p50) by more than
+the tolerance or fewer distinct codes were found.
+"""
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+from src.video_source import VideoSource
+from src.recording import Recording, REPLAY_FAST_PREFIX
+from src.scanner import Scanner
+from src.preprocess import Preprocessor
+from bench.preprocess import CONFIGS
+
+
+LATENCY_TOLERANCE = 0.10    # relative p50 increase that counts as a regression
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def replay(path: Path, preprocess: str, budget: float | None, roi_tracking: bool) -> dict:
+    frame_count = Recording(path).frame_count
+    camera = VideoSource(threaded=True)
+    preprocessor = Preprocessor(CONFIGS[preprocess])
+    scanner = Scanner()
+    scanner.roi_tracking = roi_tracking
+    scanner.candidate_search = True
+    scanner.check_qr_code = True
+    scanner.set_decode_budget(budget)
+
+    latencies: list[float] = []
+    frames_with_codes = 0
+    codes_found: set[str] = set()
+    total_start = time.perf_counter()
+    for _ in range(frame_count):
+        captured = camera.read(REPLAY_FAST_PREFIX + str(path), wait_new=True)
+        if captured.sequence < 0:
+            raise RuntimeError(f"couldn't replay {path}")
+        start = time.perf_counter()
+        codes = scanner.scan_for_codes(preprocessor.process(captured.image))
+        latencies.append(time.perf_counter() - start)
+        frames_with_codes += bool(codes)
+        codes_found.update(f"{code.type.name}:{code.data.decode('latin-1')}" for code in codes)
+    total_time = time.perf_counter() - total_start
+
+    ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        "frames": len(ms),
+        "mean_ms": statistics.fmean(ms),
+        "p50_ms": _percentile(ms, 0.50),
+        "p90_ms": _percentile(ms, 0.90),
+        "p99_ms": _percentile(ms, 0.99),
+        "max_ms": ms[-1],
+        "throughput_fps": len(ms) / total_time,
+        "frames_with_codes": frames_with_codes,
+        "codes": sorted(codes_found),
+    }
+
+
+def compare(old: dict, new: dict) -> bool:
+    """
+    Prints the differences between two replay results.
+
+    :returns: True if there are regressions
+    """
+    latency_change = new["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] > 0 else 0.0
+    lost = sorted(set(old["codes"]) - set(new["codes"]))
+    slower = latency_change > LATENCY_TOLERANCE
+    print(
+        f"p50 {old['p50_ms']:7.1f} -> {new['p50_ms']:7.1f} ms ({latency_change:+.0%}){' SLOWER' if slower else ''}, "
+        f"frames with codes {old['frames_with_codes']} -> {new['frames_with_codes']}, "
+        f"codes {len(old['codes'])} -> {len(new['codes'])}"
+    )
+    for code in lost:
+        print(f"  no longer found: {code}")
+    return slower or bool(lost)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", type=Path)
+    parser.add_argument("--preprocess", choices=[name for name, config in CONFIGS.items() if config is not None], default="gray")
+    parser.add_argument("--budget", type=float, default=None, help="datamatrix decode budget in seconds, fixed parameters if not set")
+    parser.add_argument("--roi-tracking", action="store_true", help="only decode datamatrices around the ones of the last frame")
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    parser.add_argument("--compare", type=Path, help="previous results to compare against")
+    args = parser.parse_args()
+
+    result = replay(args.recording, args.preprocess, args.budget, args.roi_tracking)
+    print(
+        f"{result['frames']} frames: mean {result['mean_ms']:7.1f} ms, p50 {result['p50_ms']:7.1f} ms, "
+        f"p90 {result['p90_ms']:7.1f} ms, p99 {result['p99_ms']:7.1f} ms, {result['throughput_fps']:6.1f} fps, "
+        f"{result['frames_with_codes']} frames with codes, {len(result['codes'])} distinct codes"
+    )
+
+    if args.json is not None:
+        args.json.write_text(json.dumps({
+            "recording": str(args.recording),
+            "preprocess": args.preprocess,
+            "budget": args.budget,
+            "roi_tracking": args.roi_tracking,
+            "result": result,
+        }, indent=2))
+
+    if args.compare is not None:
+        print(f"\nCompared to {args.compare}:")
+        if compare(json.loads(args.compare.read_text())["result"], result):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,98 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 14:30
+
+Measures the datamatrix decode speedup of ROI tracking.
+
+Runs the scanner over all frames of a video file or a recorded session (see
+src/recording.py), once scanning the entire frame every time and once with
+ROI tracking, and compares decode time and the number of detected codes.
+The frames are preprocessed like in the image worker (grayscale at full
+resolution). The speedup depends on the camera resolution and how much of
+the frame the labels cover, so measure it with the camera ROI tracking is
+meant to be used with before enabling it (ROI_TRACKING in main.py).
+
+Usage (from the repository root):
+
+    python -m bench.roi_tracking <video file or recording> [--max-frames N] [--candidate-search]
+"""
+
+import argparse
+import statistics
+import time
+from pathlib import Path
+import cv2
+
+from src.scanner import Scanner
+from src.preprocess import Preprocessor
+from src.recording import ReplayCapture, RECORDING_SUFFIX
+
+
+def run(path: str, roi_tracking: bool, candidate_search: bool, max_frames: int) -> tuple[list[float], int]:
+    """
+    :returns: per-frame decode times in seconds and the total number of detected datamatrices
+    """
+    if path.endswith(RECORDING_SUFFIX):
+        cap = ReplayCapture(Path(path), realtime=False)
+    else:
+        cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise SystemExit(f"Couldn't open '{path}'")
+
+    preprocessor = Preprocessor()
+    scanner = Scanner()
+    scanner.check_barcode_128 = False
+    scanner.check_qr_code = False
+    scanner.roi_tracking = roi_tracking
+    scanner.candidate_search = candidate_search
+
+    times: list[float] = []
+    detections = 0
+    while len(times) < max_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frame = preprocessor.process(frame)
+        start = time.perf_counter()
+        detections += len(scanner.scan_for_codes(frame))
+        times.append(time.perf_counter() - start)
+
+    cap.release()
+    if roi_tracking:
+        print(f"  {scanner.stats}")
+        print(f"  mean ROI scan: {scanner.stats.mean_roi_time * 1000:.1f} ms, mean full scan: {scanner.stats.mean_full_time * 1000:.1f} ms")
+    return times, detections
+
+
+def summarize(name: str, times: list[float], detections: int) -> None:
+    ms = sorted(t * 1000 for t in times)
+    print(
+        f"{name:>10}: {len(ms)} frames, {detections} codes, "
+        f"mean {statistics.fmean(ms):.1f} ms, p50 {ms[len(ms) // 2]:.1f} ms, "
+        f"p95 {ms[min(len(ms) - 1, int(len(ms) * 0.95))]:.1f} ms"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", help="video file or recording to scan")
+    parser.add_argument("--max-frames", type=int, default=300)
+    parser.add_argument("--candidate-search", action="store_true", help="only decode candidate regions in full frame scans, like the image worker")
+    args = parser.parse_args()
+
+    full_times, full_detections = run(args.video, False, args.candidate_search, args.max_frames)
+    roi_times, roi_detections = run(args.video, True, args.candidate_search, args.max_frames)
+    if not full_times or not roi_times:
+        print("No frames read")
+        return 1
+
+    summarize("full frame", full_times, full_detections)
+    summarize("ROI", roi_times, roi_detections)
+    print(f"speedup: {statistics.fmean(full_times) / statistics.fmean(roi_times):.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
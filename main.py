@@ -10,50 +10,153 @@ inspired by maholli/getparts.
 
 import asyncio
 import multiprocessing as mp
+import os
+import time
 
 from src.ui import MainWindow
-from src.img_process import async_pipe_recv, image_process, WorkerCommand, WorkerResponse
+from src.img_process import image_process, WorkerCommand, WorkerResponse, PartInfoResponse, PartImageResponse, FrameAck
+from src.frame_transport import FrameRingReader
+from src.preprocess import PreprocessConfig
+from src.async_channel import AsyncChannel
+from src.instrumentation import PipelineMetrics, STAGE_TRANSPORT, STAGE_DISPLAY, STAGE_END_TO_END
 
 
-FRAME_RATE = 30 
+FRAME_RATE = 30
 FRAME_TIME = int(1000 / FRAME_RATE)
+DECODER_POOL_DEPTH = 1  # 0 to decode in the image worker itself, > 1 to also decode successive frames in parallel
+CHANGE_GATING = True    # only decode while the scene changes
+# only decode datamatrices around the ones found in the last frame, check the speedup
+# with the camera first (python -m bench.roi_tracking <video or recording>)
+ROI_TRACKING = False
+ADAPTIVE_DECODING = True    # tune the datamatrix decoder parameters to stay within the decode budget
+DECODE_BUDGET = 0.5 / FRAME_RATE    # seconds per frame for datamatrix decoding, the rest is left for the other stages
+LOOKUP_SUPPRESS_WINDOW = 30.0   # seconds in which a code that has been looked up isn't looked up again when it comes back
+# grayscale at full resolution, set max_width to decode downscaled frames (small codes may no longer decode)
+PREPROCESS_CONFIG = PreprocessConfig(max_width=None, clahe=False, sharpen=False, adaptive_threshold=False)
+# record all captured frames to a new file in this folder to replay them later (video source "replay:<file>")
+RECORDING_DIR = os.environ.get("GETPARTS_RECORDING_DIR")
+SETTINGS_CHECK_INTERVAL = 0.1   # seconds between checks for changed settings
+WORKER_EXIT_TIMEOUT = 5.0       # seconds to wait for the image worker to exit before terminating it
+
+
+EXIT_COMMAND = WorkerCommand(
+    exit=True,
+    video_source="",
+    enable_datamatrix=False,
+    enable_barcode_128=False,
+    enable_qrcode=False,
+    decode_budget=None
+)
+
+
+def current_command(window: MainWindow) -> WorkerCommand:
+    return WorkerCommand(
+        exit=False,
+        video_source=window.video_source,
+        enable_datamatrix=window.enable_datamatrix,
+        enable_barcode_128=window.enable_barcode_128,
+        enable_qrcode=window.enable_qrcode,
+        decode_budget=DECODE_BUDGET if ADAPTIVE_DECODING else None
+    )
+
+
+async def send_settings(window: MainWindow, channel: AsyncChannel) -> None:
+    """
+    Sends the worker settings whenever they change and the exit command once the window is closed.
+    """
+    cmd: WorkerCommand | None = None
+    while not window.exited:
+        new_cmd = current_command(window)
+        if new_cmd != cmd:
+            cmd = new_cmd
+            channel.send(cmd)
+        await asyncio.sleep(SETTINGS_CHECK_INTERVAL)
+
+    # tell process to stop, it then closes its end of the pipe which ends the message stream
+    channel.send(EXIT_COMMAND)
+
+
+def show_lookup_result(window: MainWindow, resp: object) -> bool:
+    """
+    Part infos and images are sent separately whenever they are available.
+
+    :returns: True if resp was a lookup result and has been shown
+    """
+    if isinstance(resp, PartInfoResponse):
+        window.set_part_info(resp.part_info)
+    elif isinstance(resp, PartImageResponse):
+        window.add_part_image(resp.part_image)
+    else:
+        return False
+    return True
 
 
 async def image_pipeline(window: MainWindow) -> None:
     # start image worker
     main_pipe, worker_pipe = mp.Pipe(duplex=True)
-    process = mp.Process(target=image_process, args=(worker_pipe,))
+    process = mp.Process(target=image_process, args=(worker_pipe, DECODER_POOL_DEPTH, CHANGE_GATING, LOOKUP_SUPPRESS_WINDOW, PREPROCESS_CONFIG, RECORDING_DIR, ROI_TRACKING))
     process.start()
+    # only the worker may keep its end open, otherwise we would never see the end of the stream
+    worker_pipe.close()
+    channel = AsyncChannel(main_pipe)
+    settings_task = asyncio.create_task(send_settings(window, channel))
+    frame_ring = FrameRingReader()
+    metrics = PipelineMetrics()
+    window.metrics = metrics
+    skipped_frames = 0
+
+    async for resp in channel:
+        if show_lookup_result(window, resp):
+            continue
+
+        # if the UI is slower than the worker, more frames may already be waiting, only show the newest one
+        while isinstance(resp, WorkerResponse) and channel.poll():
+            try:
+                newer = channel.recv_nowait()
+            except EOFError:
+                break
+            if show_lookup_result(window, newer):
+                continue
+            # same as below, the worker may already have exited
+            if not window.exited:
+                channel.send(FrameAck(resp.frame.sequence))
+            skipped_frames += 1
+            metrics.set_values({"preview_skipped": skipped_frames})
+            resp = newer
 
-    while not window.exited:
-        main_pipe.send(WorkerCommand(
-            exit=False, 
-            video_source=window.video_source, 
-            enable_datamatrix=window.enable_datamatrix,
-            enable_barcode_128=window.enable_barcode_128,
-            enable_qrcode=window.enable_qrcode
-        ))
-
-        resp = await async_pipe_recv(main_pipe)
         if not isinstance(resp, WorkerResponse):
-            print("Invalid worker response, commanding process exit")
+            print("Invalid worker response, stopping worker")
             break
+        metrics.record(STAGE_TRANSPORT, time.monotonic() - resp.sent_time)
+        metrics.add_samples(resp.stage_samples)
+        metrics.set_values(resp.values)
+
+        # the worker doesn't overwrite the frame before it is acknowledged
+        with metrics.measure(STAGE_DISPLAY):
+            frame = frame_ring.view(resp.frame)
+            if frame is not None:
+                window.set_camera_image(frame)
+            del frame
+        # the worker may already have exited and closed the pipe
+        if not window.exited:
+            channel.send(FrameAck(resp.frame.sequence))
+        metrics.record(STAGE_END_TO_END, time.monotonic() - resp.capture_time)
+        metrics.frame_done()
 
-        window.set_camera_image(resp.frame)
-        if resp.part_info is not None:
-            window.set_part_info(resp.part_info)
-
-        await asyncio.sleep(0.02)
-    
-    # tell process to stop
-    main_pipe.send(WorkerCommand(
-        exit=True, 
-        video_source="", 
-        enable_datamatrix=False,
-        enable_barcode_128=False,
-        enable_qrcode=False
-    ))
-    process.join()
+    settings_task.cancel()
+    # the stream can also end because of an invalid message, so make sure the worker stops in any case
+    if process.is_alive():
+        try:
+            channel.send(EXIT_COMMAND)
+        except OSError:
+            pass    # worker has already closed the pipe
+    channel.close()
+    process.join(WORKER_EXIT_TIMEOUT)
+    if process.is_alive():
+        print("Image worker didn't exit, terminating it")
+        process.terminate()
+        process.join()
+    frame_ring.close()
 
 
 async def main() -> int:
@@ -0,0 +1,101 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 21:45
+
+Asyncio wrapper around a multiprocessing Connection.
+
+The file descriptor of the connection is registered with the event loop
+once for the lifetime of the channel, and a single event is reused to wake
+up the receiver, so receiving costs the same in the first minute and after
+hours of running. Messages can be awaited one by one or streamed with
+"async for", which ends when the other side closes its end of the pipe or
+the channel is closed.
+"""
+
+import asyncio
+import typing
+from multiprocessing.connection import Connection
+
+
+class ChannelClosed(Exception):
+    """
+    Raised by AsyncChannel.recv() once the channel has been closed.
+    """
+
+
+class AsyncChannel:
+    """
+    Sends and asynchronously receives picklable messages over a Connection.
+    Must be created and used from within the event loop.
+    """
+
+    def __init__(self, connection: Connection) -> None:
+        self._connection = connection
+        self._loop = asyncio.get_running_loop()
+        self._readable = asyncio.Event()
+        self._closed = False
+        self._loop.add_reader(self._connection.fileno(), self._readable.set)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def send(self, message: typing.Any) -> None:
+        if self._closed:
+            raise ChannelClosed("Can't send on a closed channel")
+        self._connection.send(message)
+
+    def poll(self) -> bool:
+        """
+        :returns: True if a message (or the end of the stream) can be received without waiting
+        """
+        return not self._closed and self._connection.poll()
+
+    def recv_nowait(self) -> typing.Any:
+        """
+        Receives a message that is already available, only call this after poll() returned True.
+
+        :raises EOFError: if the other side has closed the connection
+        """
+        return self._connection.recv()
+
+    async def recv(self) -> typing.Any:
+        """
+        Waits for the next message. Can be cancelled (e.g. by asyncio.wait_for)
+        without losing messages.
+
+        :returns: the received message
+        :raises EOFError: if the other side has closed the connection
+        :raises ChannelClosed: if the channel is or gets closed while waiting
+        """
+        while True:
+            if self._closed:
+                raise ChannelClosed("Channel has been closed")
+            if self._connection.poll():
+                return self._connection.recv()
+            # the reader callback only runs while we are waiting, so no wakeup can get lost here
+            self._readable.clear()
+            await self._readable.wait()
+
+    def __aiter__(self) -> "AsyncChannel":
+        return self
+
+    async def __anext__(self) -> typing.Any:
+        try:
+            return await self.recv()
+        except (EOFError, ChannelClosed):
+            raise StopAsyncIteration
+
+    def close(self) -> None:
+        """
+        Unregisters the connection from the event loop, wakes up any waiting
+        receivers (they get ChannelClosed) and closes the connection.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._loop.remove_reader(self._connection.fileno())
+        self._readable.set()
+        self._connection.close()
@@ -0,0 +1,74 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 20:10
+
+Change detection in front of the decoders.
+
+Most of the time the camera looks at an empty desk or at a bag that has
+already been decoded. The gate compares a tiny grayscale thumbnail of every
+frame with the one of the last decoded frame and only lets frames through
+to the decoders while the scene changes, plus a few frames after it has
+settled (when the label is sharp again), plus one frame every now and then
+in case a change was too subtle to notice.
+"""
+
+import cv2
+import numpy
+
+
+GATE_SIZE = (64, 36)        # thumbnail size the frames are compared at
+GATE_THRESHOLD = 4.0        # mean absolute gray level difference that counts as change
+GATE_SETTLE_FRAMES = 10     # frames that are still decoded after the last change
+GATE_MAX_SKIP = 30          # decode at least every N frames even if nothing changed
+
+
+class ChangeGate:
+    """
+    Decides per frame whether it is worth decoding.
+    """
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self.skipped = 0
+        self._reference: numpy.ndarray | None = None    # thumbnail of the last decoded frame
+        self._settle = 0        # frames still to decode after the last change
+        self._since_decode = 0
+
+    @property
+    def skip_fraction(self) -> float:
+        return self.skipped / self.frames if self.frames else 0.0
+
+    def rearm(self) -> None:
+        """
+        Decodes the next frames regardless of change, e.g. after the decoder settings changed.
+        """
+        self._settle = GATE_SETTLE_FRAMES
+
+    def should_decode(self, frame: cv2.typing.MatLike) -> bool:
+        """
+        :returns: False if the frame hardly differs from the last decoded one
+            and decoding it would most likely find the same codes again
+        """
+        self.frames += 1
+        thumbnail = cv2.resize(frame, GATE_SIZE, interpolation=cv2.INTER_AREA)
+        if thumbnail.ndim == 3:
+            thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_RGB2GRAY)
+
+        if (
+            self._reference is None
+            or self._reference.shape != thumbnail.shape
+            or cv2.absdiff(thumbnail, self._reference).mean() > GATE_THRESHOLD
+        ):
+            self._settle = GATE_SETTLE_FRAMES
+
+        if self._settle > 0 or self._since_decode >= GATE_MAX_SKIP:
+            self._settle = max(0, self._settle - 1)
+            self._since_decode = 0
+            self._reference = thumbnail
+            return True
+
+        self._since_decode += 1
+        self.skipped += 1
+        return False
@@ -0,0 +1,121 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+19.10.26 01:40
+
+Temporal tracking of scanned codes.
+
+Decides when a code seen by the scanner should be looked up. A code has to
+be decoded in CONFIRM_FRAMES of the last CONFIRM_WINDOW decoded frames
+before it counts as present, which filters out single frame misreads. Only
+a code becoming present triggers a lookup, so a code in view for a long time
+is looked up once, and a code that comes back within the suppression window
+(e.g. when alternating between bags) isn't looked up again at all.
+Recently seen codes are kept in a bounded LRU.
+"""
+
+import collections
+import dataclasses
+import typing
+
+
+CONFIRM_FRAMES = 2      # frames a code has to be decoded in ...
+CONFIRM_WINDOW = 3      # ... out of this many decoded frames to be present
+SUPPRESS_WINDOW = 30.0  # seconds after a lookup in which the same code isn't looked up again
+MAX_TRACKED_CODES = 256
+
+
+@dataclasses.dataclass
+class TrackerStats:
+    issued: int = 0         # lookups triggered
+    suppressed: int = 0     # codes that became present again within the suppression window
+    evicted: int = 0        # codes dropped from the LRU
+
+
+@dataclasses.dataclass
+class _TrackedCode:
+    last_frame: int
+    hits: int = 0           # bit n set if the code was decoded n frames before last_frame
+    present: bool = False
+    last_lookup: float | None = None
+
+
+class CodeTracker:
+    """
+    Tracks the codes of successive decoded frames, see update().
+    """
+
+    def __init__(
+        self,
+        confirm_frames: int = CONFIRM_FRAMES,
+        confirm_window: int = CONFIRM_WINDOW,
+        suppress_window: float = SUPPRESS_WINDOW,
+        max_codes: int = MAX_TRACKED_CODES
+    ) -> None:
+        """
+        :param confirm_frames: frames out of confirm_window a code has to be decoded in to trigger a lookup
+        :param suppress_window: seconds after a lookup during which the code isn't looked up again
+        :param max_codes: codes remembered, the least recently seen one is forgotten first
+        """
+        if not 1 <= confirm_frames <= confirm_window:
+            raise ValueError("confirm_frames has to be between 1 and confirm_window")
+        self._confirm_frames = confirm_frames
+        self._confirm_window = confirm_window
+        self._window_mask = (1 << confirm_window) - 1
+        self._suppress_window = suppress_window
+        self._max_codes = max_codes
+        self._codes: collections.OrderedDict[typing.Hashable, _TrackedCode] = collections.OrderedDict()
+        self._frame = 0
+        self.stats = TrackerStats()
+
+    def update(self, codes: typing.Iterable[typing.Hashable], now: float) -> list[typing.Hashable]:
+        """
+        Records the codes decoded in a frame, call this once per decoded frame (also without codes),
+        but not for frames that weren't decoded (e.g. skipped by the change gate).
+
+        :param now: time of the frame in seconds
+        :returns: the codes that should be looked up now
+        """
+        self._frame += 1
+        lookups: list[typing.Hashable] = []
+        for code in codes:
+            entry = self._codes.get(code)
+            if entry is None:
+                entry = _TrackedCode(last_frame=self._frame)
+                self._codes[code] = entry
+                if len(self._codes) > self._max_codes:
+                    self._codes.popitem(last=False)
+                    self.stats.evicted += 1
+            else:
+                self._codes.move_to_end(code)
+            gap = self._frame - entry.last_frame
+            if gap == 0 and entry.hits & 1:
+                continue    # same code twice in one frame
+            if gap > self._confirm_window:
+                # not decoded in a whole window of frames, so it has left the view
+                entry.hits = 0
+                entry.present = False
+            entry.hits = ((entry.hits << gap) | 1) & self._window_mask
+            entry.last_frame = self._frame
+
+            if entry.present or entry.hits.bit_count() < self._confirm_frames:
+                continue
+            entry.present = True
+            if entry.last_lookup is not None and now - entry.last_lookup < self._suppress_window:
+                self.stats.suppressed += 1
+                continue
+            entry.last_lookup = now
+            self.stats.issued += 1
+            lookups.append(code)
+        return lookups
+
+    def metric_values(self) -> dict[str, float]:
+        """
+        :returns: tracker counters for PipelineMetrics.set_values()
+        """
+        return {
+            "lookups_issued": self.stats.issued,
+            "lookups_suppressed": self.stats.suppressed,
+            "codes_tracked": len(self._codes),
+        }
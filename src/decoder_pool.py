@@ -0,0 +1,277 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 15:20
+
+Pool of decoder processes that decode datamatrices and barcodes concurrently.
+
+Frames are written into a shared memory frame ring once and only the frame
+handle is sent to the decoder processes. Every symbology group (datamatrix
+via libdmtx, 1D/QR via zbar) has its own processes, so a frame is decoded by
+both libraries at the same time on separate cores instead of one after the
+other.
+
+With a pipeline depth > 1, every symbology group gets that many processes
+and successive frames are distributed round-robin between them, so multiple
+frames can be in flight at once. Results are always returned in frame order.
+
+The per-scene state of the datamatrix search (ROI tracking, see TrackingState)
+is sent along with every frame and the state after the newest decoded frame
+is kept, so it doesn't matter which process decodes a frame (the state just
+lags behind by the frames in flight). The DecodeTuner runs in the pool and
+sees the decode times of all frames in order.
+"""
+
+import dataclasses
+import enum
+import multiprocessing as mp
+import time
+import collections
+import cv2
+
+from .frame_transport import FrameRingWriter, FrameRingReader, FrameHandle
+from .scanner import Scanner, CodeResult, CodeType, DmtxParams, DecodeTuner, TrackingState
+from .instrumentation import PipelineMetrics, STAGE_DATAMATRIX, STAGE_BARCODE
+
+
+class Symbology(enum.Enum):
+    DATAMATRIX = 1  # libdmtx
+    BARCODE = 2     # zbar: CODE128 and QR codes
+
+
+@dataclasses.dataclass
+class DecoderConfig:
+    check_datamatrix_2d: bool = True
+    check_barcode_128: bool = True
+    check_qr_code: bool = False
+    roi_tracking: bool = False
+    candidate_search: bool = False
+    dmtx_params: DmtxParams = dataclasses.field(default_factory=DmtxParams)
+    decode_budget: float | None = None  # seconds per frame, the pool tunes dmtx_params like Scanner.set_decode_budget()
+
+
+@dataclasses.dataclass
+class DecodeTask:
+    sequence: int
+    frame: FrameHandle
+    config: DecoderConfig
+    tracking: TrackingState | None = None  # datamatrix tasks only
+
+
+@dataclasses.dataclass
+class DecodeResult:
+    sequence: int
+    symbology: Symbology
+    codes: list[CodeResult]
+    decode_time: float  # seconds spent decoding in the decoder process
+    tracking: TrackingState | None  # state after decoding, datamatrix results only
+
+
+def decoder_process(symbology: Symbology, tasks: mp.Queue, results: mp.Queue) -> None:
+    """
+    Decoder process main function. Decodes the frames of all tasks from the
+    task queue until it receives None.
+    """
+    scanner = Scanner()
+    frame_ring = FrameRingReader()
+
+    while True:
+        task: DecodeTask | None = tasks.get()
+        if task is None:
+            break
+
+        scanner.check_datamatrix_2d = task.config.check_datamatrix_2d
+        scanner.check_barcode_128 = task.config.check_barcode_128
+        scanner.check_qr_code = task.config.check_qr_code
+        scanner.roi_tracking = task.config.roi_tracking
+        scanner.candidate_search = task.config.candidate_search
+        scanner.dmtx_params = task.config.dmtx_params
+        if task.tracking is not None:
+            scanner.tracking = task.tracking
+
+        start = time.perf_counter()
+        codes: list[CodeResult] = []
+        frame = frame_ring.view(task.frame)
+        if frame is None:
+            print(f"Decoder: frame {task.sequence} was overwritten before decoding")
+        elif symbology == Symbology.DATAMATRIX:
+            codes = scanner.scan_datamatrix(frame)
+        else:
+            codes = scanner.scan_barcodes(frame)
+        # release the view before the frame ring can be closed
+        del frame
+
+        decode_time = time.perf_counter() - start
+        tracking = scanner.tracking if task.tracking is not None else None
+        results.put(DecodeResult(task.sequence, symbology, codes, decode_time, tracking))
+
+    frame_ring.close()
+
+
+class DecoderPool:
+    """
+    Decoder processes fed from shared memory, with results merged per frame.
+    """
+
+    def __init__(self, pipeline_depth: int = 1, metrics: PipelineMetrics | None = None) -> None:
+        """
+        :param pipeline_depth: maximum number of frames that can be decoded at the same time
+        :param metrics: optional metrics to record the decode time of each symbology in
+        """
+        self._depth = pipeline_depth
+        self._metrics = metrics
+        # one additional slot for the frame being written while all others are in use
+        self._frame_ring = FrameRingWriter(slot_count=pipeline_depth + 1)
+        self._results: mp.Queue = mp.Queue()
+        self._task_queues: dict[Symbology, list[mp.Queue]] = {}
+        self._processes: list[mp.Process] = []
+        self._next_sequence = 0
+
+        # sequence -> number of symbology results still outstanding, in submission order
+        self._outstanding: collections.OrderedDict[int, int] = collections.OrderedDict()
+        self._partial: dict[int, list[CodeResult]] = {}
+        # datamatrix decode time and codes per sequence, for the tuner
+        self._datamatrix_results: dict[int, tuple[float, list[CodeResult]]] = {}
+        self._tracking = TrackingState()
+        self._tracking_sequence = -1    # frame after which _tracking was returned
+        self._tuner: DecodeTuner | None = None
+        self.config = DecoderConfig()
+        self.decode_time: dict[Symbology, float] = {symbology: 0.0 for symbology in Symbology}
+
+    @property
+    def pipeline_depth(self) -> int:
+        return self._depth
+
+    @property
+    def in_flight(self) -> int:
+        """
+        number of frames that are still being decoded
+        """
+        return sum(1 for remaining in self._outstanding.values() if remaining > 0)
+
+    def _decoding(self, sequence: int) -> bool:
+        return self._outstanding.get(sequence, 0) > 0
+
+    def start(self) -> None:
+        for symbology in Symbology:
+            self._task_queues[symbology] = []
+            for _ in range(self._depth):
+                tasks = mp.Queue()
+                process = mp.Process(
+                    target=decoder_process,
+                    args=(symbology, tasks, self._results),
+                    daemon=True
+                )
+                process.start()
+                self._task_queues[symbology].append(tasks)
+                self._processes.append(process)
+
+    def stop(self) -> None:
+        for queues in self._task_queues.values():
+            for tasks in queues:
+                tasks.put(None)
+        for process in self._processes:
+            process.join()
+        self._processes.clear()
+        self._task_queues.clear()
+        self._frame_ring.close()
+
+    def submit(self, frame: cv2.typing.MatLike) -> int:
+        """
+        Queues a frame for decoding. If pipeline_depth frames are already in flight,
+        this blocks until the oldest one is done (its result stays available to collect()).
+
+        :returns: the sequence number of the frame
+        """
+        sequence = self._next_sequence
+        # also make sure the frame ring slot we are about to overwrite is no longer being decoded
+        while self.in_flight >= self._depth or self._decoding(sequence - self._frame_ring.slot_count):
+            self._receive()
+        # a larger frame re-allocates the ring and unlinks the old one, which the queued frames are still in
+        if not self._frame_ring.fits(frame):
+            while self.in_flight > 0:
+                self._receive()
+
+        self._next_sequence += 1
+        handle = self._frame_ring.publish(frame)
+
+        config = self.config
+        self._update_tuner()
+        if self._tuner is not None:
+            config = dataclasses.replace(config, dmtx_params=self._tuner.params)
+        tracking = self._tracking
+        lag = sequence - 1 - self._tracking_sequence
+        if lag > 0:
+            # count the frames that are still being decoded, so full scans still happen every N frames
+            tracking = dataclasses.replace(
+                tracking,
+                frames_since_full_scan=tracking.frames_since_full_scan + lag,
+                frames_since_exhaustive_scan=tracking.frames_since_exhaustive_scan + lag
+            )
+
+        symbologies: list[Symbology] = []
+        if self.config.check_datamatrix_2d:
+            symbologies.append(Symbology.DATAMATRIX)
+        if self.config.check_barcode_128 or self.config.check_qr_code:
+            symbologies.append(Symbology.BARCODE)
+
+        self._outstanding[sequence] = len(symbologies)
+        self._partial[sequence] = []
+        for symbology in symbologies:
+            # successive frames go to the same process only every pipeline_depth frames
+            queues = self._task_queues[symbology]
+            queues[sequence % len(queues)].put(DecodeTask(
+                sequence, handle, config, tracking if symbology == Symbology.DATAMATRIX else None
+            ))
+        return sequence
+
+    def _update_tuner(self) -> None:
+        budget = self.config.decode_budget
+        if budget is None:
+            self._tuner = None
+        elif self._tuner is None:
+            self._tuner = DecodeTuner(budget, self.config.dmtx_params)
+        else:
+            self._tuner.budget = budget
+
+    def _receive(self) -> None:
+        """
+        Waits for one decode result and merges it into the results of its frame.
+        """
+        result: DecodeResult = self._results.get()
+        self.decode_time[result.symbology] += result.decode_time
+        if self._metrics is not None:
+            stage = STAGE_DATAMATRIX if result.symbology == Symbology.DATAMATRIX else STAGE_BARCODE
+            self._metrics.record(stage, result.decode_time)
+        if result.symbology == Symbology.DATAMATRIX:
+            self._datamatrix_results[result.sequence] = (result.decode_time, result.codes)
+        # results can arrive out of order, the state after the newest frame is the most up to date
+        if result.tracking is not None and result.sequence > self._tracking_sequence:
+            self._tracking = result.tracking
+            self._tracking_sequence = result.sequence
+        self._partial[result.sequence].extend(result.codes)
+        self._outstanding[result.sequence] -= 1
+
+    def collect(self) -> tuple[int, list[CodeResult]] | None:
+        """
+        Waits until the oldest submitted frame has been decoded by all symbologies.
+
+        :returns: sequence number and codes of the oldest frame,
+            datamatrices first like Scanner.scan_for_codes()
+        :returns: None if no frames are in flight
+        """
+        if not self._outstanding:
+            return None
+        sequence = next(iter(self._outstanding))
+        while self._outstanding[sequence] > 0:
+            self._receive()
+        del self._outstanding[sequence]
+        datamatrix_result = self._datamatrix_results.pop(sequence, None)
+        if self._tuner is not None and datamatrix_result is not None:
+            self._tuner.update(*datamatrix_result)
+            if self._metrics is not None:
+                self._metrics.set_values(self._tuner.metric_values())
+        codes = self._partial.pop(sequence)
+        codes.sort(key=lambda code: code.type != CodeType.DATAMATRIX_2D)
+        return sequence, codes
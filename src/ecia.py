@@ -0,0 +1,161 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+19.10.26 00:50
+
+Parser for ECIA (EIGP 114) / ANSI MH10.8.2 labels.
+
+The 2D codes on Mouser and DigiKey bags are format 06 records:
+
+    [)> RS 06 GS <field> GS <field> ... RS EOT
+
+where every field starts with a data identifier (DI: up to three digits and
+an upper case letter, e.g. "1P" or "14K") followed by the value. Fields are
+identified by their DI, so the order of the fields doesn't matter. The known
+DIs are compiled into a table mapping them to record attributes and value
+conversions once on import, so parsing is a single split and a dictionary
+lookup per field, and the record is created once all fields are known.
+"""
+
+import dataclasses
+import re
+
+
+HEADER = b"[)>\x1e06\x1d"
+RECORD_SEPARATOR = b"\x1e"
+GROUP_SEPARATOR = b"\x1d"
+END_OF_TRANSMISSION = b"\x04"
+
+
+@dataclasses.dataclass(slots=True)
+class EciaLabel:
+    customer_po: bytes | None = None                # K
+    supplier_order: bytes | None = None             # 1K
+    invoice: bytes | None = None                    # 10K
+    packing_list: bytes | None = None               # 11K
+    line_item: bytes | None = None                  # 14K
+    customer_part_number: bytes | None = None       # P
+    supplier_part_number: bytes | None = None       # 1P, the manufacturer part number on DigiKey labels
+    distributor_part_number: bytes | None = None    # 30P, e.g. the DigiKey part number
+    quantity: int | None = None                     # Q
+    date_code: bytes | None = None                  # 9D (YYWW) or 10D (YYWW)
+    lot: bytes | None = None                        # 1T
+    country_of_origin: bytes | None = None          # 4L
+    manufacturer: bytes | None = None               # 1V
+    package_id: bytes | None = None                 # 3S
+    other: dict[bytes, bytes] = dataclasses.field(default_factory=dict)     # fields with unknown DI by DI
+    errors: list[str] = dataclasses.field(default_factory=list)            # problems found while parsing
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+    @property
+    def lookup_part_number(self) -> bytes | None:
+        """
+        :returns: the part number to search the part by at the distributor
+        """
+        return self.distributor_part_number or self.supplier_part_number
+
+    @property
+    def dedup_key(self) -> tuple:
+        """
+        :returns: key identifying the physical bag, equal for repeated scans of the same label
+        """
+        return (
+            self.lookup_part_number,
+            self.customer_po,
+            self.line_item,
+            self.packing_list,
+            self.lot,
+            self.date_code,
+            self.quantity,
+        )
+
+
+def _parse_quantity(value: bytes) -> int | None:
+    return int(value) if value.isdigit() else None
+
+
+# DI -> record attribute and value conversion (None if the value is stored as it is)
+_FIELDS: dict[bytes, tuple[str, object]] = {
+    b"K": ("customer_po", None),
+    b"1K": ("supplier_order", None),
+    b"10K": ("invoice", None),
+    b"11K": ("packing_list", None),
+    b"14K": ("line_item", None),
+    b"P": ("customer_part_number", None),
+    b"1P": ("supplier_part_number", None),
+    b"30P": ("distributor_part_number", None),
+    b"Q": ("quantity", _parse_quantity),
+    b"9D": ("date_code", None),
+    b"10D": ("date_code", None),
+    b"1T": ("lot", None),
+    b"4L": ("country_of_origin", None),
+    b"1V": ("manufacturer", None),
+    b"3S": ("package_id", None),
+}
+_DI_PATTERN = re.compile(rb"[0-9]{0,3}[A-Z]")
+
+
+def parse_ecia(code_data: bytes) -> EciaLabel | None:
+    """
+    Parses the data of an ECIA label code. The returned label contains all
+    fields that could be parsed, errors lists what was wrong with the rest.
+
+    :returns: the parsed label
+    :returns: None if the data isn't a format 06 record
+    """
+    start = code_data.find(HEADER)
+    if start < 0:
+        return None
+    body = code_data[start + len(HEADER):]
+    end = body.find(RECORD_SEPARATOR)
+    if end >= 0:
+        body = body[:end]
+    elif body.endswith(END_OF_TRANSMISSION):
+        body = body[:-1]
+
+    values: dict[str, object] = {}
+    other: dict[bytes, bytes] = {}
+    errors: list[str] = []
+    for field in body.split(GROUP_SEPARATOR):
+        if not field:
+            continue    # e.g. a trailing separator
+        # the DI ends with the first letter, which is at most the 4th character (> "9" is faster than isalpha())
+        if field[0] > 0x39:
+            length = 1
+        elif len(field) > 1 and field[1] > 0x39:
+            length = 2
+        else:
+            length = 3
+        known = _FIELDS.get(field[:length])
+        if known is None:
+            # not a known field, keep it if it at least has a valid DI
+            match = _DI_PATTERN.match(field)
+            if match is None:
+                errors.append(f"field without data identifier: {field[:16]!r}")
+            else:
+                other[match.group()] = field[match.end():]
+            continue
+        attribute, convert = known
+        if attribute in values:
+            errors.append(f"duplicate field {field[:length].decode()}")
+            continue
+        value = field[length:]
+        if convert is not None:
+            value = convert(value)
+            if value is None:
+                errors.append(f"invalid value for {field[:length].decode()}: {field[length:length + 16]!r}")
+                continue
+        values[attribute] = value
+
+    label = EciaLabel(**values, other=other, errors=errors)
+    if not label.lookup_part_number:
+        label.errors.append("no part number (1P or 30P)")
+    if label.quantity == 0:
+        label.errors.append("quantity is zero")
+    if label.date_code is not None and not (label.date_code.isdigit() and len(label.date_code) in (4, 6)):
+        label.errors.append(f"invalid date code: {label.date_code[:16]!r}")
+    return label
@@ -0,0 +1,233 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 10:12
+
+Shared memory frame transport between the image worker and the UI process.
+
+Instead of pickling entire frames through the pipe, the worker writes each
+frame into one slot of a ring of shared memory frame buffers and only sends
+a small FrameHandle describing where to find it. The receiving side can then
+wrap the slot directly as a numpy array without any copying.
+
+Memory layout of a ring:
+
+    | header: slot_count x int64 sequence numbers | slot 0 | slot 1 | ... |
+
+The header stores the sequence number of the frame currently held by each
+slot, which allows the reader to detect if a slot has been overwritten
+in the meantime.
+"""
+
+import dataclasses
+import sys
+from multiprocessing import shared_memory, resource_tracker
+import numpy
+
+
+SLOT_ALIGNMENT = 64     # slots start on cache line boundaries
+DEFAULT_SLOT_COUNT = 3
+
+
+@dataclasses.dataclass
+class FrameHandle:
+    """
+    Small, cheaply picklable descriptor of a frame stored in a frame ring.
+    """
+    ring_name: str
+    slot_count: int
+    slot_size: int
+    slot: int
+    sequence: int
+    shape: tuple[int, ...]
+    dtype: str
+
+
+def _align(size: int) -> int:
+    return (size + SLOT_ALIGNMENT - 1) // SLOT_ALIGNMENT * SLOT_ALIGNMENT
+
+
+def _header_size(slot_count: int) -> int:
+    return _align(slot_count * numpy.dtype(numpy.int64).itemsize)
+
+
+def _attach_untracked(name: str) -> shared_memory.SharedMemory:
+    """
+    Attaches to an existing shared memory block without registering it with the
+    resource tracker. The writer owns the block and unlinks it. Otherwise the
+    tracker of the reading process would unlink it as "leaked" when the reader
+    exits, or, if the tracker is shared with the writer (forked processes),
+    drop the writer's registration.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class FrameRingWriter:
+    """
+    Owner and writer of a frame ring. The ring is allocated lazily on the first
+    published frame and transparently re-allocated (under a new name) if a
+    frame no longer fits into the slots, e.g. after switching to a camera with
+    a higher resolution.
+
+    Slots are reused in round-robin order, so a frame handle stays valid until
+    slot_count more frames have been published. The reader has to be done with
+    a frame before that happens (or check FrameRingReader.is_valid()).
+    """
+
+    def __init__(self, slot_count: int = DEFAULT_SLOT_COUNT) -> None:
+        self._slot_count = slot_count
+        self._slot_size: int = 0
+        self._shm: shared_memory.SharedMemory | None = None
+        self._sequences: numpy.ndarray | None = None
+        self._next_sequence: int = 0
+
+    @property
+    def slot_count(self) -> int:
+        return self._slot_count
+
+    def _allocate(self, min_slot_size: int) -> None:
+        """
+        (Re-)allocates the shared memory block so every slot can hold
+        at least min_slot_size bytes. The previous block is unlinked,
+        readers that still have it mapped can continue using it until
+        they notice the name change.
+        """
+        self._release()
+        self._slot_size = _align(min_slot_size)
+        header_size = _header_size(self._slot_count)
+        self._shm = shared_memory.SharedMemory(
+            create=True,
+            size=header_size + self._slot_count * self._slot_size
+        )
+        self._sequences = numpy.ndarray(
+            (self._slot_count, ),
+            dtype=numpy.int64,
+            buffer=self._shm.buf[:header_size]
+        )
+        self._sequences[:] = -1
+        print(f"Allocated frame ring '{self._shm.name}' with {self._slot_count} slots of {self._slot_size} bytes")
+
+    def fits(self, frame: numpy.ndarray) -> bool:
+        """
+        :returns: False if publishing the frame re-allocates the ring, which invalidates all previous handles
+        """
+        return self._shm is not None and frame.nbytes <= self._slot_size
+
+    def publish(self, frame: numpy.ndarray) -> FrameHandle:
+        """
+        Copies a frame into the next free slot of the ring.
+
+        :returns: the handle which can be sent to the reading process
+        """
+        if self._shm is None or frame.nbytes > self._slot_size:
+            self._allocate(frame.nbytes)
+
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        slot = sequence % self._slot_count
+
+        offset = _header_size(self._slot_count) + slot * self._slot_size
+        target = numpy.ndarray(
+            frame.shape,
+            dtype=frame.dtype,
+            buffer=self._shm.buf[offset:offset + frame.nbytes]
+        )
+        numpy.copyto(target, frame)
+        self._sequences[slot] = sequence
+
+        return FrameHandle(
+            ring_name=self._shm.name,
+            slot_count=self._slot_count,
+            slot_size=self._slot_size,
+            slot=slot,
+            sequence=sequence,
+            shape=frame.shape,
+            dtype=frame.dtype.str
+        )
+
+    def _release(self) -> None:
+        if self._shm is None:
+            return
+        # drop our own views before closing, otherwise the buffer can't be released
+        self._sequences = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def close(self) -> None:
+        """
+        Releases and unlinks the shared memory block.
+        Must be called before the worker process exits.
+        """
+        self._release()
+
+
+class FrameRingReader:
+    """
+    Reading side of a frame ring, which attaches to the ring named
+    in the received frame handles.
+    """
+
+    def __init__(self) -> None:
+        self._shm: shared_memory.SharedMemory | None = None
+        self._sequences: numpy.ndarray | None = None
+
+    def _attach(self, handle: FrameHandle) -> None:
+        self.close()
+        self._shm = _attach_untracked(handle.ring_name)
+        self._sequences = numpy.ndarray(
+            (handle.slot_count, ),
+            dtype=numpy.int64,
+            buffer=self._shm.buf[:_header_size(handle.slot_count)]
+        )
+
+    def view(self, handle: FrameHandle) -> numpy.ndarray | None:
+        """
+        Wraps the slot referenced by the handle as a numpy array without copying.
+        The array is only valid until the writer reuses the slot, so it should
+        be consumed (or copied) right away.
+
+        :returns: the frame array
+        :returns: None if the frame has already been overwritten
+        """
+        if self._shm is None or self._shm.name != handle.ring_name:
+            self._attach(handle)
+
+        if not self.is_valid(handle):
+            return None
+
+        dtype = numpy.dtype(handle.dtype)
+        nbytes = int(numpy.prod(handle.shape)) * dtype.itemsize
+        offset = _header_size(handle.slot_count) + handle.slot * handle.slot_size
+        return numpy.ndarray(
+            handle.shape,
+            dtype=dtype,
+            buffer=self._shm.buf[offset:offset + nbytes]
+        )
+
+    def is_valid(self, handle: FrameHandle) -> bool:
+        """
+        :returns: True if the slot still holds the frame referenced by the handle
+        """
+        if self._sequences is None or self._shm is None or self._shm.name != handle.ring_name:
+            return False
+        return int(self._sequences[handle.slot]) == handle.sequence
+
+    def close(self) -> None:
+        """
+        Detaches from the current ring. Any arrays returned by view()
+        must no longer be in use when this is called.
+        """
+        if self._shm is None:
+            return
+        self._sequences = None
+        self._shm.close()
+        self._shm = None
@@ -0,0 +1,175 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 23:55
+
+Background writer for part images.
+
+Saving images on the Tk event loop freezes the UI whenever the disk is slow
+(e.g. a network mount), so images are queued and written by a thread
+instead. Images whose content is already stored at the target path (written
+before in this session or found on disk) are skipped, and files are written
+to a temporary file first and then renamed, so a crash never leaves a
+half-written image behind.
+"""
+
+import dataclasses
+import hashlib
+import io
+import os
+import queue
+import tempfile
+import threading
+import time
+from pathlib import Path
+from PIL import Image
+
+from .instrumentation import RollingHistogram
+
+
+MAX_QUEUED_IMAGES = 64
+THUMBNAIL_DIR = "thumbnails"    # folder next to the images the thumbnails are stored in
+THUMBNAIL_QUALITY = 75          # JPEG quality of thumbnails
+
+
+@dataclasses.dataclass
+class ImageWriterStats:
+    written: int = 0
+    duplicates: int = 0     # images that were already stored with the same content
+    failed: int = 0
+    dropped: int = 0        # images not queued because the queue was full
+
+
+@dataclasses.dataclass
+class _WriteJob:
+    path: Path
+    image: Image.Image
+    data: bytes | None
+
+
+class ImageWriter:
+    """
+    Writes images in a background thread. Images are queued with save(),
+    which can be called from any thread and never blocks.
+    """
+
+    def __init__(self, thumbnail_size: tuple[int, int] | None = None, max_queued: int = MAX_QUEUED_IMAGES) -> None:
+        """
+        :param thumbnail_size: if set, a recompressed JPEG thumbnail of at most this size is stored as well
+        :param max_queued: images that can wait to be written, more are dropped
+        """
+        self._thumbnail_size = thumbnail_size
+        self._queue: queue.Queue[_WriteJob | None] = queue.Queue(max_queued)
+        self._hashes: dict[Path, str] = {}     # content hash of every file known to be stored, writer thread only
+        self._thread = threading.Thread(target=self._run, name="ImageWriter", daemon=True)
+        self.stats = ImageWriterStats()
+        self.write_latency = RollingHistogram()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Writes the remaining queued images and stops the writer thread.
+        """
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def save(self, path: Path, image: Image.Image, data: bytes | None = None) -> None:
+        """
+        Queues an image to be written to path.
+
+        :param data: the original file contents if available, which are written as they are,
+            otherwise the image is encoded in the format of the file extension
+        """
+        try:
+            self._queue.put_nowait(_WriteJob(path, image, data))
+        except queue.Full:
+            self.stats.dropped += 1
+            print(f"Image writer queue is full, not saving {path}")
+
+    def metric_values(self) -> dict[str, float]:
+        """
+        :returns: queue depth, counters and write latency for PipelineMetrics.set_values()
+        """
+        latency = self.write_latency.summary()
+        return {
+            "image_queue": self.queue_depth,
+            "images_written": self.stats.written,
+            "image_duplicates": self.stats.duplicates,
+            "image_write_p90_ms": latency.p90_ms if latency is not None else 0.0,
+        }
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            start = time.perf_counter()
+            try:
+                written = self._write(job)
+            except (OSError, ValueError) as e:   # ValueError if the image can't be encoded in that format
+                self.stats.failed += 1
+                print(f"Couldn't save image to {job.path}: {e}")
+                continue
+            if written:
+                self.stats.written += 1
+                self.write_latency.add(time.perf_counter() - start)
+            else:
+                self.stats.duplicates += 1
+
+    def _write(self, job: _WriteJob) -> bool:
+        """
+        :returns: False if the file already had the same content
+        """
+        data = job.data
+        if data is None:
+            buffer = io.BytesIO()
+            job.image.save(buffer, format=Image.registered_extensions().get(job.path.suffix.lower(), "PNG"))
+            data = buffer.getvalue()
+        content_hash = hashlib.sha256(data).hexdigest()
+
+        if job.path not in self._hashes and job.path.exists():
+            self._hashes[job.path] = hashlib.sha256(job.path.read_bytes()).hexdigest()
+        if self._hashes.get(job.path) == content_hash:
+            return False
+
+        job.path.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomic(job.path, data)
+        self._hashes[job.path] = content_hash
+
+        if self._thumbnail_size is not None:
+            thumbnail = job.image.convert("RGB")
+            thumbnail.thumbnail(self._thumbnail_size)
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+            thumbnail_path = job.path.parent / THUMBNAIL_DIR / (job.path.stem + ".jpg")
+            thumbnail_path.parent.mkdir(exist_ok=True)
+            _write_atomic(thumbnail_path, buffer.getvalue())
+        return True
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """
+    Writes data to a temporary file next to path and renames it to path.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
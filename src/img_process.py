@@ -5,104 +5,308 @@ www.elektron.work
 06.07.24 11:51
 
 Image processing worker process
+
+The worker runs freely at the rate of the video source and pushes every
+processed frame (WorkerResponse), finished lookup (PartInfoResponse) and
+part image (PartImageResponse, following its PartInfoResponse) to the main
+process on its own. The main process only sends a WorkerCommand
+when the settings change and acknowledges every frame it is done with
+(FrameAck). When the main process falls behind and too many frames are
+unacknowledged, the worker keeps scanning but drops the preview frames.
 """
 
 from multiprocessing.connection import Connection
-import asyncio
-import typing
 import dataclasses
-from PIL import Image
+import collections
+import time
+from pathlib import Path
 import cv2
 
 from .video_source import VideoSource
-from .scanner import Scanner, CodeType
-from .partinfo import request_part_info_mouser, PartInfo
+from .recording import new_recording_path
+from .frame_transport import FrameRingWriter, FrameHandle
+from .scanner import Scanner, CodeResult
+from .decoder_pool import DecoderPool
+from .change_gate import ChangeGate
+from .preview import PreviewRenderer
+from .preprocess import Preprocessor, PreprocessConfig
+from .code_tracker import CodeTracker, SUPPRESS_WINDOW
+from .instrumentation import (
+    PipelineMetrics,
+    STAGE_CAPTURE,
+    STAGE_CONVERT,
+    STAGE_GATE,
+    STAGE_DATAMATRIX,
+    STAGE_BARCODE,
+    STAGE_DECODE,
+    STAGE_PREVIEW,
+    STAGE_DRAW,
+    STAGE_PUBLISH
+)
+from .partinfo import PartInfo, PartImage
+from .lookup_service import LookupService
+
+
+PLACEHOLDER_INTERVAL = 0.1  # seconds between placeholder frames while the video source can't be opened
+
 
 @dataclasses.dataclass
 class WorkerCommand:
+    """
+    Worker configuration, sent whenever it changes.
+    """
     exit: bool
     video_source: str
     enable_datamatrix: bool
     enable_barcode_128: bool
     enable_qrcode: bool
+    decode_budget: float | None # seconds per frame for datamatrix decoding, None to use fixed decoder parameters
 
 
 @dataclasses.dataclass
 class WorkerResponse:
-    frame: Image.Image
-    part_info: PartInfo | None = None   # optional, only if part info was found
+    frame: FrameHandle  # frame is transferred via shared memory
+    capture_time: float # time.monotonic() at which the frame was captured
+    sent_time: float    # time.monotonic() at which the response was sent
+    stage_samples: dict[str, list[float]]   # worker stage timings since the last response
+    values: dict[str, float]                # current worker metric values
 
 
-async def async_pipe_recv(reader: Connection) -> typing.Any:
+@dataclasses.dataclass
+class FrameAck:
     """
-    Asynchronously ready from a multiprocessing.Pipe Connection object,
-    asynchronously pausing the task until data is available to read.
+    Sent by the main process once it no longer needs a frame (shown or skipped)
+    """
+    sequence: int   # FrameHandle.sequence
 
-    Inspiration: https://stackoverflow.com/a/62098165
-    
-    :returns: The received data
+
+@dataclasses.dataclass
+class PartInfoResponse:
+    """
+    Sent by the worker whenever a part lookup has finished
     """
-    data_available = asyncio.Event()
-    asyncio.get_event_loop().add_reader(reader.fileno(), data_available.set)
+    part_info: PartInfo
 
-    while not reader.poll():
-        await data_available.wait()
-        data_available.clear()
 
-    return reader.recv()
+@dataclasses.dataclass
+class PartImageResponse:
+    """
+    Sent by the worker once the image of a looked up part is available
+    """
+    part_image: PartImage
+
 
+def _to_frame(codes: list[CodeResult], scale: float) -> list[CodeResult]:
+    """
+    Maps codes found in a preprocessed frame to frame coordinates.
 
-def image_process(pipe: Connection) -> None:
-    camera = VideoSource()
+    :param scale: Preprocessor.scale of the frame
+    """
+    if scale == 1.0:
+        return codes
+    return [code.scaled(1 / scale) for code in codes]
+
+
+def image_process(
+    pipe: Connection,
+    decoder_pool_depth: int = 0,
+    change_gating: bool = True,
+    lookup_suppress_window: float = SUPPRESS_WINDOW,
+    preprocess_config: PreprocessConfig | None = None,
+    recording_dir: str | None = None,
+    roi_tracking: bool = False
+) -> None:
+    """
+    Image worker process main function.
+
+    :param decoder_pool_depth: 0 to decode in this process, otherwise the pipeline depth
+        of the DecoderPool used to decode all symbologies (and up to this many successive
+        frames) in parallel. Depths > 1 delay the preview by depth - 1 frames.
+    :param change_gating: only decode frames when the scene changes (see ChangeGate),
+        otherwise the codes of the last decoded frame are kept
+    :param lookup_suppress_window: seconds in which a code that has been looked up isn't looked up again
+    :param preprocess_config: how frames are prepared for decoding, grayscale at full resolution by default
+    :param recording_dir: if set, all captured frames are recorded to a new file in this folder (see recording.py)
+    :param roi_tracking: only decode datamatrices around the ones found in the last frame (see Scanner.roi_tracking)
+    """
+    metrics = PipelineMetrics(forward=True)    # samples are sent to the main process with each frame
+    camera = VideoSource(threaded=True)
+    if recording_dir is not None:
+        camera.start_recording(new_recording_path(Path(recording_dir)))
     scanner = Scanner()
+    scanner.roi_tracking = roi_tracking
+    scanner.candidate_search = True
+    pool: DecoderPool | None = None
+    if decoder_pool_depth > 0:
+        pool = DecoderPool(decoder_pool_depth, metrics)
+        pool.config.roi_tracking = scanner.roi_tracking
+        pool.config.candidate_search = scanner.candidate_search
+        pool.start()
+    gate = ChangeGate() if change_gating else None
+    preprocessor = Preprocessor(preprocess_config)
+    # frames in the decoder pool, their capture times, preprocessing scales and whether they were submitted or skipped by the gate
+    pending_frames: collections.deque[tuple[cv2.typing.MatLike, float, float, bool]] = collections.deque()
+    last_found_codes: list[CodeResult] = []
+    last_enabled: tuple[bool, bool, bool] | None = None
+    renderer = PreviewRenderer()
+    frame_ring = FrameRingWriter()
+    # the main process may still be showing the oldest unacknowledged frame
+    # while the others are written, so one ring slot always has to stay free
+    max_unacked_frames = frame_ring.slot_count - 1
+    unacked_frames: set[int] = set()
+    preview_dropped = 0
+    lookup = LookupService(metrics=metrics)
+    lookup.start()
 
-    last_code: bytes = ""
+    tracker = CodeTracker(suppress_window=lookup_suppress_window)
+    cmd: WorkerCommand | None = None
 
     while True:
-        # Receive command from main process
-        cmd = pipe.recv()
-        if not isinstance(cmd, WorkerCommand):
-            print("Invalid worker command, worker process exiting")
+        # apply all messages from the main process, waiting for the initial configuration
+        invalid = False
+        while cmd is None or pipe.poll():
+            message = pipe.recv()
+            if isinstance(message, FrameAck):
+                unacked_frames.discard(message.sequence)
+            elif isinstance(message, WorkerCommand):
+                cmd = message
+            else:
+                invalid = True
+                break
+        if invalid:
+            print("Invalid worker message, worker process exiting")
             break
-            
+
         # exit process if commanded
         if cmd.exit:
             break
         
+        # decode the next frames in any case when different codes are enabled now
+        enabled = (cmd.enable_datamatrix, cmd.enable_barcode_128, cmd.enable_qrcode)
+        if gate is not None and enabled != last_enabled:
+            gate.rearm()
+        last_enabled = enabled
+
+        def should_decode() -> bool:
+            if gate is None:
+                return True
+            with metrics.measure(STAGE_GATE):
+                return gate.should_decode(preprocessor.gray)
+
         # read and process frame
-        frame_raw = camera.get_frame(cmd.video_source)
-        frame = cv2.cvtColor(frame_raw, cv2.COLOR_BGR2RGB)
+        found_codes: list[CodeResult]
+        decoded: bool   # False if the gate skipped the frame and found_codes are the last frame's
+        if pool is None:
+            with metrics.measure(STAGE_CAPTURE):
+                captured = camera.read(cmd.video_source, wait_new=True)
+            if captured.sequence < 0:
+                time.sleep(PLACEHOLDER_INTERVAL)
+            frame = captured.image
+            with metrics.measure(STAGE_CONVERT):
+                decode_image = preprocessor.process(frame)
+            capture_time = captured.timestamp
 
-        scanner.check_datamatrix_2d = cmd.enable_datamatrix
-        scanner.check_barcode_128 = cmd.enable_barcode_128
-        scanner.check_qr_code =  cmd.enable_qrcode
-        found_codes = scanner.scan_for_codes(frame)
+            scanner.check_datamatrix_2d = cmd.enable_datamatrix
+            scanner.check_barcode_128 = cmd.enable_barcode_128
+            scanner.check_qr_code =  cmd.enable_qrcode
+            scanner.set_decode_budget(cmd.decode_budget)
+            decoded = should_decode()
+            if decoded:
+                with metrics.measure(STAGE_DECODE):
+                    with metrics.measure(STAGE_DATAMATRIX):
+                        found_codes = scanner.scan_datamatrix(decode_image)
+                    with metrics.measure(STAGE_BARCODE):
+                        found_codes += scanner.scan_barcodes(decode_image)
+                found_codes = _to_frame(found_codes, preprocessor.scale)
+                if scanner.tuner is not None:
+                    metrics.set_values(scanner.tuner.metric_values())
+            else:
+                found_codes = last_found_codes
+        else:
+            pool.config.check_datamatrix_2d = cmd.enable_datamatrix
+            pool.config.check_barcode_128 = cmd.enable_barcode_128
+            pool.config.check_qr_code = cmd.enable_qrcode
+            pool.config.decode_budget = cmd.decode_budget
+            # keep the pipeline filled, the oldest frame is shown once it has been decoded
+            while len(pending_frames) < pool.pipeline_depth:
+                with metrics.measure(STAGE_CAPTURE):
+                    captured = camera.read(cmd.video_source, wait_new=True)
+                if captured.sequence < 0:
+                    time.sleep(PLACEHOLDER_INTERVAL)
+                with metrics.measure(STAGE_CONVERT):
+                    decode_image = preprocessor.process(captured.image)
+                submitted = should_decode()
+                if submitted:
+                    pool.submit(decode_image)
+                pending_frames.append((captured.image, captured.timestamp, preprocessor.scale, submitted))
+            frame, capture_time, scale, decoded = pending_frames.popleft()
+            if decoded:
+                with metrics.measure(STAGE_DECODE):
+                    _, found_codes = pool.collect()
+                found_codes = _to_frame(found_codes, scale)
+            else:
+                found_codes = last_found_codes
+        last_found_codes = found_codes
+        if gate is not None:
+            metrics.set_values({"gate_skipped": gate.skip_fraction})
 
-        info: PartInfo | None = None
+        # backpressure: when the main process is behind, only scan this frame and don't show it
+        show_frame = len(unacked_frames) < max_unacked_frames
+        if show_frame:
+            # only the preview sized frame is transferred, the codes are drawn onto it
+            with metrics.measure(STAGE_PREVIEW):
+                preview = renderer.render(frame)
+
+        draw_start = time.perf_counter()
+        lookup_codes: dict[bytes, CodeResult] = {}
         for result in found_codes:
-            # only fetch if we got a different datamatrix than the last one we already fetched
-            # and only look up the first detected code
-            # if we found datamatrix and we haven't found any valid part in this frame yet:
-            if result.type == CodeType.DATAMATRIX_2D and info is not ...:
-                # draw bounds in green to signify the detected code
-                result.draw_bounds(frame, (0, 255, 0), 2)
-                # if we already looked this up previously, no need to repeat
-                if last_code == result.data:
-                    continue
-                # otherwise save and request info
-                last_code = result.data
-                info = request_part_info_mouser(result.data)
+            if LookupService.resolvable(result.type, result.data):
+                # draw bounds in green to signify a code that can be looked up
+                if show_frame:
+                    result.draw_bounds(preview, (0, 255, 0), 2, renderer.scale, renderer.offset)
+                lookup_codes[result.data] = result
 
-            else:
+            elif show_frame:
                 # other detected codes are marked red
-                result.draw_bounds(frame, (255, 0, 0), 2)
+                result.draw_bounds(preview, (255, 0, 0), 2, renderer.scale, renderer.offset)
+        metrics.record(STAGE_DRAW, time.perf_counter() - draw_start)
+
+        # request info for codes that have just come into view, the result arrives in a later frame.
+        # the tracker counts decoded frames, a skipped frame repeating the last codes would count them twice
+        if decoded:
+            for code_data in tracker.update(lookup_codes, capture_time):
+                lookup.submit(code_data, lookup_codes[code_data].type)
+            metrics.set_values(tracker.metric_values())
+
+        # forward any lookups that have finished in the meantime
+        for result in lookup.poll():
+            if isinstance(result, PartImage):
+                pipe.send(PartImageResponse(result))
+            else:
+                pipe.send(PartInfoResponse(result))
+
+        if not show_frame:
+            preview_dropped += 1
+            metrics.set_values({"preview_dropped": preview_dropped})
+            continue
 
-        # send the response back to main process
+        # push the frame to the main process
+        with metrics.measure(STAGE_PUBLISH):
+            handle = frame_ring.publish(preview)
+        unacked_frames.add(handle.sequence)
         pipe.send(WorkerResponse(
-            Image.fromarray(frame),
-            info
+            frame=handle,
+            capture_time=capture_time,
+            sent_time=time.monotonic(),
+            stage_samples=metrics.take_samples(),
+            values=metrics.values()
         ))
     
-    # before exiting, close pipe
+    # before exiting, stop outstanding lookups, decoders and the recording, release the frame buffers and close pipe
+    lookup.stop()
+    camera.stop_recording()
+    if pool is not None:
+        pool.stop()
+    frame_ring.close()
     if not pipe.closed:
         pipe.close()
@@ -0,0 +1,213 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 19:20
+
+Per-stage timing instrumentation of the image pipeline.
+
+Every stage (capture, color conversion, decoding, drawing, transport, display, ...)
+records its durations into a rolling window, from which percentiles are computed.
+The worker process collects its own samples and sends them along with each
+frame, so the UI process has the complete picture including the end-to-end
+capture-to-display latency and the effective frame rate. Besides durations,
+named values (e.g. the currently chosen decoder parameters) can be reported.
+"""
+
+import collections
+import contextlib
+import dataclasses
+import json
+import threading
+import time
+import typing
+from pathlib import Path
+
+
+HISTORY_SIZE = 300  # samples kept per stage, 10 seconds at 30 FPS
+
+# stages in pipeline order, used to sort the overlay and exports
+STAGE_CAPTURE = "capture"
+STAGE_CONVERT = "convert"
+STAGE_GATE = "gate"
+STAGE_DATAMATRIX = "dmtx"
+STAGE_BARCODE = "zbar"
+STAGE_DECODE = "decode"     # wall time of all decoding, which can be less than dmtx + zbar with the decoder pool
+STAGE_LOOKUP = "lookup"     # until the part info is available, without the image
+STAGE_IMAGE = "image"       # download of the part image after the lookup
+STAGE_PREVIEW = "preview"
+STAGE_DRAW = "draw"
+STAGE_PUBLISH = "publish"
+STAGE_TRANSPORT = "transport"
+STAGE_DISPLAY = "display"
+STAGE_END_TO_END = "end_to_end"
+STAGE_ORDER = [
+    STAGE_CAPTURE, STAGE_CONVERT, STAGE_GATE, STAGE_DATAMATRIX, STAGE_BARCODE,
+    STAGE_DECODE, STAGE_LOOKUP, STAGE_IMAGE, STAGE_PREVIEW, STAGE_DRAW, STAGE_PUBLISH, STAGE_TRANSPORT, STAGE_DISPLAY, STAGE_END_TO_END
+]
+
+
+@dataclasses.dataclass
+class StageSummary:
+    count: int
+    mean_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+class RollingHistogram:
+    """
+    Rolling window of duration samples in seconds.
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE) -> None:
+        self._samples: collections.deque[float] = collections.deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def summary(self) -> StageSummary | None:
+        if not self._samples:
+            return None
+        ms = sorted(s * 1000 for s in self._samples)
+        pick = lambda fraction: ms[min(len(ms) - 1, int(len(ms) * fraction))]
+        return StageSummary(
+            count=len(ms),
+            mean_ms=sum(ms) / len(ms),
+            p50_ms=pick(0.5),
+            p90_ms=pick(0.9),
+            p99_ms=pick(0.99),
+            max_ms=ms[-1]
+        )
+
+    def buckets(self) -> dict[str, int]:
+        """
+        :returns: sample counts in power-of-two millisecond buckets, e.g. "<1", "<2", "<4", ...
+        """
+        counts: dict[str, int] = {}
+        for sample in self._samples:
+            limit = 1
+            while sample * 1000 >= limit:
+                limit *= 2
+            counts[f"<{limit}"] = counts.get(f"<{limit}", 0) + 1
+        return dict(sorted(counts.items(), key=lambda item: int(item[0][1:])))
+
+
+class PipelineMetrics:
+    """
+    Thread safe collection of rolling stage histograms and frame rate.
+    """
+
+    def __init__(self, forward: bool = False) -> None:
+        """
+        :param forward: keep the samples for take_samples(), only for instances whose samples are sent to another process
+        """
+        self._lock = threading.Lock()
+        self._stages: dict[str, RollingHistogram] = {}
+        self._forward = forward
+        # samples not yet taken by take_samples(), older ones than the receiver keeps are dropped
+        self._unsent: dict[str, collections.deque[float]] = {}
+        self._frame_times: collections.deque[float] = collections.deque(maxlen=HISTORY_SIZE)
+        self._values: dict[str, float] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage not in self._stages:
+                self._stages[stage] = RollingHistogram()
+            self._stages[stage].add(seconds)
+            if self._forward:
+                if stage not in self._unsent:
+                    self._unsent[stage] = collections.deque(maxlen=HISTORY_SIZE)
+                self._unsent[stage].append(seconds)
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> typing.Iterator[None]:
+        """
+        Records the duration of the with-block as a sample of stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def take_samples(self) -> dict[str, list[float]]:
+        """
+        :returns: the samples recorded since the last call (at most HISTORY_SIZE per stage), for sending them
+            to another process, only available with forward=True
+        """
+        with self._lock:
+            samples, self._unsent = self._unsent, {}
+        return {stage: list(values) for stage, values in samples.items()}
+
+    def add_samples(self, samples: dict[str, list[float]]) -> None:
+        """
+        Records samples taken from another PipelineMetrics instance.
+        """
+        for stage, values in samples.items():
+            for value in values:
+                self.record(stage, value)
+
+    def set_values(self, values: dict[str, float]) -> None:
+        """
+        Updates named values that are reported as they are, without history.
+        """
+        with self._lock:
+            self._values.update(values)
+
+    def values(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def frame_done(self) -> None:
+        """
+        Marks a frame as displayed, for the effective frame rate.
+        """
+        with self._lock:
+            self._frame_times.append(time.monotonic())
+
+    @property
+    def fps(self) -> float:
+        with self._lock:
+            elapsed = self._frame_times[-1] - self._frame_times[0] if self._frame_times else 0.0
+            if elapsed <= 0:
+                return 0.0
+            return (len(self._frame_times) - 1) / elapsed
+
+    def summaries(self) -> dict[str, StageSummary]:
+        with self._lock:
+            stages = sorted(
+                self._stages.items(),
+                key=lambda item: STAGE_ORDER.index(item[0]) if item[0] in STAGE_ORDER else len(STAGE_ORDER)
+            )
+            return {name: summary for name, histogram in stages if (summary := histogram.summary()) is not None}
+
+    def overlay_text(self) -> str:
+        """
+        :returns: short multi-line summary for the preview overlay
+        """
+        lines = [f"{self.fps:5.1f} FPS"]
+        for name, summary in self.summaries().items():
+            lines.append(f"{name:>10}: {summary.p50_ms:6.1f} / {summary.p90_ms:6.1f} ms")
+        for name, value in self.values().items():
+            lines.append(f"{name}: {value:g}")
+        return "\n".join(lines)
+
+    def export(self, path: Path) -> None:
+        """
+        Writes summaries and histogram buckets of all stages to a JSON file.
+        """
+        summaries = self.summaries()
+        with self._lock:
+            buckets = {name: histogram.buckets() for name, histogram in self._stages.items()}
+        Path(path).write_text(json.dumps({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "fps": self.fps,
+            "values": self.values(),
+            "stages": {
+                name: dataclasses.asdict(summary) | {"buckets_ms": buckets[name]}
+                for name, summary in summaries.items()
+            }
+        }, indent=2))
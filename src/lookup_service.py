@@ -0,0 +1,502 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 11:40
+
+Asynchronous part lookup service.
+
+Runs an asyncio event loop with a SupplierClient in a background thread,
+so the image worker can hand off lookups without blocking the decode loop.
+Finished lookups are collected and can be polled from the worker loop.
+
+The part info is delivered as soon as the search has finished, the image of
+the part follows separately (PartImage) once it is downloaded or read from
+the cache.
+
+Results are cached persistently (see part_cache.py). Stale cache entries are
+delivered immediately and then revalidated, which delivers the part a second
+time with up to date stock and prices.
+
+Codes are looked up at the suppliers they can belong to (see resolvers.py).
+Part number searches are coalesced (see MouserBatcher), so when a whole order
+is scanned in a short time, up to 10 parts are looked up with a single request.
+The requests are sent within the Mouser API rate limits (see supplier_client.py),
+with revalidation of stale entries waiting behind new scans.
+"""
+
+import asyncio
+import dataclasses
+import threading
+import queue
+import io
+import sqlite3
+import time
+from pathlib import Path
+from PIL import Image
+
+from .partinfo import (
+    PartInfo,
+    PartImage,
+    mouser_search_body,
+    parse_mouser_search_response,
+    parse_mouser_batch_response,
+    MOUSER_MAX_BATCH_SIZE,
+    MOUSER_SEARCH_URL,
+    MOUSER_SEARCH_HEADERS,
+    IMAGE_HEADERS
+)
+from .instrumentation import PipelineMetrics, STAGE_LOOKUP, STAGE_IMAGE
+from .supplier_client import SupplierClient, Priority, RateLimit
+from .resolvers import Resolver, SupplierResolver, PartQuery, QueryKind, classify, MOUSER
+from .scanner import CodeType
+from .part_cache import PartCache, CacheState, DEFAULT_CACHE_DIR, DEFAULT_FRESH_TTL, DEFAULT_MAX_AGE
+from .api_keys import MOUSER_API_KEY
+
+
+MAX_CONCURRENT_LOOKUPS = MOUSER_MAX_BATCH_SIZE   # lookups mostly wait for their batch, so this many can fill one
+MAX_QUEUED_LOOKUPS = 32
+BATCH_WINDOW = 0.2      # seconds a part number search waits for others to be sent along with it
+MOUSER_RATE_LIMIT = RateLimit(per_minute=30, per_day=1000)  # search API limits
+MOUSER_LOOKUP_TIMEOUT = 20.0    # seconds, including waiting for the rate limit
+MOUSER_HEDGE_DELAY = 2.0        # seconds, most searches (including the batch window) finish well before
+HEDGE_QUOTA_RESERVE = 10        # requests per minute that have to be left for a hedged request to be sent
+RESOLVED_SUPPLIERS = {MOUSER}   # suppliers there is a resolver for (see _serve())
+
+
+async def fetch_mouser_part(
+    client: SupplierClient,
+    mouser_part_number: bytes,
+    priority: Priority = Priority.INTERACTIVE
+) -> PartInfo | None:
+    """
+    Searches a part number on Mouser.
+
+    :returns: the part info without image
+    :returns: None if the request failed or nothing was found
+    """
+    response = await client.request(
+        "POST",
+        f"{MOUSER_SEARCH_URL}?apiKey={MOUSER_API_KEY}",
+        supplier=MOUSER,
+        priority=priority,
+        headers=MOUSER_SEARCH_HEADERS,
+        data=mouser_search_body(mouser_part_number)
+    )
+    if response.status != 200:
+        print(f"API reponded with {response.status}")
+        return None
+    return parse_mouser_search_response(response.json())
+
+
+async def fetch_mouser_parts(
+    client: SupplierClient,
+    mouser_part_numbers: list[bytes],
+    priority: Priority = Priority.INTERACTIVE
+) -> dict[bytes, PartInfo | None]:
+    """
+    Searches up to MOUSER_MAX_BATCH_SIZE part numbers on Mouser with a single request.
+
+    :returns: the part info without image for every part number, None if nothing was found
+    :returns: None for all part numbers if the request failed
+    """
+    response = await client.request(
+        "POST",
+        f"{MOUSER_SEARCH_URL}?apiKey={MOUSER_API_KEY}",
+        supplier=MOUSER,
+        priority=priority,
+        headers=MOUSER_SEARCH_HEADERS,
+        data=mouser_search_body(b"|".join(mouser_part_numbers))
+    )
+    if response.status != 200:
+        print(f"API reponded with {response.status}")
+        return {part_number: None for part_number in mouser_part_numbers}
+    return parse_mouser_batch_response(response.json(), mouser_part_numbers)
+
+
+async def fetch_image(client: SupplierClient, url: str) -> bytes | None:
+    """
+    :returns: the raw contents of the image file
+    :returns: None if it couldn't be downloaded
+    """
+    # images are served from a CDN, not the rate limited API
+    response = await client.request("GET", url, headers=IMAGE_HEADERS)
+    if response.status != 200:
+        return None
+    return response.body
+
+
+class MouserBatcher:
+    """
+    Coalesces concurrent part number searches into batch requests.
+
+    A search waits up to BATCH_WINDOW for other searches to arrive and is then
+    sent together with them in one request (or right away once the batch is
+    full). The results are fanned out to all waiting searches.
+    Must be used from within the event loop.
+    """
+
+    def __init__(self, client: SupplierClient, window: float = BATCH_WINDOW) -> None:
+        self._client = client
+        self._window = window
+        self._batch: dict[bytes, asyncio.Future[PartInfo | None]] = {}
+        self._batch_priority = Priority.BACKGROUND
+        self._timer: asyncio.TimerHandle | None = None
+        self._requests: set[asyncio.Task] = set()
+        self.request_count = 0
+        self.part_count = 0
+
+    async def fetch(self, mouser_part_number: bytes, priority: Priority = Priority.INTERACTIVE) -> PartInfo | None:
+        """
+        Like fetch_mouser_part(), but sent in a batch with other searches.
+        The batch is sent with the highest priority of its searches.
+        """
+        self._batch_priority = min(self._batch_priority, priority)
+        future = self._batch.get(mouser_part_number)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._batch[mouser_part_number] = future
+            if len(self._batch) >= MOUSER_MAX_BATCH_SIZE:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self._window, self._flush)
+        # shielded, because the same part number may be awaited by another search
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, {}
+        priority, self._batch_priority = self._batch_priority, Priority.BACKGROUND
+        if not batch:
+            return
+        self.request_count += 1
+        self.part_count += len(batch)
+        request = asyncio.create_task(self._request(batch, priority))
+        self._requests.add(request)
+        request.add_done_callback(self._requests.discard)
+
+    async def _request(self, batch: dict[bytes, asyncio.Future[PartInfo | None]], priority: Priority) -> None:
+        try:
+            results = await fetch_mouser_parts(self._client, list(batch), priority)
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for part_number, future in batch.items():
+            if not future.done():
+                future.set_result(results[part_number])
+
+    def close(self) -> None:
+        """
+        Cancels the batch that is being collected and all requests in progress.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for future in self._batch.values():
+            future.cancel()
+        self._batch.clear()
+        for request in self._requests:
+            request.cancel()
+
+
+class MouserResolver(SupplierResolver):
+    """
+    Searches supplier part numbers in batches (see MouserBatcher) and manufacturer
+    part numbers one by one, as the batch results can only be assigned by Mouser part number.
+    """
+    supplier = MOUSER
+    timeout = MOUSER_LOOKUP_TIMEOUT
+    hedge_delay = MOUSER_HEDGE_DELAY
+
+    def __init__(self, client: SupplierClient, batcher: MouserBatcher) -> None:
+        self._client = client
+        self._batcher = batcher
+
+    async def resolve(self, query: PartQuery, priority: Priority) -> PartInfo | None:
+        if query.kind == QueryKind.SUPPLIER_PART_NUMBER:
+            return await self._batcher.fetch(query.part_number, priority)
+        return await fetch_mouser_part(self._client, query.part_number, priority)
+
+    def can_hedge(self) -> bool:
+        # hedging must not use up the quota needed for new scans
+        return self._client.quota()[MOUSER].minute_remaining >= HEDGE_QUOTA_RESERVE
+
+
+@dataclasses.dataclass
+class LookupFinished:
+    """
+    Reported by LookupService.poll() with report_finished=True when the lookup of a code has finished
+    """
+    code_data: bytes
+    info: PartInfo | None   # None if nothing was found, the lookup failed or the code was dropped
+
+
+class LookupService:
+    """
+    Part lookup service running in a background thread.
+
+    Codes are submitted with submit() and processed by a fixed number
+    of concurrent lookup tasks. Results are collected with poll().
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path | None = DEFAULT_CACHE_DIR,
+        fresh_ttl: float = DEFAULT_FRESH_TTL,
+        max_age: float = DEFAULT_MAX_AGE,
+        metrics: PipelineMetrics | None = None,
+        mouser_limit: RateLimit = MOUSER_RATE_LIMIT,
+        report_finished: bool = False
+    ) -> None:
+        """
+        :param cache_dir: directory of the persistent part cache, None to disable caching
+        :param fresh_ttl: seconds after which cached stock and prices are revalidated
+        :param max_age: seconds after which cached parts are no longer used at all
+        :param metrics: optional metrics to record the duration of lookups in
+        :param mouser_limit: rate limit of the Mouser search API
+        :param report_finished: also deliver a LookupFinished for every code that wasn't ignored as
+            a duplicate, so the results can be matched to the codes
+        """
+        self._metrics = metrics
+        self._report_finished = report_finished
+        self._mouser_limit = mouser_limit
+        self._cache_dir = cache_dir
+        self._fresh_ttl = fresh_ttl
+        self._max_age = max_age
+        self._cache: PartCache | None = None   # created and used in the loop thread only
+        self._batcher: MouserBatcher | None = None  # created and used in the loop thread only
+        self._resolver: Resolver | None = None      # created and used in the loop thread only
+        self._image_lookups: dict[str, asyncio.Task] = {}   # by image url, only accessed in the loop thread
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="LookupService", daemon=True)
+        self._pending: asyncio.Queue[tuple[bytes, CodeType]] | None = None
+        self._shutdown: asyncio.Event | None = None
+        self._in_flight: set[bytes] = set()     # codes queued or being looked up, only accessed in the loop thread
+        self._results: queue.SimpleQueue[PartInfo | PartImage | LookupFinished] = queue.SimpleQueue()
+        self._started = threading.Event()
+        self._outstanding = 0   # submitted codes whose lookup hasn't finished yet
+        self._outstanding_lock = threading.Lock()
+
+    def start(self) -> None:
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self) -> None:
+        """
+        Cancels all outstanding lookups and stops the service thread.
+        """
+        if not self._thread.is_alive():
+            return
+        self._loop.call_soon_threadsafe(self._shutdown.set)
+        self._thread.join()
+
+    @staticmethod
+    def resolvable(code_type: CodeType, code_data: bytes) -> bool:
+        """
+        :returns: True if the code can be looked up at any supplier
+        """
+        return any(query.supplier in RESOLVED_SUPPLIERS for query in classify(code_type, code_data))
+
+    def submit(self, code_data: bytes, code_type: CodeType = CodeType.DATAMATRIX_2D) -> None:
+        """
+        Queues a code for lookup. Codes which are already queued or being looked
+        up are ignored, as are new codes while the queue is full.
+        Can be called from any thread.
+        """
+        with self._outstanding_lock:
+            self._outstanding += 1
+        self._loop.call_soon_threadsafe(self._enqueue, code_data, code_type)
+
+    def _finished(self) -> None:
+        with self._outstanding_lock:
+            self._outstanding -= 1
+
+    @property
+    def outstanding(self) -> int:
+        """
+        number of submitted codes that haven't been processed yet (including ignored duplicates)
+        """
+        with self._outstanding_lock:
+            return self._outstanding
+
+    def poll(self) -> list[PartInfo | PartImage | LookupFinished]:
+        """
+        :returns: all part infos and images that have been looked up since the last call,
+            LookupFinished only with report_finished=True
+        """
+        results: list[PartInfo | PartImage | LookupFinished] = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def _enqueue(self, code_data: bytes, code_type: CodeType) -> None:
+        if code_data in self._in_flight:
+            self._finished()
+            return
+        try:
+            self._pending.put_nowait((code_data, code_type))
+        except asyncio.QueueFull:
+            print("Lookup queue is full, dropping code")
+            self._report(code_data, None)
+            self._finished()
+            return
+        self._in_flight.add(code_data)
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+        self._loop.close()
+
+    async def _serve(self) -> None:
+        self._pending = asyncio.Queue(MAX_QUEUED_LOOKUPS)
+        self._shutdown = asyncio.Event()
+        if self._cache_dir is not None:
+            try:
+                self._cache = PartCache(self._cache_dir, self._fresh_ttl, self._max_age)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Couldn't open part cache, continuing without: {e!r}")
+        async with SupplierClient({MOUSER: self._mouser_limit}) as client:
+            self._batcher = MouserBatcher(client)
+            self._resolver = Resolver([MouserResolver(client, self._batcher)])
+            workers = [
+                asyncio.create_task(self._lookup_worker(client))
+                for _ in range(MAX_CONCURRENT_LOOKUPS)
+            ]
+            self._started.set()
+            await self._shutdown.wait()
+            for worker in workers:
+                worker.cancel()
+            self._batcher.close()
+            for image_lookup in self._image_lookups.values():
+                image_lookup.cancel()
+            await asyncio.gather(*workers, *self._image_lookups.values(), return_exceptions=True)
+            print(f"Mouser: {self._batcher.part_count} part numbers searched with {self._batcher.request_count} requests")
+            print(f"Supplier quota: {client.quota()}")
+            print(f"Resolver: {self._resolver.stats}")
+        if self._cache is not None:
+            print(f"Part cache: {self._cache.stats}")
+            self._cache.close()
+
+    async def _lookup_worker(self, client: SupplierClient) -> None:
+        while True:
+            code_data, code_type = await self._pending.get()
+            start = time.perf_counter()
+            try:
+                info = await self._lookup(client, code_data, code_type)
+                if self._metrics is not None:
+                    self._metrics.record(STAGE_LOOKUP, time.perf_counter() - start)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Part lookup failed: {e!r}")
+                self._report(code_data, None)
+            else:
+                self._report(code_data, info)
+            finally:
+                self._in_flight.discard(code_data)
+                self._finished()
+
+    def _report(self, code_data: bytes, info: PartInfo | None) -> None:
+        if self._report_finished:
+            self._results.put(LookupFinished(code_data, info))
+
+    async def _lookup(self, client: SupplierClient, code_data: bytes, code_type: CodeType) -> PartInfo | None:
+        """
+        :returns: the newest part info delivered for the code
+        """
+        queries = self._resolver.resolvable(classify(code_type, code_data))
+        if not queries:
+            return None
+        # the code is cached under its preferred query
+        cache_key = queries[0].cache_key
+
+        priority = Priority.INTERACTIVE
+        delivered_image_url: str | None = None
+        cached = None
+        if self._cache is not None:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._results.put(cached.info)
+                image_data = self._cache.get_image(cached.image_hash) if cached.image_hash is not None else None
+                if image_data is not None:
+                    self._deliver_image(cached.info, image_data)
+                    delivered_image_url = cached.info.image_url
+                if cached.state == CacheState.FRESH:
+                    if delivered_image_url is None and cached.info.image_url is not None:
+                        # the download failed the last time
+                        self._start_image_lookup(client, cache_key, cached.info)
+                    return cached.info
+                # stale, so fetch it again to update stock and prices, but after new scans
+                priority = Priority.BACKGROUND
+
+        resolved = await self._resolver.resolve(queries, priority)
+        if self._metrics is not None:
+            quota = client.quota()[MOUSER]
+            self._metrics.set_values({
+                "mouser_requests": self._batcher.request_count,
+                "mouser_parts": self._batcher.part_count,
+                "mouser_retries": quota.retries,
+                "mouser_quota_minute": quota.minute_remaining,
+                "mouser_quota_day": quota.day_remaining
+            } | self._resolver.metric_values())
+        if resolved is None:
+            return cached.info if cached is not None else None
+        _, info = resolved
+
+        # the image of a part basically never changes, so there is no need to re-download it
+        cached_image: tuple[str, bytes] | None = None
+        if info.image_url is not None and self._cache is not None:
+            cached_image = self._cache.get_image_by_url(info.image_url)
+        if self._cache is not None:
+            self._cache.put(cache_key, info, cached_image[0] if cached_image is not None else None)
+
+        # the text is all that is needed to identify the part, so it is delivered without waiting for the image
+        self._results.put(info)
+        if info.image_url is None or info.image_url == delivered_image_url:
+            return info
+        if cached_image is not None:
+            self._deliver_image(info, cached_image[1])
+        else:
+            self._start_image_lookup(client, cache_key, info)
+        return info
+
+    def _deliver_image(self, info: PartInfo, image_data: bytes) -> None:
+        image = Image.open(io.BytesIO(image_data))
+        self._results.put(PartImage(info.supplier_part_number, info.image_url, image, image_data))
+
+    def _start_image_lookup(self, client: SupplierClient, cache_key: str, info: PartInfo) -> None:
+        """
+        Downloads the image of a part in the background, so the lookup worker is free for the next code.
+        """
+        if info.image_url in self._image_lookups:
+            return  # the part has been scanned again while the image is being downloaded
+        task = asyncio.create_task(self._image_lookup(client, cache_key, info))
+        self._image_lookups[info.image_url] = task
+        task.add_done_callback(lambda _: self._image_lookups.pop(info.image_url, None))
+
+    async def _image_lookup(self, client: SupplierClient, cache_key: str, info: PartInfo) -> None:
+        start = time.perf_counter()
+        try:
+            image_data = await fetch_image(client, info.image_url)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Image download failed: {e!r}")
+            return
+        if image_data is None:
+            return
+        if self._cache is not None:
+            self._cache.set_image(cache_key, self._cache.put_image(info.image_url, image_data))
+        self._deliver_image(info, image_data)
+        if self._metrics is not None:
+            self._metrics.record(STAGE_IMAGE, time.perf_counter() - start)
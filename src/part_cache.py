@@ -0,0 +1,193 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 13:05
+
+Persistent on-disk cache for part infos and part images.
+
+Part infos are stored in an SQLite database keyed by the supplier part number.
+Images are stored content-addressed (by SHA-256 of the file contents) in a
+directory next to it, so identical images are only stored once.
+
+Entries younger than fresh_ttl are returned as FRESH. Older entries are still
+returned (as STALE) until max_age, so the caller can show them right away
+and revalidate in the background (stale-while-revalidate). Only the volatile
+fields (stock, prices) really age, the rest of the part info practically never
+changes, which is why max_age can be much longer than fresh_ttl.
+"""
+
+import dataclasses
+import enum
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from .partinfo import PartInfo, part_info_to_dict, part_info_from_dict
+
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "getparts"
+DEFAULT_FRESH_TTL = 6 * 60 * 60         # 6 hours, after that stock and prices are revalidated
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60     # 30 days, after that entries aren't used at all anymore
+
+
+class CacheState(enum.Enum):
+    FRESH = 1
+    STALE = 2
+
+
+@dataclasses.dataclass
+class CachedPart:
+    info: PartInfo
+    state: CacheState
+    fetched_at: float   # unix timestamp of when the info was fetched from the supplier
+    image_hash: str | None
+
+
+@dataclasses.dataclass
+class CacheStats:
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    image_hits: int = 0
+    image_misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.stale_hits + self.misses
+        return (self.hits + self.stale_hits) / total if total else 0.0
+
+
+class PartCache:
+    """
+    SQLite backed part info cache. An instance must only be used from
+    the thread that created it.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = DEFAULT_CACHE_DIR,
+        fresh_ttl: float = DEFAULT_FRESH_TTL,
+        max_age: float = DEFAULT_MAX_AGE
+    ) -> None:
+        self._cache_dir = Path(cache_dir)
+        self._image_dir = self._cache_dir / "images"
+        self._image_dir.mkdir(parents=True, exist_ok=True)
+        self.fresh_ttl = fresh_ttl
+        self.max_age = max_age
+        self.stats = CacheStats()
+
+        self._db = sqlite3.connect(self._cache_dir / "parts.sqlite3")
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS parts (
+                part_number TEXT PRIMARY KEY,
+                info TEXT NOT NULL,
+                image_hash TEXT,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                image_hash TEXT NOT NULL
+            );
+        """)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def get(self, part_number: str) -> CachedPart | None:
+        """
+        :returns: the cached part info (with image if available)
+        :returns: None if the part is not cached or the entry is too old
+        """
+        row = self._db.execute(
+            "SELECT info, image_hash, fetched_at FROM parts WHERE part_number = ?",
+            (part_number, )
+        ).fetchone()
+        age = time.time() - row[2] if row is not None else None
+        if row is None or age > self.max_age:
+            self.stats.misses += 1
+            return None
+
+        state = CacheState.FRESH if age <= self.fresh_ttl else CacheState.STALE
+        if state == CacheState.FRESH:
+            self.stats.hits += 1
+        else:
+            self.stats.stale_hits += 1
+
+        return CachedPart(
+            info=part_info_from_dict(json.loads(row[0])),
+            state=state,
+            fetched_at=row[2],
+            image_hash=row[1]
+        )
+
+    def put(self, part_number: str, info: PartInfo, image_hash: str | None) -> None:
+        """
+        Stores or refreshes the part info of a part. The image has to be
+        stored separately using put_image().
+        """
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO parts (part_number, info, image_hash, fetched_at) VALUES (?, ?, ?, ?)",
+                (part_number, json.dumps(part_info_to_dict(info)), image_hash, time.time())
+            )
+
+    def set_image(self, part_number: str, image_hash: str) -> None:
+        """
+        Sets the image of an already stored part, once it has been downloaded.
+        """
+        with self._db:
+            self._db.execute("UPDATE parts SET image_hash = ? WHERE part_number = ?", (image_hash, part_number))
+
+    def _image_path(self, image_hash: str) -> Path:
+        return self._image_dir / image_hash[:2] / image_hash
+
+    def get_image(self, image_hash: str) -> bytes | None:
+        """
+        :returns: the contents of the image file with the provided hash
+        :returns: None if it is not stored
+        """
+        try:
+            data = self._image_path(image_hash).read_bytes()
+        except FileNotFoundError:
+            self.stats.image_misses += 1
+            return None
+        self.stats.image_hits += 1
+        return data
+
+    def get_image_by_url(self, url: str) -> tuple[str, bytes] | None:
+        """
+        :returns: hash and contents of the image previously downloaded from url
+        :returns: None if the image is not stored
+        """
+        row = self._db.execute("SELECT image_hash FROM images WHERE url = ?", (url, )).fetchone()
+        if row is None:
+            self.stats.image_misses += 1
+            return None
+        data = self.get_image(row[0])
+        return (row[0], data) if data is not None else None
+
+    def put_image(self, url: str, data: bytes) -> str:
+        """
+        Stores an image file downloaded from url.
+
+        :returns: the content hash of the image
+        """
+        image_hash = hashlib.sha256(data).hexdigest()
+        path = self._image_path(image_hash)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            # write to temporary file first so there are never any partially written images in the store
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images (url, image_hash) VALUES (?, ?)",
+                (url, image_hash)
+            )
+        return image_hash
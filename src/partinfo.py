@@ -8,11 +8,10 @@ API part info getters
 """
 
 import dataclasses
-import requests
+import os
 from PIL import Image
-import io
 
-from .api_keys import MOUSER_API_KEY
+from .ecia import parse_ecia
 
 @dataclasses.dataclass
 class PriceStep:
@@ -36,61 +35,103 @@ class PartInfo:
     image: Image.Image | None = None
 
 
-def request_part_info_mouser(code_data: bytes) -> PartInfo | None:
-    # extract manufacturer part number from EICA code
-    if not b'[)>' in code_data:
-        print("Invalid code, returning None")
-        return None
-    
-    code_components = code_data.split(r"".encode())
-    # 3rd component is supplier part number, except the first two character which define the component
-    mouser_part_number = code_components[3][2:]
-    print(f"{mouser_part_number=}")
-    
-    part_info: PartInfo = ...
-
-    response: requests.Response = requests.post(
-        url=f"https://api.mouser.com/api/v1/search/partnumber?apiKey={MOUSER_API_KEY}",
-        headers = {
-            'Content-Type': "application/json",
-            'accept': "application/json"
-        },
-        data=b"{\"SearchByPartRequest\": {\"mouserPartNumber\": \"" + mouser_part_number + b"\",}}"
-    )
-    if response.status_code != 200:
-        print(f"API reponded with {response.status_code}")
-        return None
-    # This would be nice to do with pydantic but I'm not gonna bother with that now
-    resp_data = response.json()
-    if len(resp_data["Errors"]) != 0:
-        print(f"API returned some error(s): {resp_data["Errors"]}")
+@dataclasses.dataclass
+class PartImage:
+    """
+    Image of a part, delivered separately after its PartInfo
+    """
+    supplier_part_number: str
+    image_url: str
+    image: Image.Image
+    data: bytes     # original file contents, for saving without recompressing
+
+
+def part_info_to_dict(info: PartInfo) -> dict:
+    """
+    :returns: JSON serializable dict of all fields except the image
+    """
+    return {
+        field.name: getattr(info, field.name)
+        for field in dataclasses.fields(info)
+        if field.name not in ("image", "price_breaks")
+    } | {
+        "price_breaks": [dataclasses.asdict(brk) for brk in info.price_breaks]
+    }
+
+
+def part_info_from_dict(data: dict) -> PartInfo:
+    """
+    Inverse of part_info_to_dict(), the image is left empty.
+    """
+    return PartInfo(**(data | {
+        "price_breaks": [PriceStep(**brk) for brk in data["price_breaks"]]
+    }))
+
+
+# can be pointed to a local stand-in like bench/fake_mouser.py
+MOUSER_API_URL = os.environ.get("GETPARTS_MOUSER_API_URL", "https://api.mouser.com/api/v1")
+MOUSER_SEARCH_URL = f"{MOUSER_API_URL}/search/partnumber"
+MOUSER_SEARCH_HEADERS = {
+    'Content-Type': "application/json",
+    'accept': "application/json"
+}
+IMAGE_HEADERS = {
+    # using some browser User agent because it doesn't work otherwise
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0",
+    "Accept": "image/*",
+    "Connection": "keep-alive",
+}
+
+
+def extract_mouser_part_number(code_data: bytes) -> bytes | None:
+    """
+    Extracts the part number to search for from an ECIA datamatrix code.
+
+    :returns: the part number
+    :returns: None if the code is not a valid ECIA code or has no part number
+    """
+    label = parse_ecia(code_data)
+    if label is None:
         return None
-    search_results: dict = resp_data["SearchResults"]
-    nr_results: int = search_results["NumberOfResult"]
+    return label.supplier_part_number or None
 
-    # get the part descriptor
-    part_descriptor: dict = ...
-    if nr_results == 0:
-        print(f"No matching parts found on Mouser")
-    
+
+MOUSER_MAX_BATCH_SIZE = 10  # part numbers the search accepts in one request, separated by "|"
+
+
+def mouser_search_body(mouser_part_number: bytes) -> bytes:
+    """
+    :param mouser_part_number: part number, or up to MOUSER_MAX_BATCH_SIZE part numbers joined with b"|"
+    """
+    return b"{\"SearchByPartRequest\": {\"mouserPartNumber\": \"" + mouser_part_number + b"\",}}"
+
+
+def _select_mouser_part(parts: list[dict]) -> dict | None:
+    """
+    Selects the best matching part of the search results for one part number.
+
+    :returns: the part descriptor
+    :returns: None if none of the parts is available
+    """
+    if len(parts) == 1:
+        return parts[0]
+    # sometimes there are two equal parts, one only in full reels and one as cut tape.
+    # So we select the one which has the lower minimum quantity (or the one that hay
+    # any quantity at all)
+    # possible alternatives: larger amount of price breaks, larger amount of packaging options, product status
+    options = list(reversed(parts))
+    print(f"Multiple parts found, arbitrating")
+    # filter any parts with zero minimum count, these are not available
+    options = [option for option in options if int(option["Min"]) > 0]
+    if not options:
         return None
-    elif nr_results == 1:
-        part_descriptor = search_results["Parts"][0]
-    else:
-        # sometimes there are two equal parts, one only in full reels and one as cut tape.
-        # So we select the one which has the lower minimum quantity (or the one that hay
-        # any quantity at all)
-        # possible alternatives: larger amount of price breaks, larger amount of packaging options, product status
-        options: list[dict] = search_results["Parts"]
-        options.reverse()
-        print(f"Multiple parts found, arbitrating")
-        # filter any parts with zero minimum count, these are not available
-        options = [option for option in options if int(option["Min"]) > 0]
-        # select the one with the smallest minimum order quantity
-        part_descriptor = min(options, key=lambda o: int(o["Min"]) )
-    
+    # select the one with the smallest minimum order quantity
+    return min(options, key=lambda o: int(o["Min"]) )
+
+
+def _part_info_from_descriptor(part_descriptor: dict) -> PartInfo:
     #print(f"found part:\n{json.dumps(part_descriptor, indent=3, sort_keys=True)}")
-    part_info = PartInfo(
+    return PartInfo(
         description=                part_descriptor["Description"],
         in_stock=                   int(part_descriptor["AvailabilityInStock"]),
         min_qty=                    int(part_descriptor["Min"]),
@@ -108,27 +149,60 @@ def request_part_info_mouser(code_data: bytes) -> PartInfo | None:
         image_url=                  part_descriptor["ImagePath"]
     )
 
-    # also fetch the image if available
-    if part_info.image_url is None:
-        part_info.image = None
-        return part_info
-    
-    response: requests.Response = requests.get(
-        url=part_info.image_url,
-        headers={
-            # using some browser User agent because it doesn't work otherwise
-            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0",
-            "Accept": "image/*",
-            "Connection": "keep-alive",
-        }
-    )
-    if (response.status_code) == 200:
-        part_info.image = Image.open(io.BytesIO(response.content))
-    else:
-        part_info.image = None
-                
-    return part_info
-                
-            
-
-            
+
+def parse_mouser_search_response(resp_data: dict) -> PartInfo | None:
+    """
+    Converts the JSON response of the Mouser part number search to a PartInfo
+    object (without the image, which has to be fetched separately).
+
+    :returns: the part info of the best matching part
+    :returns: None if the API returned errors or no part was found
+    """
+    # This would be nice to do with pydantic but I'm not gonna bother with that now
+    if len(resp_data["Errors"]) != 0:
+        print(f"API returned some error(s): {resp_data["Errors"]}")
+        return None
+    search_results: dict = resp_data["SearchResults"]
+    nr_results: int = search_results["NumberOfResult"]
+
+    if nr_results == 0:
+        print(f"No matching parts found on Mouser")
+        return None
+    part_descriptor = _select_mouser_part(search_results["Parts"])
+    if part_descriptor is None:
+        return None
+    return _part_info_from_descriptor(part_descriptor)
+
+
+def parse_mouser_batch_response(resp_data: dict, mouser_part_numbers: list[bytes]) -> dict[bytes, PartInfo | None]:
+    """
+    Like parse_mouser_search_response(), but for a search of multiple part numbers
+    (see mouser_search_body()), whose results are all returned in one list.
+    Parts are assigned to the searched part numbers that are their Mouser or manufacturer
+    part number. Otherwise a part containing the searched part number is only used if it
+    is the only one, as e.g. a search for "BC547" also returns "BC547B" and "BC547C".
+
+    :returns: part info (without image) for every searched part number, None if nothing was found
+    """
+    results: dict[bytes, PartInfo | None] = {part_number: None for part_number in mouser_part_numbers}
+    if len(resp_data["Errors"]) != 0:
+        print(f"API returned some error(s): {resp_data["Errors"]}")
+        return results
+    parts: list[dict] = resp_data["SearchResults"]["Parts"] or []
+
+    for part_number in mouser_part_numbers:
+        search = part_number.decode(errors="replace").upper()
+        part_numbers = [(part["MouserPartNumber"].upper(), part["ManufacturerPartNumber"].upper()) for part in parts]
+        matching = [part for part, numbers in zip(parts, part_numbers) if search in numbers]
+        if not matching:
+            matching = [part for part, numbers in zip(parts, part_numbers) if any(search in number for number in numbers)]
+            if len(matching) > 1:
+                print(f"{len(matching)} parts found on Mouser for {part_number}, but none matches exactly")
+                continue
+        if not matching:
+            print(f"No matching parts found on Mouser for {part_number}")
+            continue
+        part_descriptor = _select_mouser_part(matching)
+        if part_descriptor is not None:
+            results[part_number] = _part_info_from_descriptor(part_descriptor)
+    return results
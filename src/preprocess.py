@@ -0,0 +1,84 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+19.10.26 02:10
+
+Preprocessing of camera frames for the decoders.
+
+libdmtx and zbar only look at a single luminance plane (zbar even just takes
+the first channel of color images), so every frame is converted to grayscale
+once and that plane is shared by the change gate and all decoders, which
+makes the decoder input a third of the size of an RGB frame. Optionally the
+frame is downscaled and its contrast enhanced (CLAHE or adaptive threshold)
+and sharpened for difficult labels (glossy bags, shadows, slight defocus).
+Only the preview is converted to RGB (see PreviewRenderer).
+
+Codes are found in the coordinates of the preprocessed image, which differ
+from the frame coordinates when downscaling. See scale.
+"""
+
+import dataclasses
+import cv2
+import numpy
+
+
+DOWNSCALE_INTERPOLATION = cv2.INTER_AREA   # antialiased, but several times slower than INTER_LINEAR at non-integer factors
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_TILE_GRID = (8, 8)
+THRESHOLD_BLOCK_SIZE = 31   # odd neighbourhood size in pixels the threshold is computed in, about a code module or more
+THRESHOLD_OFFSET = 10       # gray levels a pixel has to be darker than its neighbourhood to count as dark
+SHARPEN_SIGMA = 1.5         # blur of the unsharp mask
+SHARPEN_AMOUNT = 1.0        # 0 = not sharpened
+
+
+@dataclasses.dataclass
+class PreprocessConfig:
+    max_width: int | None = None    # frames wider than this are downscaled, None to decode at full resolution
+    clahe: bool = False             # local contrast equalization, helps with shadows and glare
+    sharpen: bool = False           # unsharp mask, helps with slightly defocused labels
+    adaptive_threshold: bool = False    # binarize with a local threshold, done last
+
+
+class Preprocessor:
+    """
+    Turns camera frames into the image passed to the decoders.
+    """
+
+    def __init__(self, config: PreprocessConfig | None = None) -> None:
+        self.config = config if config is not None else PreprocessConfig()
+        self._clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+        # preprocessed image size relative to the frame of the last process() call,
+        # a point in the preprocessed image maps to point / scale in the frame
+        self.scale = 1.0
+        # grayscale, downscaled frame of the last process() call before contrast enhancement,
+        # so change detection isn't affected by amplified noise
+        self.gray: numpy.ndarray | None = None
+
+    def process(self, frame: cv2.typing.MatLike) -> numpy.ndarray:
+        """
+        :param frame: BGR frame as returned by VideoSource (or an already grayscale one)
+        :returns: the single channel image for the decoders
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+        width = gray.shape[1]
+        self.scale = 1.0
+        if self.config.max_width is not None and width > self.config.max_width:
+            self.scale = self.config.max_width / width
+            # downscaling the single plane is a third of the work of downscaling the color frame
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=DOWNSCALE_INTERPOLATION)
+        self.gray = gray
+
+        image = gray
+        if self.config.clahe:
+            image = self._clahe.apply(image)
+        if self.config.sharpen:
+            blurred = cv2.GaussianBlur(image, (0, 0), SHARPEN_SIGMA)
+            image = cv2.addWeighted(image, 1.0 + SHARPEN_AMOUNT, blurred, -SHARPEN_AMOUNT, 0)
+        if self.config.adaptive_threshold:
+            image = cv2.adaptiveThreshold(
+                image, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                THRESHOLD_BLOCK_SIZE, THRESHOLD_OFFSET
+            )
+        return image
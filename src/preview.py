@@ -0,0 +1,65 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 21:00
+
+Letterboxed camera preview rendering.
+
+The worker scales every frame into a preallocated buffer of the preview
+size (centered, black bars, never upscaled) before it is published, so only
+preview sized frames are transferred and the UI just has to copy them into
+its image without any resizing.
+"""
+
+import cv2
+import numpy
+
+
+PREVIEW_SIZE = (640, 360)
+PREVIEW_INTERPOLATION = cv2.INTER_AREA  # antialiased like PIL's thumbnail(), INTER_LINEAR is faster but aliases
+
+
+class PreviewRenderer:
+    """
+    Renders frames into one reused preview buffer.
+    """
+
+    def __init__(self, size: tuple[int, int] = PREVIEW_SIZE) -> None:
+        self._size = size
+        self._buffer = numpy.zeros((size[1], size[0], 3), dtype=numpy.uint8)
+        self._frame_shape: tuple[int, ...] | None = None
+        self._target: numpy.ndarray = self._buffer  # view of the buffer area the frame is scaled into
+        self._scaled: numpy.ndarray = self._buffer  # the scaled frame before color conversion
+        self.scale = 1.0
+        self.offset = (0, 0)
+
+    def _layout(self, frame_shape: tuple[int, ...]) -> None:
+        height, width = frame_shape[:2]
+        self.scale = min(1.0, self._size[0] / width, self._size[1] / height)
+        target_w = max(1, round(width * self.scale))
+        target_h = max(1, round(height * self.scale))
+        self.offset = ((self._size[0] - target_w) // 2, (self._size[1] - target_h) // 2)
+        # the bars of the previous layout may be in a different place
+        self._buffer[:] = 0
+        self._target = self._buffer[
+            self.offset[1]:self.offset[1] + target_h,
+            self.offset[0]:self.offset[0] + target_w
+        ]
+        self._scaled = numpy.empty((target_h, target_w) + tuple(frame_shape[2:]), dtype=numpy.uint8)
+        self._frame_shape = frame_shape
+
+    def render(self, frame: cv2.typing.MatLike) -> numpy.ndarray:
+        """
+        Scales a BGR (or grayscale) frame into the preview buffer and converts it to RGB.
+        Points in frame coordinates map to point * scale + offset in the preview.
+
+        :returns: the RGB preview buffer, which is overwritten by the next call
+        """
+        if frame.shape != self._frame_shape:
+            self._layout(frame.shape)
+        scaled = frame
+        if self.scale != 1.0:
+            scaled = cv2.resize(frame, (self._target.shape[1], self._target.shape[0]), dst=self._scaled, interpolation=PREVIEW_INTERPOLATION)
+        cv2.cvtColor(scaled, cv2.COLOR_BGR2RGB if scaled.ndim == 3 else cv2.COLOR_GRAY2RGB, dst=self._target)
+        return self._buffer
@@ -0,0 +1,309 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+19.10.26 03:00
+
+Session recording and replay of raw camera frames.
+
+Problems that only show up with the real camera, lighting and labels can't
+be reproduced with a video file, as video compression changes the frames the
+decoders see. The recorder therefore stores every captured frame exactly as
+it was captured, with its capture time, in a memory-mapped file:
+
+    header | timestamp (float64) + frame | timestamp + frame | ...
+
+All frames of a recording have the shape of the first one. The file grows in
+chunks of RECORDING_CHUNK_FRAMES and is cut to the recorded frames when the
+recording is closed. If the app crashes, the frames written up to then can
+still be replayed. The frames are written by a thread, so a slow disk doesn't
+delay the capture. When the disk can't keep up, frames are dropped instead.
+
+ReplayCapture plays a recording back through VideoSource with the subset of
+the cv2.VideoCapture interface VideoSource uses, either at the original
+pacing or as fast as the consumer takes the frames, once or in a loop (see
+parse_replay_source()).
+"""
+
+import queue
+import re
+import struct
+import threading
+import time
+from pathlib import Path
+import cv2
+import numpy
+
+
+RECORDING_SUFFIX = ".gprec"
+RECORDING_MAGIC = b"GPREC\x00\x00\x01"
+RECORDING_CHUNK_FRAMES = 64             # frames the file is extended by when it is full
+RECORDING_MAX_BYTES = 16 * 1024 ** 3    # the recording stops when the file would get larger than this
+RECORDING_MAX_QUEUED = 30               # frames waiting to be written, more are dropped
+REPLAY_PREFIX = "replay:"               # video source "replay:<path>" plays a recording at the original pacing
+REPLAY_FAST_PREFIX = "replay-fast:"     # video source "replay-fast:<path>" plays every frame as soon as the previous one was taken
+# "-loop" before the colon (e.g. "replay-fast-loop:<path>") starts over at the end instead of stopping
+_REPLAY_SOURCE_PATTERN = re.compile(r"^replay(-fast)?(-loop)?:(.+)$")
+
+# magic, height, width, channels, frame count (0 while recording)
+_HEADER = struct.Struct("<8sIIIQ")
+_HEADER_SIZE = 64
+
+
+def _record_dtype(shape: tuple[int, ...]) -> numpy.dtype:
+    return numpy.dtype([("timestamp", "<f8"), ("image", numpy.uint8, shape)])
+
+
+def new_recording_path(directory: Path) -> Path:
+    """
+    :returns: a path for a new recording in directory named after the current time
+    """
+    return directory / f"session_{time.strftime('%Y%m%d_%H%M%S')}{RECORDING_SUFFIX}"
+
+
+def parse_replay_source(src: str) -> tuple[Path, bool, bool] | None:
+    """
+    :returns: the path of the recording, whether it should be replayed at the original pacing and whether it loops
+    :returns: None if src isn't a replay source
+    """
+    match = _REPLAY_SOURCE_PATTERN.match(src)
+    if match is None:
+        return None
+    return Path(match.group(3)), match.group(1) is None, match.group(2) is not None
+
+
+class FrameRecorder:
+    """
+    Writes frames into a recording file in a background thread. Frames are
+    queued with write(), which never blocks. The queued frames are not copied,
+    so they must not be modified afterwards (camera frames are new arrays
+    anyway).
+    """
+
+    def __init__(self, path: Path, max_bytes: int = RECORDING_MAX_BYTES, max_queued: int = RECORDING_MAX_QUEUED) -> None:
+        """
+        The file is created with the first frame.
+
+        :param max_bytes: file size after which further frames are dropped
+        :param max_queued: frames that can wait to be written, more are dropped
+        """
+        self.path = path
+        self._max_bytes = max_bytes
+        self._queue: queue.Queue[tuple[numpy.ndarray, float] | None] = queue.Queue(max_queued)
+        self._thread = threading.Thread(target=self._run, name="FrameRecorder", daemon=True)
+        self._file = None
+        self._records: numpy.memmap | None = None
+        self._shape: tuple[int, ...] | None = None
+        self._capacity = 0
+        self.frames = 0
+        self.dropped = 0    # frames not recorded because the queue was full
+        self.skipped = 0    # frames not recorded because of a different shape or the size limit
+        self._full = False
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def write(self, image: numpy.ndarray, timestamp: float) -> None:
+        """
+        Queues a frame to be recorded.
+        """
+        try:
+            self._queue.put_nowait((image, timestamp))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """
+        Writes the remaining queued frames, cuts the file to the recorded frames and writes the frame count.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._file is None:
+            return
+        # the mapping is missing if growing the file failed
+        if self._records is not None:
+            self._records.flush()
+            self._records = None
+        try:
+            self._file.truncate(_HEADER_SIZE + self.frames * _record_dtype(self._shape).itemsize)
+            self._file.seek(_HEADER.size - 8)
+            self._file.write(struct.pack("<Q", self.frames))
+        except OSError as e:
+            # the frames can still be replayed, the frame count is then found by their timestamps
+            print(f"Couldn't finish the recording {self.path}: {e}")
+        finally:
+            self._file.close()
+            self._file = None
+        print(f"Recorded {self.frames} frames to {self.path} ({self.dropped} dropped, {self.skipped} skipped)")
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self._write(*job)
+            except OSError as e:
+                print(f"Couldn't record to {self.path}, stopping the recording: {e}")
+                self._full = True
+                self.skipped += 1
+
+    def _open(self, shape: tuple[int, ...]) -> None:
+        self._shape = shape
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "w+b")
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) > 2 else 1
+        self._file.write(_HEADER.pack(RECORDING_MAGIC, height, width, channels, 0).ljust(_HEADER_SIZE, b"\x00"))
+        self._grow()
+        print(f"Recording frames of {width}x{height}x{channels} to {self.path}")
+
+    def _grow(self) -> bool:
+        """
+        Extends the file by a chunk and maps it again.
+
+        :returns: False if the file has reached the size limit
+        """
+        record_size = _record_dtype(self._shape).itemsize
+        capacity = min(self._capacity + RECORDING_CHUNK_FRAMES, (self._max_bytes - _HEADER_SIZE) // record_size)
+        if capacity <= self._capacity:
+            return False
+        # the file can't be resized while it is mapped (on Windows)
+        if self._records is not None:
+            self._records.flush()
+            self._records = None
+        self._file.truncate(_HEADER_SIZE + capacity * record_size)
+        self._capacity = capacity
+        self._records = numpy.memmap(self._file, dtype=_record_dtype(self._shape), mode="r+", offset=_HEADER_SIZE, shape=(capacity,))
+        return True
+
+    def _write(self, image: numpy.ndarray, timestamp: float) -> None:
+        if self._shape is None:
+            self._open(image.shape)
+        if image.shape != self._shape or self._full:
+            self.skipped += 1
+            return
+        if self.frames >= self._capacity and not self._grow():
+            self._full = True
+            self.skipped += 1
+            print(f"Recording {self.path} has reached its size limit, not recording further frames")
+            return
+        record = self._records[self.frames]
+        record["timestamp"] = timestamp
+        record["image"] = image
+        self.frames += 1
+
+
+class Recording:
+    """
+    Read-only access to the frames of a recording file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """
+        :raises ValueError: if the file isn't a recording
+        :raises OSError: if the file can't be read
+        """
+        with open(path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+        if len(header) < _HEADER.size:
+            raise ValueError("file too short")
+        magic, height, width, channels, count = _HEADER.unpack_from(header)
+        if magic != RECORDING_MAGIC:
+            raise ValueError("not a recording")
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        dtype = _record_dtype(self.shape)
+
+        available = (path.stat().st_size - _HEADER_SIZE) // dtype.itemsize
+        self._records = numpy.memmap(path, dtype=dtype, mode="r", offset=_HEADER_SIZE, shape=(available,)) \
+            if available > 0 else numpy.zeros(0, dtype=dtype)
+        if count == 0:
+            # not closed properly, the unused part of the last chunk has no timestamps
+            count = available
+            while count > 0 and self._records[count - 1]["timestamp"] == 0:
+                count -= 1
+        self.frame_count = min(count, available)
+        self.timestamps: numpy.ndarray = numpy.array(self._records["timestamp"][:self.frame_count])
+
+    @property
+    def fps(self) -> float:
+        if self.frame_count < 2 or self.timestamps[-1] <= self.timestamps[0]:
+            return 0.0
+        return (self.frame_count - 1) / (self.timestamps[-1] - self.timestamps[0])
+
+    def frame(self, index: int) -> numpy.ndarray:
+        """
+        :returns: a copy of the frame, like every frame read from a camera is a new array
+        """
+        return numpy.array(self._records[index]["image"])
+
+
+class ReplayCapture:
+    """
+    Plays back a recording in place of a cv2.VideoCapture.
+    """
+
+    def __init__(self, path: Path, realtime: bool, loop: bool = False) -> None:
+        """
+        :param realtime: whether read() waits until the frame is due at the original pacing
+        :param loop: start over at the end instead of stopping
+        """
+        self.realtime = realtime
+        self.loop = loop
+        self._recording: Recording | None = None
+        try:
+            self._recording = Recording(path)
+        except (OSError, ValueError) as e:
+            print(f"Couldn't open recording '{path}': {e}")
+        self._position = 0
+        self._start: float | None = None    # time.monotonic() at which the first frame was read
+
+    def isOpened(self) -> bool:
+        return self._recording is not None
+
+    @property
+    def finished(self) -> bool:
+        """
+        True once all frames of a replay that doesn't loop have been read
+        """
+        return self._recording is not None and not self.loop and self._position >= self._recording.frame_count
+
+    def read(self) -> tuple[bool, numpy.ndarray | None]:
+        """
+        :returns: False and None at the end of the recording
+        """
+        if self._recording is None or self._recording.frame_count == 0:
+            return False, None
+        if self._position >= self._recording.frame_count:
+            if not self.loop:
+                return False, None
+            self._position = 0
+            self._start = None
+        if self.realtime:
+            offset = self._recording.timestamps[self._position] - self._recording.timestamps[0]
+            if self._start is None:
+                self._start = time.monotonic()
+            delay = self._start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        image = self._recording.frame(self._position)
+        self._position += 1
+        return True, image
+
+    def get(self, prop: int) -> float:
+        if self._recording is None:
+            return 0.0
+        if prop == cv2.CAP_PROP_FPS:
+            return self._recording.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self._recording.frame_count)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._position)
+        return 0.0
+
+    def set(self, prop: int, value: float) -> bool:
+        return False
+
+    def release(self) -> None:
+        self._recording = None
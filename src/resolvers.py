@@ -0,0 +1,236 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+19.10.26 00:20
+
+Supplier resolvers.
+
+A scanned code is classified into the part queries it can answer (e.g. an
+LCSC QR label contains both the LCSC part number and the manufacturer part
+number, which can be searched at Mouser). A Resolver runs the queries for
+which a SupplierResolver is registered concurrently, each with the timeout
+of its supplier, and the first valid result wins. When a query takes longer
+than the hedge delay of its supplier, a duplicate request is started and
+whichever finishes first is used, so a single slow response doesn't hold up
+the lookup.
+"""
+
+import asyncio
+import dataclasses
+import enum
+import re
+
+from .partinfo import PartInfo
+from .ecia import parse_ecia
+from .scanner import CodeType
+from .supplier_client import Priority
+
+
+MOUSER = "mouser"
+DIGIKEY = "digikey"
+LCSC = "lcsc"
+
+DEFAULT_TIMEOUT = 15.0  # seconds
+DIGIKEY_BARCODE_MIN_LENGTH = 11     # shorter numeric barcodes are quantities or line items
+LCSC_QR_PATTERN = re.compile(rb"^\{(?:[a-z]+:[^,]*,?)+\}$")
+# Mouser part numbers are the manufacturer part number prefixed with a 2-3 digit manufacturer code, e.g. 595-TPS63020DSJR
+MOUSER_PART_NUMBER_PATTERN = re.compile(rb"^[0-9]{2,3}-[A-Za-z0-9][A-Za-z0-9.,/+#()-]*$")
+
+
+class QueryKind(enum.Enum):
+    SUPPLIER_PART_NUMBER = "spn"
+    MANUFACTURER_PART_NUMBER = "mpn"
+
+
+@dataclasses.dataclass(frozen=True)
+class PartQuery:
+    supplier: str
+    kind: QueryKind
+    part_number: bytes
+
+    @property
+    def cache_key(self) -> str:
+        part_number = self.part_number.decode(errors="replace")
+        if self.kind == QueryKind.SUPPLIER_PART_NUMBER:
+            # supplier part numbers identify the part on their own
+            return part_number
+        return f"{self.kind.value}:{self.supplier}:{part_number}"
+
+
+def parse_lcsc_qr(code_data: bytes) -> dict[str, bytes] | None:
+    """
+    Parses the QR code on LCSC bags, e.g. {pbn:PICK2205170072,on:SO2205170118,pc:C2913202,pm:TPS63020DSJR,qty:5}
+
+    :returns: the fields by name
+    :returns: None if it is not an LCSC code
+    """
+    if LCSC_QR_PATTERN.match(code_data) is None:
+        return None
+    fields: dict[str, bytes] = {}
+    for field in code_data[1:-1].split(b","):
+        name, _, value = field.partition(b":")
+        fields[name.decode()] = value
+    return fields
+
+
+def classify(code_type: CodeType, code_data: bytes) -> list[PartQuery]:
+    """
+    Determines the supplier(s) a code belongs to and what can be searched for with it.
+
+    :returns: the possible queries in order of preference, empty if the code isn't known
+    """
+    if code_type == CodeType.DATAMATRIX_2D:
+        label = parse_ecia(code_data)
+        if label is None:
+            return []
+        if label.distributor_part_number:
+            # DigiKey labels, which have the manufacturer part number in 1P
+            queries = [PartQuery(DIGIKEY, QueryKind.SUPPLIER_PART_NUMBER, label.distributor_part_number)]
+            if label.supplier_part_number:
+                queries.append(PartQuery(MOUSER, QueryKind.MANUFACTURER_PART_NUMBER, label.supplier_part_number))
+            return queries
+        if label.supplier_part_number:
+            return [PartQuery(MOUSER, QueryKind.SUPPLIER_PART_NUMBER, label.supplier_part_number)]
+        return []
+
+    if code_type == CodeType.QR_CODE:
+        fields = parse_lcsc_qr(code_data)
+        if fields is None:
+            return []
+        queries: list[PartQuery] = []
+        if fields.get("pc"):
+            queries.append(PartQuery(LCSC, QueryKind.SUPPLIER_PART_NUMBER, fields["pc"]))
+        if fields.get("pm"):
+            # the manufacturer part number can be searched at any supplier
+            queries.append(PartQuery(MOUSER, QueryKind.MANUFACTURER_PART_NUMBER, fields["pm"]))
+        return queries
+
+    if code_type == CodeType.BARCODE_128:
+        if code_data.isdigit():
+            if len(code_data) >= DIGIKEY_BARCODE_MIN_LENGTH:
+                return [PartQuery(DIGIKEY, QueryKind.SUPPLIER_PART_NUMBER, code_data)]
+            return []
+        if MOUSER_PART_NUMBER_PATTERN.match(code_data) is not None:
+            return [PartQuery(MOUSER, QueryKind.SUPPLIER_PART_NUMBER, code_data)]
+        # other barcodes on bags are PO numbers, line items, lots etc.
+        return []
+
+    return []
+
+
+class SupplierResolver:
+    """
+    Looks up parts at one supplier. Subclasses set the class attributes and implement resolve().
+    """
+    supplier: str = ""
+    timeout: float = DEFAULT_TIMEOUT
+    hedge_delay: float | None = None    # seconds after which a duplicate request is started, None to never hedge
+
+    async def resolve(self, query: PartQuery, priority: Priority) -> PartInfo | None:
+        """
+        :returns: the part info without image
+        :returns: None if the part wasn't found
+        """
+        raise NotImplementedError()
+
+    def can_hedge(self) -> bool:
+        """
+        :returns: False if a duplicate request shouldn't be sent right now, e.g. because of the rate limit
+        """
+        return True
+
+
+@dataclasses.dataclass
+class ResolverStats:
+    lookups: int = 0
+    hedges: int = 0         # duplicate requests started
+    hedge_wins: int = 0     # lookups answered by the duplicate request
+    timeouts: int = 0
+    failures: int = 0       # queries that raised an error
+
+
+class Resolver:
+    """
+    Runs the queries of a code at the registered suppliers. Must be used from within the event loop.
+    """
+
+    def __init__(self, resolvers: list[SupplierResolver]) -> None:
+        self._resolvers = {resolver.supplier: resolver for resolver in resolvers}
+        self.stats = ResolverStats()
+
+    def resolvable(self, queries: list[PartQuery]) -> list[PartQuery]:
+        """
+        :returns: the queries there is a resolver for
+        """
+        return [query for query in queries if query.supplier in self._resolvers]
+
+    async def resolve(self, queries: list[PartQuery], priority: Priority) -> tuple[PartQuery, PartInfo] | None:
+        """
+        Runs all resolvable queries concurrently, hedging slow ones.
+
+        :returns: the first query that found the part and its part info
+        :returns: None if no query found the part within the timeouts
+        """
+        self.stats.lookups += 1
+        loop = asyncio.get_running_loop()
+        running: dict[asyncio.Task, tuple[PartQuery, bool]] = {}   # task -> query, whether it is a hedge
+        hedge_at: dict[PartQuery, float] = {}
+
+        def start(query: PartQuery, hedge: bool) -> None:
+            resolver = self._resolvers[query.supplier]
+            task = asyncio.create_task(asyncio.wait_for(resolver.resolve(query, priority), resolver.timeout))
+            running[task] = (query, hedge)
+
+        for query in self.resolvable(queries):
+            start(query, False)
+            delay = self._resolvers[query.supplier].hedge_delay
+            if delay is not None:
+                hedge_at[query] = loop.time() + delay
+
+        try:
+            while running:
+                timeout = max(0.0, min(hedge_at.values()) - loop.time()) if hedge_at else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    query, hedge = running.pop(task)
+                    try:
+                        info = task.result()
+                    except asyncio.TimeoutError:
+                        self.stats.timeouts += 1
+                        print(f"Lookup of {query.part_number} at {query.supplier} timed out")
+                        continue
+                    except Exception as e:
+                        self.stats.failures += 1
+                        print(f"Lookup of {query.part_number} at {query.supplier} failed: {e!r}")
+                        continue
+                    if info is not None:
+                        if hedge:
+                            self.stats.hedge_wins += 1
+                        return query, info
+                    # the supplier answered that it doesn't have the part, asking again won't change that
+                    hedge_at.pop(query, None)
+
+                now = loop.time()
+                for query, deadline in list(hedge_at.items()):
+                    if deadline > now:
+                        continue
+                    del hedge_at[query]
+                    if any(running_query == query for running_query, _ in running.values()) \
+                            and self._resolvers[query.supplier].can_hedge():
+                        self.stats.hedges += 1
+                        start(query, True)
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+
+    def metric_values(self) -> dict[str, float]:
+        """
+        :returns: hedging and failure counters for PipelineMetrics.set_values()
+        """
+        return {
+            "lookup_hedges": self.stats.hedges,
+            "lookup_hedge_wins": self.stats.hedge_wins,
+            "lookup_timeouts": self.stats.timeouts,
+        }
@@ -13,7 +13,112 @@ from pyzbar import pyzbar
 from pylibdmtx import pylibdmtx
 import enum
 import cv2
+import collections
 import dataclasses
+import time
+import numpy
+
+
+ROI_PADDING = 0.5               # padding around the last detected code(s), relative to their size
+ROI_MOTION_GAIN = 2.0           # how many frames of the last detected movement the ROI is expanded by
+ROI_FULL_SCAN_INTERVAL = 10     # scan the entire frame at least every N frames to find new codes
+
+CANDIDATE_SEARCH_WIDTH = 480        # width of the downscaled image used to search for datamatrix candidates
+CANDIDATE_MIN_SIZE = 10             # minimum side length of candidates in the downscaled image
+CANDIDATE_MAX_ASPECT = 4.0          # rectangular datamatrices go up to 1:4 (plus some perspective)
+CANDIDATE_MIN_FILL = 0.5            # minimum fraction of the rotated bounding box covered by the blob
+CANDIDATE_MIN_L_SCORE = 0.6         # minimum solidity of the two edges forming the "L" finder pattern
+CANDIDATE_PADDING = 0.2             # padding around candidates when cropping, relative to their size
+CANDIDATE_MAX_COUNT = 4
+CANDIDATE_EXHAUSTIVE_INTERVAL = 30  # decode the entire frame every N frames in case the candidate search misses a code
+
+TUNER_MAX_LEVEL = 3             # number of steps the tuner can trade detection reliability for speed
+TUNER_SMOOTHING = 0.2           # weight of the newest frame in the moving averages
+TUNER_SETTLE_FRAMES = 5         # frames to wait after changing the level before judging it
+TUNER_RELAX_FRACTION = 0.4      # go back a level when decoding takes less than this share of the budget
+TUNER_SIZE_MEMORY = 30          # frames after which detected code sizes are forgotten
+TUNER_LOSS_WINDOW = 3           # a frame without codes up to N frames after a detection counts as lost code
+TUNER_MAX_LOSS_RATE = 0.3       # go back a level when more codes than this are lost
+TUNER_MIN_SHRUNK_EDGE = 40      # smallest code edge in pixels that still decodes reliably after shrinking
+TUNER_MIN_TIMEOUT = 10          # ms
+
+Region = tuple[int, int, int, int]  # x, y, width, height
+
+
+def _l_finder_score(binary: numpy.ndarray, box: numpy.ndarray) -> float:
+    """
+    Rates how much the edges of a rotated box look like the "L" finder pattern
+    of a datamatrix: two adjacent edges are solid, while the other two alternate
+    (clock track). Edges are sampled slightly inside the box.
+
+    :param binary: binarized image (0 = dark)
+    :param box: 4x2 corner points as returned by cv2.boxPoints
+    :returns: solidity (0-1) of the best pair of adjacent edges
+    """
+    center = box.mean(axis=0)
+    t = numpy.linspace(0.1, 0.9, 16)[None, :, None]
+    edges = box[:, None, :] + (numpy.roll(box, -1, axis=0) - box)[:, None, :] * t
+    edges += (center - edges) * 0.06
+    xs = numpy.clip(edges[..., 0].round().astype(numpy.intp), 0, binary.shape[1] - 1)
+    ys = numpy.clip(edges[..., 1].round().astype(numpy.intp), 0, binary.shape[0] - 1)
+    dark = (binary[ys, xs] == 0).mean(axis=1)   # dark fraction of each edge
+    dark_next = numpy.roll(dark, -1)
+    # codes may also be printed inverted, so solid light edges are just as good
+    return float(max(
+        numpy.minimum(dark, dark_next).max(),
+        numpy.minimum(1 - dark, 1 - dark_next).max()
+    ))
+
+
+def find_datamatrix_candidates(frame: cv2.typing.MatLike) -> list[Region]:
+    """
+    Cheaply finds regions that could contain a datamatrix, so the expensive
+    libdmtx search only has to look at those instead of the entire frame.
+
+    Works on a downscaled grayscale copy: datamatrices show up as dense areas of
+    strong gradients, which are merged into blobs and then filtered by size,
+    shape and the presence of an "L" finder pattern along their edges.
+
+    :returns: padded candidate regions in frame coordinates, most promising first
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY) if len(frame.shape) == 3 else frame
+    frame_h, frame_w = gray.shape[:2]
+    scale = min(1.0, CANDIDATE_SEARCH_WIDTH / frame_w)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, kernel)
+    _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # close the gaps between modules so every code becomes a single blob, then remove
+    # thin structures like label outlines which would otherwise enclose everything
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    scored: list[tuple[float, Region]] = []
+    for contour in contours:
+        rotated = cv2.minAreaRect(contour)
+        w, h = rotated[1]
+        if min(w, h) < CANDIDATE_MIN_SIZE or max(w, h) / min(w, h) > CANDIDATE_MAX_ASPECT:
+            continue
+        if cv2.contourArea(contour) < CANDIDATE_MIN_FILL * w * h:
+            continue
+        score = _l_finder_score(binary, cv2.boxPoints(rotated))
+        if score < CANDIDATE_MIN_L_SCORE:
+            continue
+
+        x, y, bw, bh = cv2.boundingRect(contour)
+        pad = max(bw, bh) * CANDIDATE_PADDING
+        x0 = max(0, int((x - pad) / scale))
+        y0 = max(0, int((y - pad) / scale))
+        x1 = min(frame_w, int((x + bw + pad) / scale))
+        y1 = min(frame_h, int((y + bh + pad) / scale))
+        scored.append((score, (x0, y0, x1 - x0, y1 - y0)))
+
+    scored.sort(key=lambda c: c[0], reverse=True)
+    return [region for _, region in scored[:CANDIDATE_MAX_COUNT]]
 
 class CodeType(enum.Enum):
     DATAMATRIX_2D = 1
@@ -26,65 +131,398 @@ class CodeResult:
     type: CodeType
     _bounding_points: list[tuple[int, int]] = dataclasses.field(default_factory=list)
 
-    def draw_bounds(self, image: cv2.typing.MatLike, color: tuple[int, int, int], thickness: int) -> None:
+    def draw_bounds(
+        self,
+        image: cv2.typing.MatLike,
+        color: tuple[int, int, int],
+        thickness: int,
+        scale: float = 1.0,
+        offset: tuple[int, int] = (0, 0)
+    ) -> None:
         """
         Draws the bounds of the detected code on the provided opencv buffer.
+        scale and offset map the code coordinates to the buffer, e.g. to draw
+        on a downscaled preview of the frame.
         """
         # don't draw if there is only one point, as that is "pointless"
         if len(self._bounding_points) < 2:
             return
         
-        for index, point_b in enumerate(self._bounding_points):
-            point_a = self._bounding_points[index - 1]
+        points = [
+            (round(x * scale + offset[0]), round(y * scale + offset[1]))
+            for x, y in self._bounding_points
+        ]
+        for index, point_b in enumerate(points):
+            point_a = points[index - 1]
             cv2.line(
                 image,
                 point_a, point_b,
                 color, thickness
             )
 
+    def scaled(self, factor: float) -> "CodeResult":
+        """
+        :returns: a copy with the bounds multiplied by factor, e.g. to map codes
+            found in a downscaled image back to frame coordinates
+        """
+        return CodeResult(
+            self.data,
+            self.type,
+            [(round(x * factor), round(y * factor)) for x, y in self._bounding_points]
+        )
+
+    def bounding_box(self) -> Region:
+        xs = [p[0] for p in self._bounding_points]
+        ys = [p[1] for p in self._bounding_points]
+        return (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+
+
+@dataclasses.dataclass
+class TrackingState:
+    """
+    Per-scene state of the datamatrix search (see Scanner.roi_tracking and Scanner.candidate_search).
+    """
+    roi: Region | None = None
+    last_center: tuple[float, float] | None = None
+    velocity: tuple[float, float] = (0.0, 0.0)
+    frames_since_full_scan: int = 0
+    frames_since_exhaustive_scan: int = 0
+
+
+@dataclasses.dataclass
+class DmtxParams:
+    """
+    Parameters passed to pylibdmtx.decode(), None means libdmtx default.
+    """
+    timeout: int | None = 100       # ms per frame, shared by all regions decoded in the frame
+    max_count: int | None = 2
+    threshold: int | None = 50
+    shrink: int = 1
+    min_edge: int | None = None
+    max_edge: int | None = None
+    gap_size: int | None = None
+
+
+class DecodeTuner:
+    """
+    Adapts the libdmtx parameters so datamatrix decoding stays within a
+    time budget per frame.
+
+    The timeout always follows the budget. When the average decode time
+    exceeds the budget, the tuner goes up a level: the image is shrunk
+    (as far as the smallest recently detected code allows), the edge
+    threshold is raised and the scan grid gets coarser. The sizes of
+    recently detected codes also limit min_edge/max_edge. When there is
+    plenty of time left, or when codes detected in the last frames are
+    suddenly lost, the tuner goes back down a level.
+    """
+
+    def __init__(self, budget: float, base: DmtxParams | None = None) -> None:
+        """
+        :param budget: seconds per frame that datamatrix decoding may take
+        :param base: parameters at level 0, max_count is always taken from them
+        """
+        self.budget = budget
+        self.base = base if base is not None else DmtxParams()
+        self.level = 0
+        self.frames = 0
+        self.over_budget = 0    # frames that took longer than the budget
+        self._mean_time: float | None = None
+        self._loss_rate = 0.0
+        self._frames_at_level = 0
+        self._last_hit: int | None = None
+        # (frame, smallest edge, largest edge) of recently detected codes
+        self._sizes: collections.deque[tuple[int, int, int]] = collections.deque()
+
+    @property
+    def budget_adherence(self) -> float:
+        """
+        fraction of frames decoded within the budget
+        """
+        return 1 - self.over_budget / self.frames if self.frames else 1.0
+
+    def _known_edges(self) -> tuple[int, int] | None:
+        if not self._sizes:
+            return None
+        return min(size[1] for size in self._sizes), max(size[2] for size in self._sizes)
+
+    @property
+    def params(self) -> DmtxParams:
+        """
+        parameters to decode the next frame with
+        """
+        edges = self._known_edges()
+        shrink = self.base.shrink
+        if self.level >= 1 and edges is not None:
+            shrink = max(shrink, min(self.level + 1, edges[0] // TUNER_MIN_SHRUNK_EDGE))
+        elif self.level >= 2:
+            shrink = max(shrink, 2)
+
+        params = dataclasses.replace(
+            self.base,
+            timeout=max(TUNER_MIN_TIMEOUT, int(self.budget * 1000)),
+            shrink=shrink
+        )
+        if self.level >= 1:
+            params.threshold = min(90, (self.base.threshold or 10) + 10 * self.level)
+        if edges is not None:
+            # libdmtx measures edges in the shrunk image
+            params.min_edge = max(1, edges[0] // 2 // shrink)
+            params.max_edge = edges[1] * 2 // shrink
+            if self.level >= 1:
+                # scan lines closer than the smallest code can't miss it
+                params.gap_size = max(1, params.min_edge // 3)
+        return params
+
+    def update(self, decode_time: float, codes: list[CodeResult]) -> None:
+        """
+        Adapts the parameters after decoding a frame with them.
+
+        :param decode_time: seconds it took to decode the frame
+        :param codes: datamatrices found in the frame
+        """
+        self.frames += 1
+        self._frames_at_level += 1
+        if decode_time > self.budget:
+            self.over_budget += 1
+        if self._mean_time is None:
+            self._mean_time = decode_time
+        else:
+            self._mean_time += TUNER_SMOOTHING * (decode_time - self._mean_time)
+
+        if self._last_hit is not None and self.frames - self._last_hit <= TUNER_LOSS_WINDOW:
+            self._loss_rate += TUNER_SMOOTHING * ((0.0 if codes else 1.0) - self._loss_rate)
+        if codes:
+            self._last_hit = self.frames
+            for code in codes:
+                _, _, width, height = code.bounding_box()
+                self._sizes.append((self.frames, min(width, height), max(width, height)))
+        while self._sizes and self.frames - self._sizes[0][0] > TUNER_SIZE_MEMORY:
+            self._sizes.popleft()
+
+        if self._frames_at_level < TUNER_SETTLE_FRAMES:
+            return
+        if self.level > 0 and (
+            self._loss_rate > TUNER_MAX_LOSS_RATE
+            or self._mean_time < self.budget * TUNER_RELAX_FRACTION
+        ):
+            self._set_level(self.level - 1)
+        elif self.level < TUNER_MAX_LEVEL and self._mean_time > self.budget:
+            self._set_level(self.level + 1)
+
+    def _set_level(self, level: int) -> None:
+        self.level = level
+        self._frames_at_level = 0
+        self._loss_rate = 0.0
+
+    def metric_values(self) -> dict[str, float]:
+        """
+        :returns: current parameters and budget adherence for PipelineMetrics.set_values(),
+            0 means no edge limit / libdmtx default
+        """
+        params = self.params
+        return {
+            "dmtx_budget_ms": self.budget * 1000,
+            "dmtx_mean_ms": (self._mean_time or 0.0) * 1000,
+            "dmtx_in_budget": self.budget_adherence,
+            "dmtx_level": self.level,
+            "dmtx_shrink": params.shrink,
+            "dmtx_threshold": params.threshold or 0,
+            "dmtx_min_edge": params.min_edge or 0,
+            "dmtx_max_edge": params.max_edge or 0,
+            "dmtx_gap_size": params.gap_size or 0,
+        }
+
+
+@dataclasses.dataclass
+class ScanStats:
+    """
+    Datamatrix decode statistics, which allow comparing
+    the time spent on ROI scans vs. full frame scans.
+    """
+    roi_scans: int = 0
+    roi_hits: int = 0
+    roi_time: float = 0.0
+    full_scans: int = 0
+    full_time: float = 0.0
+    candidate_regions: int = 0  # regions decoded instead of the entire frame (when candidate search is enabled)
+
+    @property
+    def mean_roi_time(self) -> float:
+        return self.roi_time / self.roi_scans if self.roi_scans else 0.0
+
+    @property
+    def mean_full_time(self) -> float:
+        return self.full_time / self.full_scans if self.full_scans else 0.0
+
 
 class Scanner:
     def __init__(self) -> None:
         self.check_datamatrix_2d = True
         self.check_barcode_128 = True
         self.check_qr_code = False
+        # when enabled, datamatrices are only searched around the previously
+        # found ones, with a full frame scan every ROI_FULL_SCAN_INTERVAL frames
+        self.roi_tracking = False
+        # when enabled, full frame scans only decode the regions returned by
+        # find_datamatrix_candidates(), except every CANDIDATE_EXHAUSTIVE_INTERVAL frames
+        self.candidate_search = False
+        self.dmtx_params = DmtxParams()
+        # when set, dmtx_params are chosen by the tuner before every frame (see set_decode_budget())
+        self.tuner: DecodeTuner | None = None
+        self.stats = ScanStats()
+        # state carried from frame to frame, can be handed to another scanner decoding the same scene
+        self.tracking = TrackingState()
+        # time.perf_counter() at which the dmtx timeout of the current frame runs out, None without timeout
+        self._deadline: float | None = None
 
-    def scan_for_codes(self, frame: cv2.typing.MatLike) -> list[CodeResult]:
+    def _decode_datamatrix(self, frame: cv2.typing.MatLike, region: Region | None = None) -> list[CodeResult]:
         """
-        detects various codes on a frame and returns a list of them
+        Decodes datamatrices in the entire frame or only in a region of it.
+        The bounds of the results are always in frame coordinates.
         """
-        results: CodeResult = []
+        x_offset, y_offset = 0, 0
+        if region is not None:
+            x_offset, y_offset, width, height = region
+            frame = frame[y_offset:y_offset + height, x_offset:x_offset + width]
+
+        params = dataclasses.asdict(self.dmtx_params)
+        if self._deadline is not None:
+            # a frame can be decoded in several regions (ROI, candidates), they only get the time left
+            remaining = int((self._deadline - time.perf_counter()) * 1000)
+            if remaining < 1:
+                return []   # a timeout of 0 would disable it
+            params["timeout"] = remaining
 
-        if self.check_datamatrix_2d:
-            # check for a data matrices
-            # https://stackoverflow.com/questions/66377973/how-to-improve-pylibdmtx-performance
-            barcodes_2d: list[pylibdmtx.Decoded] = pylibdmtx.decode(
-                frame,
-                timeout=100,
-                max_count=2,
-                threshold=50
+        # https://stackoverflow.com/questions/66377973/how-to-improve-pylibdmtx-performance
+        barcodes_2d: list[pylibdmtx.Decoded] = pylibdmtx.decode(frame, **params)
+        results: list[CodeResult] = []
+        for code in barcodes_2d:
+            # transform coordinates a bit because top is measured from bottom for some reason
+            rect = pylibdmtx.Rect(
+                left=code.rect.left + x_offset,
+                top=frame.shape[:2][0] - code.rect.top + y_offset,
+                height=code.rect.height,
+                width=code.rect.width
             )
-            if barcodes_2d:
-                #print(barcodes_2d)
-                for code in barcodes_2d:
-                    # transform coordinates a bit because top is measured from bottom for some reason
-                    rect = pylibdmtx.Rect(
-                        left=code.rect.left,
-                        top=frame.shape[:2][0] - code.rect.top,
-                        height=code.rect.height,
-                        width=code.rect.width
-                    )
-                    results.append(CodeResult(
-                        code.data,
-                        CodeType.DATAMATRIX_2D,
-                        [
-                            (rect.left, rect.top),
-                            (rect.left + rect.width, rect.top),
-                            (rect.left + rect.width, rect.top - rect.height),
-                            (rect.left, rect.top - rect.height)
-                        ]
-                    ))
-        
+            results.append(CodeResult(
+                code.data,
+                CodeType.DATAMATRIX_2D,
+                [
+                    (rect.left, rect.top),
+                    (rect.left + rect.width, rect.top),
+                    (rect.left + rect.width, rect.top - rect.height),
+                    (rect.left, rect.top - rect.height)
+                ]
+            ))
+        return results
+
+    def _update_roi(self, frame: cv2.typing.MatLike, codes: list[CodeResult]) -> None:
+        """
+        Places the ROI around the codes found in this frame, padded relative
+        to the code size and expanded by the movement since the last frame.
+        """
+        if not codes:
+            self.tracking.roi = None
+            self.tracking.last_center = None
+            self.tracking.velocity = (0.0, 0.0)
+            return
+
+        boxes = [code.bounding_box() for code in codes]
+        left = min(b[0] for b in boxes)
+        top = min(b[1] for b in boxes)
+        right = max(b[0] + b[2] for b in boxes)
+        bottom = max(b[1] + b[3] for b in boxes)
+
+        center = ((left + right) / 2, (top + bottom) / 2)
+        if self.tracking.last_center is not None:
+            self.tracking.velocity = (center[0] - self.tracking.last_center[0], center[1] - self.tracking.last_center[1])
+        self.tracking.last_center = center
+
+        pad_x = (right - left) * ROI_PADDING + abs(self.tracking.velocity[0]) * ROI_MOTION_GAIN
+        pad_y = (bottom - top) * ROI_PADDING + abs(self.tracking.velocity[1]) * ROI_MOTION_GAIN
+        frame_h, frame_w = frame.shape[:2]
+        x0 = max(0, int(left - pad_x))
+        y0 = max(0, int(top - pad_y))
+        x1 = min(frame_w, int(right + pad_x))
+        y1 = min(frame_h, int(bottom + pad_y))
+        self.tracking.roi = (x0, y0, x1 - x0, y1 - y0) if x1 > x0 and y1 > y0 else None
+
+    def _decode_full_frame(self, frame: cv2.typing.MatLike) -> list[CodeResult]:
+        if not self.candidate_search or self.tracking.frames_since_exhaustive_scan >= CANDIDATE_EXHAUSTIVE_INTERVAL:
+            self.tracking.frames_since_exhaustive_scan = 0
+            return self._decode_datamatrix(frame)
+
+        self.tracking.frames_since_exhaustive_scan += 1
+        codes: list[CodeResult] = []
+        for region in find_datamatrix_candidates(frame):
+            self.stats.candidate_regions += 1
+            for code in self._decode_datamatrix(frame, region):
+                # padded candidates can overlap, so the same code may be found twice
+                if all(code.data != found.data for found in codes):
+                    codes.append(code)
+        return codes
+
+    def _scan_datamatrix(self, frame: cv2.typing.MatLike) -> list[CodeResult]:
+        timeout = self.dmtx_params.timeout
+        self._deadline = time.perf_counter() + timeout / 1000 if timeout else None
+
+        if self.roi_tracking and self.tracking.roi is not None and self.tracking.frames_since_full_scan < ROI_FULL_SCAN_INTERVAL:
+            self.tracking.frames_since_full_scan += 1
+            start = time.perf_counter()
+            codes = self._decode_datamatrix(frame, self.tracking.roi)
+            self.stats.roi_time += time.perf_counter() - start
+            self.stats.roi_scans += 1
+            if codes:
+                self.stats.roi_hits += 1
+                self._update_roi(frame, codes)
+                return codes
+            # the code(s) moved out of the ROI or disappeared, fall back to the whole frame
+
+        self.tracking.frames_since_full_scan = 0
+        start = time.perf_counter()
+        codes = self._decode_full_frame(frame)
+        self.stats.full_time += time.perf_counter() - start
+        self.stats.full_scans += 1
+        if self.roi_tracking:
+            self._update_roi(frame, codes)
+        return codes
+
+    def set_decode_budget(self, budget: float | None) -> None:
+        """
+        Enables adaptive datamatrix parameters that keep decoding within
+        budget seconds per frame, or restores the fixed parameters with None.
+        """
+        if budget is None:
+            if self.tuner is not None:
+                self.dmtx_params = self.tuner.base
+                self.tuner = None
+        elif self.tuner is None:
+            self.tuner = DecodeTuner(budget, self.dmtx_params)
+        else:
+            self.tuner.budget = budget
+
+    def scan_datamatrix(self, frame: cv2.typing.MatLike) -> list[CodeResult]:
+        """
+        detects datamatrices on a frame if enabled
+        """
+        if not self.check_datamatrix_2d:
+            return []
+        if self.tuner is None:
+            return self._scan_datamatrix(frame)
+
+        self.dmtx_params = self.tuner.params
+        start = time.perf_counter()
+        codes = self._scan_datamatrix(frame)
+        self.tuner.update(time.perf_counter() - start, codes)
+        return codes
+
+    def scan_barcodes(self, frame: cv2.typing.MatLike) -> list[CodeResult]:
+        """
+        detects the enabled 1D barcodes and QR codes on a frame
+        """
+        results: list[CodeResult] = []
+
         if self.check_barcode_128 or self.check_qr_code:
             barcodes: list[pyzbar.Decoded] = pyzbar.decode(frame)
             if barcodes:
@@ -109,4 +547,10 @@ class Scanner:
                         [(p.x, p.y) for p in code.polygon]
                     ))
             
-        return results
\ No newline at end of file
+        return results
+
+    def scan_for_codes(self, frame: cv2.typing.MatLike) -> list[CodeResult]:
+        """
+        detects various codes on a frame and returns a list of them
+        """
+        return self.scan_datamatrix(frame) + self.scan_barcodes(frame)
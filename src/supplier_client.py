@@ -0,0 +1,267 @@
+"""
+ELEKTRON (c) 2024 - now
+Written by melektron
+www.elektron.work
+18.10.26 22:40
+
+Shared HTTP client for supplier APIs.
+
+All supplier requests go through one aiohttp session with a pooled keep-alive
+connector, so DNS, TCP and TLS setup is only paid once per host. Requests to
+a supplier API are limited by token buckets matching its per-minute and
+per-day quota, with interactive scans getting the next token before
+background refreshes. Failed requests (connection errors, timeouts, 429 and
+5xx responses) are retried with jittered exponential backoff.
+"""
+
+import asyncio
+import dataclasses
+import enum
+import heapq
+import itertools
+import json
+import random
+import time
+import typing
+import aiohttp
+
+
+REQUEST_TIMEOUT = 10        # seconds per attempt
+MAX_CONNECTIONS_PER_HOST = 4
+DNS_CACHE_TTL = 300         # seconds
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 0.5      # seconds, doubled for every retry
+RETRY_MAX_DELAY = 10.0      # seconds
+MAX_QUOTA_WAIT = 30.0       # seconds a request may wait for a token before failing with QuotaExhausted
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0     # lookups of codes that were just scanned
+    BACKGROUND = 1      # revalidation of stale cache entries
+
+
+class QuotaExhausted(Exception):
+    """
+    Raised when the rate limit of a supplier doesn't allow a request within MAX_QUOTA_WAIT.
+    """
+
+
+@dataclasses.dataclass(frozen=True)
+class RateLimit:
+    per_minute: int
+    per_day: int
+
+
+@dataclasses.dataclass
+class QuotaStats:
+    requests: int = 0           # attempts sent, including retries
+    retries: int = 0
+    throttled: int = 0          # 429 responses
+    failures: int = 0           # requests that failed after all retries
+    minute_remaining: int = 0
+    day_remaining: int = 0
+
+
+@dataclasses.dataclass
+class SupplierResponse:
+    status: int
+    body: bytes
+
+    def json(self) -> typing.Any:
+        return json.loads(self.body)
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens, which are refilled continuously over period seconds.
+    """
+
+    def __init__(self, capacity: int, period: float) -> None:
+        self.capacity = capacity
+        self._rate = capacity / period
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def wait_time(self) -> float:
+        """
+        :returns: seconds until a token is available, 0 if one is available now
+        """
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self._rate)
+
+    def take(self) -> None:
+        self._refill()
+        self._tokens -= 1
+
+    def drain(self) -> None:
+        """
+        Empties the bucket, e.g. when the server says the quota is used up.
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+
+
+class RateLimiter:
+    """
+    Per-minute and per-day token buckets of one supplier. Waiting requests
+    are served in priority order, and in order of arrival within a priority.
+    Must be used from within the event loop.
+    """
+
+    def __init__(self, limit: RateLimit) -> None:
+        self._minute = TokenBucket(limit.per_minute, 60)
+        self._day = TokenBucket(limit.per_day, 24 * 60 * 60)
+        self._waiting: list[tuple[int, int]] = []   # heap of (priority, arrival)
+        self._arrivals = itertools.count()
+        self._changed = asyncio.Condition()
+
+    def _wait_time(self) -> float:
+        return max(self._minute.wait_time(), self._day.wait_time())
+
+    async def acquire(self, priority: Priority) -> None:
+        """
+        Waits until a request may be sent and takes its token.
+
+        :raises QuotaExhausted: if no token will be available within MAX_QUOTA_WAIT
+        """
+        entry = (int(priority), next(self._arrivals))
+        heapq.heappush(self._waiting, entry)
+        try:
+            async with self._changed:
+                while True:
+                    wait: float | None = None   # not first in line, wait until the line moves
+                    if self._waiting[0] == entry:
+                        wait = self._wait_time()
+                        if wait <= 0:
+                            self._minute.take()
+                            self._day.take()
+                            return
+                        if wait > MAX_QUOTA_WAIT:
+                            raise QuotaExhausted(f"no request allowed for {wait:.0f} s")
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            async with self._changed:
+                self._changed.notify_all()
+
+    def throttled(self, retry_after: float | None) -> None:
+        """
+        Called when the server rejected a request because of its rate limit.
+        """
+        self._minute.drain()
+        if retry_after is not None and retry_after > 60:
+            # the server probably means the daily quota
+            self._day.drain()
+
+    def remaining(self) -> tuple[int, int]:
+        """
+        :returns: requests currently allowed within the minute and day limits
+        """
+        return int(self._minute.tokens), int(self._day.tokens)
+
+
+class SupplierClient:
+    """
+    HTTP client shared by all supplier lookups. Must be used from within
+    the event loop and closed with close() (or used as async context manager).
+    """
+
+    def __init__(self, limits: dict[str, RateLimit] | None = None) -> None:
+        """
+        :param limits: rate limits by supplier name, requests to other suppliers (or without supplier) aren't limited
+        """
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=MAX_CONNECTIONS_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        )
+        self._limiters = {supplier: RateLimiter(limit) for supplier, limit in (limits or {}).items()}
+        self._stats: dict[str, QuotaStats] = {supplier: QuotaStats() for supplier in self._limiters}
+
+    async def __aenter__(self) -> "SupplierClient":
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self._session.close()
+
+    def quota(self) -> dict[str, QuotaStats]:
+        """
+        :returns: request counters and remaining quota of every rate limited supplier
+        """
+        for supplier, limiter in self._limiters.items():
+            self._stats[supplier].minute_remaining, self._stats[supplier].day_remaining = limiter.remaining()
+        return {supplier: dataclasses.replace(stats) for supplier, stats in self._stats.items()}
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        supplier: str | None = None,
+        priority: Priority = Priority.INTERACTIVE,
+        **kwargs
+    ) -> SupplierResponse:
+        """
+        Sends a request, retrying connection errors, timeouts, 429 and 5xx responses.
+
+        :param supplier: name of the supplier whose rate limit applies
+        :param kwargs: passed on to aiohttp.ClientSession.request()
+        :returns: the last response, which may still be an error status
+        :raises QuotaExhausted: if the rate limit doesn't allow the request in time
+        :raises aiohttp.ClientError, asyncio.TimeoutError: if the last attempt failed
+        """
+        limiter = self._limiters.get(supplier)
+        stats = self._stats.get(supplier, QuotaStats())
+        for attempt in range(MAX_RETRIES + 1):
+            if limiter is not None:
+                await limiter.acquire(priority)
+            stats.requests += 1
+            retry_after: float | None = None
+            try:
+                async with self._session.request(method, url, **kwargs) as response:
+                    result = SupplierResponse(response.status, await response.read())
+                    if "Retry-After" in response.headers:
+                        try:
+                            retry_after = float(response.headers["Retry-After"])
+                        except ValueError:
+                            pass    # could also be an HTTP date, just use the backoff then
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == MAX_RETRIES:
+                    stats.failures += 1
+                    raise
+                print(f"Request to {supplier or url} failed ({e!r}), retrying")
+            else:
+                if result.status not in RETRY_STATUS:
+                    return result
+                if result.status == 429:
+                    stats.throttled += 1
+                    if limiter is not None:
+                        limiter.throttled(retry_after)
+                if attempt == MAX_RETRIES:
+                    stats.failures += 1
+                    return result
+                print(f"Request to {supplier or url} returned {result.status}, retrying")
+
+            stats.retries += 1
+            # full jitter, so retries of concurrent requests don't all hit the server at once
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
@@ -9,17 +9,24 @@ GetParts GUI
 
 from typing import Tuple, Any
 import customtkinter as ctk
+import tkinter
 import webbrowser
-import os
 from pathlib import Path
 import asyncio
-from PIL import Image
+import time
+import numpy
+from PIL import Image, ImageTk
 
-from .partinfo import PartInfo
+from .partinfo import PartInfo, PartImage
+from .instrumentation import PipelineMetrics
+from .image_writer import ImageWriter
+from .preview import PREVIEW_SIZE
 
 
-CAMERA_SIZE = (640, 360)
+CAMERA_SIZE = PREVIEW_SIZE  # the worker sends frames letterboxed to this size
 PART_IMAGE_SIZE = (150, 150)    # should be the native size for mouser, and also fits nicely in UI
+OVERLAY_INTERVAL = 0.5  # seconds between timing overlay updates
+IMAGE_THUMBNAIL_SIZE: tuple[int, int] | None = None   # e.g. (64, 64) to also save small JPEG copies of part images
 
 
 class InfoField:
@@ -154,7 +161,11 @@ class MainWindow(ctk.CTk):
         self.title("Mouser GetParts")
         #ctk.set_appearance_mode("light")
 
-        self._camera_label = ctk.CTkLabel(self, text="")
+        # every frame is copied into the same image, which is then pasted into the same photo image,
+        # a plain tkinter label is used because CTkLabel only supports (re-created) CTkImages
+        self._camera_image = Image.new("RGB", CAMERA_SIZE, (0, 0, 0))
+        self._camera_photo = ImageTk.PhotoImage(self._camera_image)
+        self._camera_label = tkinter.Label(self, image=self._camera_photo, borderwidth=0, background="black")
         self._camera_label.grid(
             row=0,
             column=0,
@@ -162,7 +173,6 @@ class MainWindow(ctk.CTk):
             padx=10,
             pady=10
         )
-        self.set_camera_image(Image.new("RGB", CAMERA_SIZE, (0, 0, 0)))
         
         self._part_image_label = ctk.CTkLabel(self, text="")
         self._part_image_label.grid(
@@ -207,7 +217,7 @@ class MainWindow(ctk.CTk):
 
         self._enable_barcode_128 = ctk.BooleanVar(self, False)
         self._enable_barcode_128_check = ctk.CTkCheckBox(
-            self, text="Look for 1D CODE128 barcodes (no function)",
+            self, text="Look for 1D CODE128 barcodes (Mouser part numbers)",
             onvalue=True, offvalue=False, variable=self._enable_barcode_128
         )
         self._enable_barcode_128_check.grid(
@@ -216,7 +226,7 @@ class MainWindow(ctk.CTk):
 
         self._enable_qrcode = ctk.BooleanVar(self, False)
         self._enable_qrcode_check = ctk.CTkCheckBox(
-            self, text="Look for QR Codes (no function)",
+            self, text="Look for QR Codes (LCSC labels, looked up at Mouser)",
             onvalue=True, offvalue=False, variable=self._enable_qrcode
         )
         self._enable_qrcode_check.grid(
@@ -241,15 +251,46 @@ class MainWindow(ctk.CTk):
             row=5, column=0, sticky="E", padx=10, pady=5,
         )
 
+        self._show_timings = ctk.BooleanVar(self, False)
+        self._show_timings_check = ctk.CTkCheckBox(
+            self, text="Show timing overlay",
+            onvalue=True, offvalue=False, variable=self._show_timings
+        )
+        self._show_timings_check.grid(
+            row=6, column=0, padx=10, pady=5, sticky="W"
+        )
+        self._export_timings_button = ctk.CTkButton(
+            self, text="Export timings", command=self._export_timings
+        )
+        self._export_timings_button.grid(
+            row=6, column=0, padx=10, pady=5, sticky="E"
+        )
+
+        # timing overlay in the top left corner of the camera preview
+        self._timing_overlay = ctk.CTkLabel(
+            self,
+            text="",
+            font=("Courier", 12),
+            justify="left",
+            anchor="nw",
+            fg_color="black",
+            text_color="white"
+        )
+        self._timing_overlay_updated = 0.0
+        self.metrics: PipelineMetrics | None = None
+        self._part_number: str | None = None    # supplier part number of the part that is shown
+        self._image_writer = ImageWriter(thumbnail_size=IMAGE_THUMBNAIL_SIZE)
+        self._image_writer.start()
+
         self._data_frame = ctk.CTkFrame(self, width=640)
         self._data_frame.grid(
-            row=0, rowspan=6,
+            row=0, rowspan=7,
             column=2,
             padx=10, pady=10,
             sticky="NSEW"
         )
 
-        self.rowconfigure(5, weight=1)
+        self.rowconfigure(6, weight=1)
         self.columnconfigure(0, weight=1)
 
         self._part_info_label = ctk.CTkLabel(
@@ -305,25 +346,50 @@ class MainWindow(ctk.CTk):
     def _accept_video_source(self, _) -> None:
         self._video_source_accepted = self._video_source_strvar.get()
 
+    def _update_timing_overlay(self) -> None:
+        if self.metrics is not None:
+            self.metrics.set_values(self._image_writer.metric_values())
+        if not self._show_timings.get() or self.metrics is None:
+            self._timing_overlay.place_forget()
+            return
+        now = time.monotonic()
+        if now - self._timing_overlay_updated < OVERLAY_INTERVAL:
+            return
+        self._timing_overlay_updated = now
+        self._timing_overlay.configure(text=self.metrics.overlay_text())
+        self._timing_overlay.place(in_=self._camera_label, x=5, y=5)
+
+    def _export_timings(self) -> None:
+        if self.metrics is None:
+            return
+        save_folder = self._image_save_path.get()
+        export_path = Path(save_folder or ".") / time.strftime("timings_%Y%m%d_%H%M%S.json")
+        try:
+            self.metrics.export(export_path)
+        except OSError as e:
+            print(f"Couldn't export timings to {export_path}: {e}")
+            return
+        print(f"Exported timings to: {export_path}")
+
     async def run(self) -> None:
         while not self.exited:
+            self._update_timing_overlay()
             self.update()
             await asyncio.sleep(0.02)
+        # finish writing the images that have been queued
+        self._image_writer.stop()
+        print(f"Image writer: {self._image_writer.stats}")
     
-    def set_camera_image(self, img: Image.Image) -> None:
-        # https://stackoverflow.com/a/44231728
-        # rescale image so it fits in camera preview size without distortion
-        img.thumbnail(size=CAMERA_SIZE) 
-        w, h = img.size
-        # paste it in the center of the actual preview area, leaving the rest black
-        background = Image.new("RGB", CAMERA_SIZE, "black")
-        background.paste(img, ((CAMERA_SIZE[0] - w) // 2, (CAMERA_SIZE[1] - h) // 2))
-        # convert to CTkImage to allow DPI rescaling and show on label
-        img_ctk = ctk.CTkImage(
-            light_image=background,
-            size=CAMERA_SIZE
-        )
-        self._camera_label.configure(image=img_ctk)
+    def set_camera_image(self, frame: numpy.ndarray) -> None:
+        """
+        Shows an RGB frame of CAMERA_SIZE (see PreviewRenderer) in the camera preview.
+        The frame is copied, so it can be reused afterwards.
+        """
+        if frame.shape != (CAMERA_SIZE[1], CAMERA_SIZE[0], 3):
+            print(f"Camera frame has shape {frame.shape} instead of preview size {CAMERA_SIZE}")
+            return
+        self._camera_image.frombytes(numpy.ascontiguousarray(frame))
+        self._camera_photo.paste(self._camera_image)
 
     def set_part_image(self, img: Image.Image) -> None:    
         img_ctk = ctk.CTkImage(
@@ -333,6 +399,10 @@ class MainWindow(ctk.CTk):
         self._part_image_label.configure(image=img_ctk)
     
     def set_part_info(self, info: PartInfo) -> None:
+        if info.supplier_part_number != self._part_number:
+            # the image of the new part usually follows later (see add_part_image())
+            self._part_number = info.supplier_part_number
+            self.set_part_image(Image.new("RGB", PART_IMAGE_SIZE, (0, 0, 0)))
         self._field_description.set_value(info.description)
         self._field_in_stock.set_value(info.in_stock)
         self._field_min_qty.set_value(info.min_qty)
@@ -346,10 +416,21 @@ class MainWindow(ctk.CTk):
         self._field_details_url.set_value(info.details_url)
         if info.image is not None:
             self.set_part_image(info.image)
-            save_folder = self._image_save_path.get()
-            if save_folder == "":
-                return  # user doesn't want to save images
-            save_path = os.path.join(save_folder, info.image_url.split("/")[-1])
-            print(f"Saving image to: {save_path}")
-            info.image.save(save_path)
+            self._save_part_image(info.image, info.image_url)
+
+    def add_part_image(self, part_image: PartImage) -> None:
+        """
+        Shows the image of a part delivered after its info, unless another part is shown by now.
+        """
+        if part_image.supplier_part_number != self._part_number:
+            return
+        self.set_part_image(part_image.image)
+        self._save_part_image(part_image.image, part_image.image_url, part_image.data)
+
+    def _save_part_image(self, image: Image.Image, image_url: str, data: bytes | None = None) -> None:
+        save_folder = self._image_save_path.get()
+        if save_folder == "":
+            return  # user doesn't want to save images
+        # written in the background, the folder may be on a slow network drive
+        self._image_writer.save(Path(save_folder) / image_url.split("/")[-1], image, data)
     
\ No newline at end of file
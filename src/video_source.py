@@ -9,11 +9,77 @@ Class representing a video source that can dynamically be changed
 
 import cv2
 import numpy
+import dataclasses
+import threading
+import time
+import os
+from pathlib import Path
+
+from .recording import FrameRecorder, ReplayCapture, parse_replay_source
+
+
+FIRST_FRAME_TIMEOUT = 2.0   # seconds to wait for the reader thread to deliver a frame after opening
+NEW_FRAME_TIMEOUT = 1.0     # seconds to wait for a new frame before returning the previous one again
+
+
+@dataclasses.dataclass
+class CapturedFrame:
+    image: cv2.typing.MatLike
+    timestamp: float    # time.monotonic() at which the frame was grabbed
+    sequence: int       # running frame number of the capture, -1 for placeholder frames
+
+
+@dataclasses.dataclass
+class CaptureStats:
+    captured: int = 0   # frames read from the capture
+    delivered: int = 0  # frames returned by read()
+    dropped: int = 0    # frames replaced by a newer one before anyone asked for them
+    stale: int = 0      # read() calls that returned an already delivered frame again
+
 
 class VideoSource:
-    def __init__(self) -> None:
+    def __init__(self, threaded: bool = False) -> None:
+        """
+        :param threaded: when True, a reader thread continuously grabs frames from the
+            capture and read() returns the newest one immediately instead of
+            reading (possibly old, buffered) frames synchronously.
+        """
         self._current_video_source: str = ""
-        self._cap: cv2.VideoCapture | None = None
+        self._cap: cv2.VideoCapture | ReplayCapture | None = None
+
+        self._threaded = threaded
+        self._reader_thread: threading.Thread | None = None
+        self._reader_stop = threading.Event()
+        self._reader_ended = False  # set by the reader thread when it exits, before the thread actually ends
+        self._frame_available = threading.Condition()
+        self._latest: CapturedFrame | None = None
+        self._last_delivered_sequence: int = -1
+        self._next_sequence: int = 0
+        self.stats = CaptureStats()
+        # records every captured frame while set, fed by whichever thread reads the capture
+        self._recorder: FrameRecorder | None = None
+        self._recorder_lock = threading.Lock()
+
+    def start_recording(self, path: Path) -> None:
+        """
+        Records all frames captured from now on (of any source) to a new recording file at path.
+        """
+        with self._recorder_lock:
+            if self._recorder is not None:
+                self._recorder.close()
+            self._recorder = FrameRecorder(path)
+            self._recorder.start()
+
+    def stop_recording(self) -> None:
+        with self._recorder_lock:
+            if self._recorder is not None:
+                self._recorder.close()
+                self._recorder = None
+
+    def _record(self, image: cv2.typing.MatLike, timestamp: float) -> None:
+        with self._recorder_lock:
+            if self._recorder is not None:
+                self._recorder.write(image, timestamp)
     
     def _open_source(self) -> bool:
         """
@@ -27,14 +93,18 @@ class VideoSource:
         if self._current_video_source == "":
             return False    # no source specified, don't even try to open
         
-        # differentiate between video devices and paths
+        # differentiate between video devices, recordings and paths
         source_specific: int | str = ...
+        replay = parse_replay_source(self._current_video_source)
         if self._current_video_source.isnumeric():
             source_specific = int(self._current_video_source)
         else:
             source_specific = self._current_video_source
         
-        self._cap = cv2.VideoCapture(source_specific)
+        if replay is not None:
+            self._cap = ReplayCapture(*replay)
+        else:
+            self._cap = cv2.VideoCapture(source_specific)
         if self._cap is None:
             print(f"Couldn't open video source '{self._current_video_source}': None")
             return False
@@ -44,8 +114,93 @@ class VideoSource:
             return False
         else:
             print(f"Successfully opened video source '{self._current_video_source}'")
+            if self._threaded:
+                self._start_reader()
             return True
 
+    def _start_reader(self) -> None:
+        # only keep a minimal number of frames buffered inside OpenCV, we read them as fast as they come anyway
+        self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # files would be read as fast as possible, so pace them at their native frame rate
+        frame_interval = 0.0
+        if os.path.isfile(self._current_video_source):
+            fps = self._cap.get(cv2.CAP_PROP_FPS)
+            if fps > 0:
+                frame_interval = 1 / fps
+        # recordings replayed as fast as possible must not lose frames, so every frame waits until it has been taken
+        lockstep = isinstance(self._cap, ReplayCapture) and not self._cap.realtime
+        self._reader_stop.clear()
+        self._reader_ended = False
+        self._reader_thread = threading.Thread(
+            target=self._reader_loop,
+            args=(self._cap, frame_interval, lockstep),
+            name="VideoSourceReader",
+            daemon=True
+        )
+        self._reader_thread.start()
+
+    def _reader_loop(self, cap: cv2.VideoCapture | ReplayCapture, frame_interval: float, lockstep: bool) -> None:
+        """
+        Continuously reads frames from the capture into the single frame slot
+        until stopped or the capture fails.
+
+        :param lockstep: wait for each frame to be delivered before reading the next one
+        """
+        next_deadline = time.monotonic()
+        while not self._reader_stop.is_set():
+            ok, image = cap.read()
+            timestamp = time.monotonic()
+            if not ok:
+                if self._replay_finished():
+                    print(f"Replay '{self._current_video_source}' finished")
+                else:
+                    print(f"Reading from video source '{self._current_video_source}' failed, stopping reader")
+                break
+            self._record(image, timestamp)
+
+            with self._frame_available:
+                if self._latest is not None and self._latest.sequence != self._last_delivered_sequence:
+                    self.stats.dropped += 1
+                self._latest = CapturedFrame(image, timestamp, self._next_sequence)
+                self._next_sequence += 1
+                self.stats.captured += 1
+                self._frame_available.notify_all()
+                if lockstep:
+                    self._frame_available.wait_for(
+                        lambda: self._latest.sequence == self._last_delivered_sequence or self._reader_stop.is_set()
+                    )
+
+            if frame_interval > 0:
+                next_deadline += frame_interval
+                self._reader_stop.wait(max(0.0, next_deadline - time.monotonic()))
+
+        # wake up consumers waiting for a new frame, there won't be one
+        with self._frame_available:
+            self._reader_ended = True
+            self._frame_available.notify_all()
+
+    def _reader_running(self) -> bool:
+        return self._reader_thread is not None and self._reader_thread.is_alive() and not self._reader_ended
+
+    def _replay_finished(self) -> bool:
+        return isinstance(self._cap, ReplayCapture) and self._cap.finished
+
+    def _close_capture(self) -> None:
+        """
+        Stops the reader thread (if any) and releases the capture.
+        """
+        if self._reader_thread is not None:
+            self._reader_stop.set()
+            with self._frame_available:
+                self._frame_available.notify_all()  # wakes a reader in lockstep
+            self._reader_thread.join()
+            self._reader_thread = None
+        with self._frame_available:
+            self._latest = None
+        if self._cap is not None and self._cap.isOpened():
+            self._cap.release()
+        self._cap = None
+
     def _select_source(self, src: str) -> bool:
         """
         Attempts to switch to a video source if currently a different
@@ -56,13 +211,15 @@ class VideoSource:
         """
         # if correct source is selected
         if self._current_video_source == src:
-            # if it's open and working
-            if self._cap is not None and self._cap.isOpened():
+            # if it's open and working (including the reader thread if needed)
+            if self._cap is not None and self._cap.isOpened() and (not self._threaded or self._reader_running()):
                 return True # do nothing
+            # replays end instead of starting over (unless they loop) until a different source is selected
+            if self._replay_finished():
+                return False
             # close if existing at all
             if self._cap is not None:
-                self._cap.release()
-                self._cap = None
+                self._close_capture()
             # attempt to open the source
             return self._open_source()
         
@@ -71,11 +228,10 @@ class VideoSource:
             # close capture if not already closed
             if self._cap is not None and self._cap.isOpened():
                 print("Closing previous capture...")
-                self._cap.release()
-                self._cap = None
+                self._close_capture()
             elif self._cap is not None:
                 print("Forgetting previous capture...")
-                self._cap = None
+                self._close_capture()
             # open new capture
             self._current_video_source = src
             return self._open_source()
@@ -86,35 +242,90 @@ class VideoSource:
         #    raise RuntimeError('Error starting video stream\n\n')
         ##self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)
 
-    def get_frame(self, src: str) -> cv2.typing.MatLike:
-        frame: cv2.typing.MatLike = ...
+    def _take_latest(self, wait_new: bool) -> CapturedFrame | None:
+        """
+        Returns the newest frame captured by the reader thread, waiting
+        for the first one if the source has just been opened.
+
+        :param wait_new: also wait (up to NEW_FRAME_TIMEOUT) if the newest frame has already been delivered
+        """
+        with self._frame_available:
+            if self._latest is None:
+                self._frame_available.wait_for(
+                    lambda: self._latest is not None or not self._reader_running(),
+                    timeout=FIRST_FRAME_TIMEOUT
+                )
+            elif wait_new:
+                self._frame_available.wait_for(
+                    lambda: self._latest is None
+                        or self._latest.sequence != self._last_delivered_sequence
+                        or not self._reader_running(),
+                    timeout=NEW_FRAME_TIMEOUT
+                )
+                if self._latest is not None and self._latest.sequence == self._last_delivered_sequence and not self._reader_running():
+                    # the capture has ended, there won't be a new frame
+                    return None
+            if self._latest is None:
+                return None
+            if self._latest.sequence == self._last_delivered_sequence:
+                self.stats.stale += 1
+            self._last_delivered_sequence = self._latest.sequence
+            self.stats.delivered += 1
+            self._frame_available.notify_all()
+            return self._latest
+
+    def read(self, src: str, wait_new: bool = False) -> CapturedFrame:
+        """
+        Reads a frame from the video source src, switching sources if needed.
+        In threaded mode, this returns the newest available frame without blocking,
+        unless wait_new is set, in which case it waits for a frame that hasn't been
+        returned before (for consumers that run as fast as the capture).
+        If the source cannot be read, a placeholder frame with an error message
+        is returned.
+        """
         if self._select_source(src):
-            _, frame = self._cap.read()
-        else:
-            # create blank frame
-            frame = numpy.zeros(shape=[360, 640, 3], dtype=numpy.uint8) # shape: height, width, color components
-            # draw error text on it
-            cv2.putText(
-                frame,
-                f"Cannot open video source:",
-                (20,30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                .5,
-                (0, 0, 255), # BGR
-                1,
-                cv2.LINE_AA
-            )
-            cv2.putText(
-                frame,
-                f"'{src}'",
-                (20,50),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                .5,
-                (0, 0, 255), # BGR
-                1,
-                cv2.LINE_AA
-            )
+            if self._threaded:
+                captured = self._take_latest(wait_new)
+                if captured is not None:
+                    return captured
+            else:
+                ok, image = self._cap.read()
+                if ok:
+                    self._record(image, time.monotonic())
+                    self.stats.captured += 1
+                    self.stats.delivered += 1
+                    self._next_sequence += 1
+                    return CapturedFrame(image, time.monotonic(), self._next_sequence - 1)
 
-        return frame
+        message = "Replay finished:" if self._replay_finished() else "Cannot open video source:"
+        return CapturedFrame(self._placeholder_frame(src, message), time.monotonic(), -1)
 
+    def _placeholder_frame(self, src: str, message: str) -> cv2.typing.MatLike:
+        """
+        Creates a blank frame showing a message about the source src.
+        """
+        # create blank frame
+        frame = numpy.zeros(shape=[360, 640, 3], dtype=numpy.uint8) # shape: height, width, color components
+        # draw error text on it
+        cv2.putText(
+            frame,
+            message,
+            (20,30),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            .5,
+            (0, 0, 255), # BGR
+            1,
+            cv2.LINE_AA
+        )
+        cv2.putText(
+            frame,
+            f"'{src}'",
+            (20,50),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            .5,
+            (0, 0, 255), # BGR
+            1,
+            cv2.LINE_AA
+        )
 
+        return frame